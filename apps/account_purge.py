@@ -0,0 +1,171 @@
+"""
+Background purge of deleted accounts.
+
+Deleting an account only tombstones the User row (see tombstone_user) and queues an
+AccountPurge. The purge then removes the user's rows stage by stage in small batches,
+committing after each batch and recording the stage and row count, so no single
+transaction holds locks for long and a restart simply resumes at the saved stage.
+"""
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, or_, select, update
+
+from apps.models import (
+    db, User, OTP, Message, ArchivedMessage, UserChatList, FriendRequest, Notification, AccountPurge,
+    ChatGroup, GroupMember, GroupMessage,
+)
+from apps.suggestions import invalidate_friend_graph
+from apps.changes import record_change
+from apps.http_cache import bump_version
+from apps.message_cache import message_cache
+
+logger = logging.getLogger(__name__)
+
+# How long a "not deleted" answer is trusted. tombstone_user drops its own entry, so this
+# process refuses a deleted account at once and other workers within this many seconds.
+LIVE_ACCOUNT_CACHE_SECONDS = 30
+
+# user_id -> time.monotonic() of the last check that found the account live, oldest first
+_live_accounts = OrderedDict()
+
+
+def _stages(user_id):
+    """(stage name, table, row filter, values) in purge order. values=None deletes, otherwise updates."""
+    return [
+        # Chat list first so the account disappears from friends' sidebars right away
+        ('chat_list', UserChatList.__table__,
+         or_(UserChatList.user_id == user_id, UserChatList.other_user_id == user_id), None),
+        ('friend_requests', FriendRequest.__table__,
+         or_(FriendRequest.sender_id == user_id, FriendRequest.receiver_id == user_id), None),
+        ('notifications', Notification.__table__, Notification.user_id == user_id, None),
+        # Other users keep notifications this user triggered (e.g. "X just joined"), without the actor
+        ('notification_actor', Notification.__table__, Notification.actor_id == user_id, {'actor_id': None}),
+        ('messages', Message.__table__,
+         or_(Message.sender_id == user_id, Message.receiver_id == user_id), None),
+        ('archived_messages', ArchivedMessage.__table__,
+         or_(ArchivedMessage.sender_id == user_id, ArchivedMessage.receiver_id == user_id), None),
+        ('group_members', GroupMember.__table__, GroupMember.user_id == user_id, None),
+        ('group_messages', GroupMessage.__table__, GroupMessage.sender_id == user_id, None),
+        ('group_creator', ChatGroup.__table__, ChatGroup.created_by == user_id, {'created_by': None}),
+        ('otp', OTP.__table__, OTP.user_id == user_id, None),
+    ]
+
+
+def is_deleted_account(user_id):
+    """
+    True if the account is tombstoned (or gone). Checked for every JWT and socket event, so
+    live answers are cached; deleted ones never are.
+    """
+    user_id = int(user_id)
+    now = time.monotonic()
+    checked = _live_accounts.pop(user_id, None)
+    if checked is not None and now - checked < LIVE_ACCOUNT_CACHE_SECONDS:
+        _live_accounts[user_id] = checked
+        return False
+    row = db.session.query(User.deleted_at).filter(User.id == user_id).first()
+    if row is None or row.deleted_at is not None:
+        return True
+    _live_accounts[user_id] = now
+    while now - next(iter(_live_accounts.values())) >= LIVE_ACCOUNT_CACHE_SECONDS:
+        _live_accounts.popitem(last=False)
+    return False
+
+
+def tombstone_user(user):
+    """
+    Marks the account deleted and queues its purge (caller commits).
+    Email and name are released immediately so they can be registered again.
+    """
+    user.deleted_at = datetime.utcnow()
+    user.verified = False
+    user.email = f"deleted-{user.id}@deleted.invalid"
+    user.name = f"deleted-{user.id}"
+    user.password_hash = "!"  # matches no password
+    _live_accounts.pop(user.id, None)
+    purge = AccountPurge(user_id=user.id)
+    db.session.add(purge)
+    return purge
+
+
+def purge_account(purge, batch_size=500, pause=0.05):
+    """Runs (or resumes) one purge until it is finished."""
+    stages = _stages(purge.user_id)
+    names = [name for name, *_ in stages]
+    start = names.index(purge.stage) if purge.stage in names else len(stages)
+
+    for name, table, condition, values in stages[start:]:
+        if name == 'chat_list':
+            # Friends of this user lose a mutual connection
+            invalidate_friend_graph(purge.user_id)
+        if name in ('chat_list', 'messages'):
+            message_cache.invalidate_user(purge.user_id)
+        purge.stage = name
+        db.session.commit()
+
+        while True:
+            ids = [row_id for (row_id,) in db.session.execute(
+                select(table.c.id).where(condition).limit(batch_size))]
+            if not ids:
+                break
+
+            if name == 'chat_list':
+                # Friends' clients drop the chat on their next /api/sync
+                friend_ids = [uid for (uid,) in db.session.query(UserChatList.user_id).filter(
+                    UserChatList.id.in_(ids), UserChatList.user_id != purge.user_id)]
+                record_change(friend_ids, 'chat', purge.user_id)
+                bump_version('chatlist', *friend_ids)
+
+            if values is None:
+                db.session.execute(delete(table).where(table.c.id.in_(ids)))
+            else:
+                db.session.execute(update(table).where(table.c.id.in_(ids)).values(**values))
+            purge.rows_deleted += len(ids)
+            db.session.commit()
+
+            # Give request handlers a chance to run between batches
+            time.sleep(pause)
+
+    user = db.session.get(User, purge.user_id)
+    if user:
+        db.session.delete(user)
+    purge.stage = 'done'
+    purge.finished_at = datetime.utcnow()
+    db.session.commit()
+    logger.info("account purged", extra={"user_id": purge.user_id, "rows_deleted": purge.rows_deleted})
+
+
+_purge_running = False
+
+
+def run_account_purges(app):
+    """Processes every unfinished purge. Safe to call repeatedly; only one run is active at a time."""
+    global _purge_running
+    if _purge_running:
+        return
+    _purge_running = True
+    try:
+        with app.app_context():
+            batch_size = app.config.get('ACCOUNT_PURGE_BATCH_SIZE', 500)
+            pending = AccountPurge.query.filter(AccountPurge.finished_at == None).order_by(AccountPurge.id).all()
+            for purge in pending:
+                try:
+                    purge_account(purge, batch_size=batch_size)
+                except Exception:
+                    db.session.rollback()
+                    logger.exception("account purge stopped", extra={
+                        "purge_id": purge.id, "user_id": purge.user_id, "stage": purge.stage})
+    finally:
+        _purge_running = False
+
+
+@click.command('purge-accounts')
+@with_appcontext
+def purge_accounts_command():
+    """Runs or resumes the purge of every deleted account."""
+    from flask import current_app
+    run_account_purges(current_app._get_current_object())
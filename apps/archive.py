@@ -0,0 +1,110 @@
+"""
+Hot/cold split for chat history.
+
+Recent messages live in `message`. Whole months older than MESSAGE_HOT_MONTHS are
+moved into `message_archive` in id-ordered batches (insert-select + delete in one
+transaction per batch), so history, search and delete queries on the hot table only
+pay for recent data. Readers use the helpers below to continue into the archive.
+"""
+import logging
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, delete, insert, literal, or_, select
+
+from apps.models import db, Message, ArchivedMessage
+
+logger = logging.getLogger(__name__)
+
+
+def hot_boundary(months=None, now=None):
+    """First day of the oldest month that is still kept in the hot table."""
+    if months is None:
+        months = current_app.config.get('MESSAGE_HOT_MONTHS', 6)
+    now = now or datetime.utcnow()
+    month_index = now.year * 12 + (now.month - 1) - months
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def archive_old_messages(cutoff=None, batch_size=1000):
+    """Moves messages older than `cutoff` into the archive. Returns the number of rows moved."""
+    cutoff = cutoff or hot_boundary()
+    hot = Message.__table__
+    columns = [c.name for c in hot.columns]
+    moved = 0
+
+    while True:
+        ids = [row_id for (row_id,) in db.session.query(Message.id)
+               .filter(Message.timestamp < cutoff)
+               .order_by(Message.id.asc())
+               .limit(batch_size)]
+        if not ids:
+            break
+
+        rows = select(*[hot.c[name] for name in columns], literal(datetime.utcnow())).where(hot.c.id.in_(ids))
+        db.session.execute(insert(ArchivedMessage.__table__).from_select(columns + ['archived_at'], rows))
+        db.session.execute(delete(hot).where(hot.c.id.in_(ids)))
+        db.session.commit()
+
+        moved += len(ids)
+        logger.info("archived messages", extra={"moved": moved, "cutoff": cutoff.date().isoformat()})
+
+    return moved
+
+
+def conversation_filter(model, user_id, other_user_id):
+    """Messages between the two users that `user_id` has not deleted for themselves."""
+    return or_(
+        and_(
+            model.sender_id == user_id,
+            model.receiver_id == other_user_id,
+            model.is_deleted_for_sender == False
+        ),
+        and_(
+            model.sender_id == other_user_id,
+            model.receiver_id == user_id,
+            model.is_deleted_for_recipient == False
+        )
+    )
+
+
+def conversation_page(user_id, other_user_id, offset, limit):
+    """
+    Newest-first page of a conversation spanning the hot table and the archive.
+    Every archived row is older than every hot row, so the archive simply continues
+    the hot ordering once `offset` passes the hot row count.
+    Returns (messages, total_count).
+    """
+    hot_query = (Message.query
+                 .filter(conversation_filter(Message, user_id, other_user_id))
+                 .order_by(Message.timestamp.desc()))
+    archive_query = (ArchivedMessage.query
+                     .filter(conversation_filter(ArchivedMessage, user_id, other_user_id))
+                     .order_by(ArchivedMessage.timestamp.desc()))
+
+    hot_count = hot_query.count()
+    archive_count = archive_query.count()
+
+    messages = hot_query.offset(offset).limit(limit).all() if offset < hot_count else []
+    remaining = limit - len(messages)
+    if remaining > 0 and archive_count:
+        messages += archive_query.offset(max(0, offset - hot_count)).limit(remaining).all()
+
+    return messages, hot_count + archive_count
+
+
+def find_message(message_id):
+    """Looks a message up by id in the hot table first, then in the archive."""
+    return db.session.get(Message, message_id) or db.session.get(ArchivedMessage, message_id)
+
+
+@click.command('archive-messages')
+@click.option('--months', type=int, default=None, help='Months of history to keep hot (default: MESSAGE_HOT_MONTHS).')
+@click.option('--batch-size', type=int, default=1000)
+@with_appcontext
+def archive_messages_command(months, batch_size):
+    """Moves messages older than the hot window into message_archive."""
+    moved = archive_old_messages(hot_boundary(months), batch_size=batch_size)
+    click.echo(f"Moved {moved} messages to the archive.")
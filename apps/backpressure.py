@@ -0,0 +1,144 @@
+"""
+Outbound backpressure for Socket.IO sessions.
+
+Every emit to a session is queued on its engine.io socket until the client takes it: the
+next poll for long-polling clients, the websocket writer for the rest. A stalled or
+slow mobile connection never drains that queue, so every broadcast it is part of
+(presence, typing, new-user notifications) grows server memory by one more packet.
+
+Two limits on the queued packets of a session bound it:
+- above SOCKET_QUEUE_SOFT_LIMIT, emit_event stops sending it droppable events
+  (SOCKET_DROPPABLE_EVENTS: typing and presence_update by default). Those are
+  superseded by the next one anyway, and the client resyncs presence over REST.
+- above SOCKET_QUEUE_HARD_LIMIT for SOCKET_SLOW_CONSUMER_GRACE seconds, the sweeper
+  disconnects it. The client reconnects and replays what it missed (apps.replay).
+
+The sweeper runs every SOCKET_BACKPRESSURE_INTERVAL seconds in a background task and
+publishes queue depth metrics. Either limit can be set to 0 to turn that policy off.
+"""
+import logging
+import time
+
+from apps.metrics import COUNT_BUCKETS, Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DROPPABLE_EVENTS = ('typing', 'presence_update')
+
+dropped_events = Counter('socket_events_dropped', 'Droppable events not sent to sessions over the soft queue limit.',
+                         ('event',))
+slow_consumer_disconnects = Counter('socket_slow_consumer_disconnects',
+                                    'Sessions disconnected for staying over the hard queue limit.')
+queue_depth = Histogram('socket_outbound_queue_depth', 'Queued outbound packets per session, sampled each sweep.',
+                        buckets=COUNT_BUCKETS)
+queued_packets = Gauge('socket_outbound_queued_packets', 'Outbound packets queued across all sessions.')
+deepest_queue = Gauge('socket_outbound_queue_max', 'Longest outbound queue of any session.')
+congested_sessions = Gauge('socket_congested_sessions', 'Sessions over the soft outbound queue limit.')
+
+
+class Backpressure:
+    def __init__(self):
+        self.soft_limit = 100
+        self.hard_limit = 1000
+        self.grace = 10.0
+        self.interval = 1.0
+        self.droppable = frozenset(DEFAULT_DROPPABLE_EVENTS)
+        self.server = None  # the python-socketio server, once started
+        self._over_since = {}  # sid -> time.monotonic() it was first seen over the hard limit
+        self._started = False
+
+    def configure(self, soft_limit=None, hard_limit=None, grace=None, interval=None, droppable=None):
+        if soft_limit is not None:
+            self.soft_limit = soft_limit
+        if hard_limit is not None:
+            self.hard_limit = hard_limit
+        if grace is not None:
+            self.grace = grace
+        if interval is not None:
+            self.interval = interval
+        if droppable is not None:
+            self.droppable = frozenset(droppable)
+
+    def start(self, socketio):
+        """Starts the sweeper (once) on the Socket.IO server's async mode; called on first connect."""
+        if self._started or socketio.server is None:
+            return
+        self._started = True
+        self.server = socketio.server
+        if self.soft_limit or self.hard_limit:
+            socketio.start_background_task(self._run, socketio)
+
+    def _depth(self, eio_sid):
+        socket = self.server.eio.sockets.get(eio_sid)
+        return socket.queue.qsize() if socket is not None else 0
+
+    def skip_for(self, event, room):
+        """
+        sids in `room` (None: everyone) too backed up to be sent `event`. A list, as
+        socketio's skip_sid wants; empty for events that are never dropped.
+        """
+        if not self.soft_limit or event not in self.droppable or self.server is None:
+            return []
+        skip = [sid for sid, eio_sid in self.server.manager.get_participants("/", room)
+                if self._depth(eio_sid) > self.soft_limit]
+        if skip:
+            dropped_events.labels(event).inc(len(skip))
+        return skip
+
+    def sweep(self):
+        """Samples every session's queue and disconnects the ones over the hard limit for too long."""
+        now = time.monotonic()
+        total = deepest = congested = 0
+        over_since, evict = {}, []
+        for sid, eio_sid in list(self.server.manager.get_participants("/", None)):
+            depth = self._depth(eio_sid)
+            queue_depth.observe(depth)
+            total += depth
+            deepest = max(deepest, depth)
+            if self.soft_limit and depth > self.soft_limit:
+                congested += 1
+            if self.hard_limit and depth > self.hard_limit:
+                over_since[sid] = self._over_since.get(sid, now)
+                if now - over_since[sid] >= self.grace:
+                    evict.append((sid, depth))
+        self._over_since = over_since
+        queued_packets.set(total)
+        deepest_queue.set(deepest)
+        congested_sessions.set(congested)
+
+        for sid, depth in evict:
+            self._over_since.pop(sid, None)
+            slow_consumer_disconnects.inc()
+            logger.warning("disconnecting slow consumer", extra={"sid": sid, "queued": depth})
+            self._evict(sid)
+        return len(evict)
+
+    def _evict(self, sid):
+        eio_sid = self.server.manager.eio_sid_from_sid(sid, "/")
+        # Runs the app's disconnect handler (presence, online_users) like any other disconnect
+        self.server.disconnect(sid, namespace="/")
+        # engine.io's own disconnect waits for the queue to drain, which a stalled client
+        # never does; abort the transport instead so the queued packets are freed now
+        socket = self.server.eio.sockets.pop(eio_sid, None)
+        if socket is not None:
+            socket.close(wait=False, abort=True)
+
+    def _run(self, socketio):
+        while True:
+            socketio.sleep(self.interval)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("backpressure sweep failed")
+
+
+backpressure = Backpressure()
+
+
+def init_app(app):
+    """SOCKET_QUEUE_SOFT_LIMIT, SOCKET_QUEUE_HARD_LIMIT (packets), SOCKET_SLOW_CONSUMER_GRACE, SOCKET_DROPPABLE_EVENTS."""
+    backpressure.configure(soft_limit=app.config.get('SOCKET_QUEUE_SOFT_LIMIT'),
+                           hard_limit=app.config.get('SOCKET_QUEUE_HARD_LIMIT'),
+                           grace=app.config.get('SOCKET_SLOW_CONSUMER_GRACE'),
+                           interval=app.config.get('SOCKET_BACKPRESSURE_INTERVAL'),
+                           droppable=app.config.get('SOCKET_DROPPABLE_EVENTS'))
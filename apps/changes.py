@@ -0,0 +1,81 @@
+"""
+Change log behind the delta sync endpoint (GET /api/sync?since=<token>).
+
+Writers call record_change() before committing, so a change and its log row land
+atomically. Readers page through the log by id. Ids can commit slightly out of order
+under concurrent writers, so the token handed back only advances past entries older
+than SYNC_SETTLE_SECONDS; newer entries are returned again on the next sync, and
+clients apply them idempotently.
+"""
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func
+
+from apps.models import db, ChangeLog
+
+
+def record_change(user_ids, kind, entity_id=None):
+    """Adds change rows for one or more users to the current session (the caller commits)."""
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+    db.session.add_all([
+        ChangeLog(user_id=int(user_id), kind=kind, entity_id=entity_id)
+        for user_id in user_ids if user_id is not None
+    ])
+
+
+def latest_token():
+    return db.session.query(func.max(ChangeLog.id)).scalar() or 0
+
+
+def changes_since(user_id, since, limit):
+    """
+    Returns (entries, token, has_more, reset). has_more is only set when fetching again from
+    `token` right away would return something new.
+    reset=True means `since` is older than the retained log and the client must do a full refetch.
+    """
+    oldest = db.session.query(func.min(ChangeLog.id)).scalar()
+    if since is None or (oldest is not None and since < oldest - 1):
+        # Entries after `since` may have been pruned
+        return [], latest_token(), False, True
+
+    entries = (ChangeLog.query
+               .filter(ChangeLog.user_id == user_id, ChangeLog.id > since)
+               .order_by(ChangeLog.id.asc())
+               .limit(limit + 1)
+               .all())
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    settled_before = datetime.utcnow() - timedelta(seconds=current_app.config.get('SYNC_SETTLE_SECONDS', 5))
+    token = since
+    for entry in entries:
+        if entry.created_at > settled_before:
+            # The next page would start here again; let the client wait for its next sync
+            has_more = False
+            break
+        token = entry.id
+    if not entries and not has_more:
+        # Nothing for this user: skip ahead, but not past entries that may still be committing
+        token = max(since, db.session.query(func.max(ChangeLog.id))
+                    .filter(ChangeLog.created_at <= settled_before).scalar() or 0)
+
+    return entries, token, has_more, False
+
+
+def prune_change_log(retention_days=7, batch_size=5000):
+    """Deletes change rows older than the retention window, in batches. Returns the number deleted."""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    deleted = 0
+    while True:
+        ids = [row_id for (row_id,) in db.session.query(ChangeLog.id)
+               .filter(ChangeLog.created_at < cutoff)
+               .order_by(ChangeLog.id.asc())
+               .limit(batch_size)]
+        if not ids:
+            break
+        ChangeLog.query.filter(ChangeLog.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+    return deleted
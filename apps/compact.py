@@ -0,0 +1,75 @@
+"""
+Compact socket encoding: MessagePack with short keys and epoch-millisecond timestamps.
+
+A client opts in at connect time with auth {"encoding": "msgpack"}; it then receives every
+event as one binary MessagePack frame instead of a JSON object. Keys are shortened with
+SHORT_KEYS (unknown keys pass through unchanged) and ISO timestamps under TIMESTAMP_KEYS
+become integers (ms since the epoch, UTC; naive datetimes are stored as UTC).
+
+msgpack is optional: without it connect falls back to JSON and reports
+"encoding": "json" in replay_state.
+"""
+from datetime import datetime, timezone
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+SHORT_KEYS = {
+    "id": "i",
+    "sender_id": "s",
+    "receiver_id": "r",
+    "content": "c",
+    "timestamp": "t",
+    "media_url": "mu",
+    "media_type": "mt",
+    "is_edited": "e",
+    "is_deleted_for_everyone": "d",
+    "user_id": "u",
+    "other_user_id": "ou",
+    "online": "o",
+    "last_seen": "ls",
+    "from_id": "f",
+    "to_id": "to",
+    "is_typing": "ty",
+    "pin_priority": "pp",
+    "seq": "q",
+    "type": "k",
+    "name": "n",
+}
+TIMESTAMP_KEYS = {"timestamp", "last_seen", "created_at", "edited_at"}
+
+
+def available():
+    return msgpack is not None
+
+
+def to_epoch_ms(value):
+    """ISO string (or datetime) -> int milliseconds; anything else is returned unchanged."""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp() * 1000)
+    return value
+
+
+def shorten(payload):
+    """Payload with short keys and epoch-ms timestamps, recursively."""
+    if isinstance(payload, dict):
+        return {
+            SHORT_KEYS.get(key, key): to_epoch_ms(value) if key in TIMESTAMP_KEYS else shorten(value)
+            for key, value in payload.items()
+        }
+    if isinstance(payload, (list, tuple)):
+        return [shorten(item) for item in payload]
+    return payload
+
+
+def pack(payload):
+    return msgpack.packb(shorten(payload), use_bin_type=True)
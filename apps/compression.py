@@ -0,0 +1,56 @@
+"""
+Negotiated response compression for large JSON reads (history, notifications, suggestions).
+
+The `compressed` decorator picks the best encoding the client accepts (br when the
+optional brotli package is installed, then gzip) and compresses the body when it is at
+least COMPRESS_MIN_BYTES. Small bodies are sent as is: compressing them costs more CPU
+than it saves on the wire.
+"""
+import gzip
+from functools import wraps
+
+from flask import current_app, make_response, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+
+def _encoders():
+    level = current_app.config.get('COMPRESS_LEVEL', 6)
+    quality = current_app.config.get('COMPRESS_BROTLI_QUALITY', 5)
+    encoders = {}
+    if brotli is not None:
+        encoders['br'] = lambda body: brotli.compress(body, quality=quality)
+    encoders['gzip'] = lambda body: gzip.compress(body, compresslevel=level, mtime=0)
+    return encoders
+
+
+def compress_response(response):
+    """Compresses `response` in place if the client accepts it and the body is big enough."""
+    response.vary.add('Accept-Encoding')
+    if (response.status_code != 200 or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    body = response.get_data()
+    if len(body) < current_app.config.get('COMPRESS_MIN_BYTES', 1024):
+        return response
+
+    encoders = _encoders()
+    encoding = request.accept_encodings.best_match(list(encoders))
+    if encoding is None:
+        return response
+
+    response.set_data(encoders[encoding](body))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def compressed(view):
+    """Decorator for JSON views whose responses are routinely several KB."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        return compress_response(make_response(view(*args, **kwargs)))
+    return wrapper
@@ -0,0 +1,106 @@
+"""
+Background conversion of legacy message content to the binary format.
+
+Rows written before `content_bin` existed keep base64 text in `content`. The converter
+walks `message` and `message_archive` in primary-key order, a batch per transaction,
+and moves each legacy row to `content_bin` by re-encoding its IV/ciphertext/tag
+(apps.utils.legacy_to_binary). Nothing is decrypted, so a batch is cheap and no key
+is needed beyond the one that wrote it. Progress is a JobCheckpoint per table; a
+restart resumes after the last converted id.
+
+An UPDATE only applies while the row is still legacy (content_bin IS NULL), so an edit
+landing mid-batch is never overwritten. The archiver can move a not yet converted row
+behind the cursor, so the job only finishes after a full pass that found nothing left
+to convert.
+"""
+import logging
+import time
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, select, update
+
+from apps.models import db, ArchivedMessage, JobCheckpoint, Message
+from apps.utils import legacy_to_binary
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'content_binary'
+
+
+def checkpoint(name):
+    """The JobCheckpoint called `name`, created on first use."""
+    state = JobCheckpoint.query.filter_by(name=name).first()
+    if state is None:
+        state = JobCheckpoint(name=name, last_id=0, rows_done=0)
+        db.session.add(state)
+        db.session.commit()
+    return state
+
+
+def convert_table(table, batch_size=1000, pause=0.05):
+    """Converts the legacy rows of one message table. Returns the number of rows converted."""
+    state = checkpoint(f"{JOB_NAME}:{table.name}")
+    if state.finished_at is not None:
+        return 0
+
+    convert = (update(table)
+               .where(table.c.id == bindparam('row_id'), table.c.content_bin.is_(None))
+               .values(content_bin=bindparam('converted'), content=''))
+    converted = 0
+    while state.finished_at is None:
+        started_from, pass_converted = state.last_id, 0
+        while True:
+            rows = db.session.execute(
+                select(table.c.id, table.c.content)
+                .where(table.c.id > state.last_id, table.c.content_bin.is_(None))
+                .order_by(table.c.id)
+                .limit(batch_size)).all()
+            if not rows:
+                break
+
+            params = []
+            for row_id, content in rows:
+                binary = legacy_to_binary(content)
+                if binary is None:
+                    logger.warning("unconvertible message content left as is",
+                                   extra={"table": table.name, "id": row_id})
+                else:
+                    params.append({'row_id': row_id, 'converted': binary})
+            if params:
+                db.session.execute(convert, params)
+            state.last_id = rows[-1].id
+            state.rows_done += len(params)
+            db.session.commit()
+            pass_converted += len(params)
+
+            # Give request handlers a chance to run between batches
+            time.sleep(pause)
+
+        converted += pass_converted
+        if started_from == 0 and pass_converted == 0:
+            state.finished_at = datetime.utcnow()
+        else:
+            # Check again from the first id for rows the archiver moved behind the cursor
+            state.last_id = 0
+        db.session.commit()
+
+    logger.info("message content converted", extra={
+        "table": table.name, "converted": converted, "rows_done": state.rows_done})
+    return converted
+
+
+def convert_legacy_content(batch_size=1000, pause=0.05):
+    """Converts both message tables; safe to call repeatedly."""
+    return sum(convert_table(model.__table__, batch_size, pause) for model in (Message, ArchivedMessage))
+
+
+@click.command('convert-message-content')
+@click.option('--batch-size', type=int, default=1000)
+@click.option('--pause', type=float, default=0.05, help='Seconds to sleep between batches.')
+@with_appcontext
+def convert_message_content_command(batch_size, pause):
+    """Moves legacy base64 message content to the binary column."""
+    converted = convert_legacy_content(batch_size, pause)
+    click.echo(f"Converted {converted} messages.")
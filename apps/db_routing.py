@@ -0,0 +1,108 @@
+import random
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+# Replica engines are configured as SQLALCHEMY_BINDS entries named replica_0, replica_1, ...
+REPLICA_BIND_PREFIX = "replica_"
+
+# user_id -> time.monotonic() of that user's last committed write, oldest first.
+# Reads by these users stay on the primary until replication has had time to catch up;
+# entries past the sticky window are dropped on each write, so this holds only recent writers.
+_recent_writers = OrderedDict()
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads from @read_replica endpoints to a replica bind.
+    Everything else (writes, flushes, socket handlers, jobs) uses the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context() and g.get("db_read_replica"):
+            if self._flushing or not self._is_clean():
+                # The request started writing: stay on the primary from now on
+                g.db_read_replica = False
+            else:
+                engine = _pick_replica(self._db.engines)
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def flush(self, objects=None):
+        writing = not self._is_clean()
+        super().flush(objects)
+        if writing and has_request_context() and not g.get("db_writer_noted"):
+            g.db_writer_noted = True
+            note_write(_jwt_user_id())
+
+
+def _jwt_user_id():
+    from flask_jwt_extended import get_jwt_identity
+    try:
+        return get_jwt_identity()
+    except RuntimeError:
+        # Socket handlers and public routes have no verified JWT; they call note_write() themselves
+        return None
+
+
+def _pick_replica(engines):
+    replicas = [
+        engine for key, engine in engines.items()
+        if key and key.startswith(REPLICA_BIND_PREFIX)
+    ]
+    if not replicas:
+        return None
+    return random.choice(replicas)
+
+
+def replica_binds_from_env(value):
+    """Turns a comma separated list of database URIs into SQLALCHEMY_BINDS entries."""
+    uris = [uri.strip() for uri in (value or "").split(",") if uri.strip()]
+    return {f"{REPLICA_BIND_PREFIX}{i}": uri for i, uri in enumerate(uris)}
+
+
+def note_write(*user_ids):
+    """Records that these users just wrote, so their next reads go to the primary."""
+    now = time.monotonic()
+    for user_id in user_ids:
+        if user_id is not None:
+            _recent_writers.pop(int(user_id), None)
+            _recent_writers[int(user_id)] = now
+    window = current_app.config.get("SQLALCHEMY_REPLICA_STICKY_SECONDS", 5) if has_app_context() else 5
+    while _recent_writers and now - next(iter(_recent_writers.values())) >= window:
+        _recent_writers.popitem(last=False)
+
+
+def _recently_wrote(user_id):
+    written_at = _recent_writers.get(user_id)
+    if written_at is None:
+        return False
+    window = current_app.config.get("SQLALCHEMY_REPLICA_STICKY_SECONDS", 5)
+    if time.monotonic() - written_at < window:
+        return True
+    _recent_writers.pop(user_id, None)
+    return False
+
+
+def wants_primary():
+    """Per-request override: ?consistency=strong or an X-Read-Consistency: strong header."""
+    value = request.args.get("consistency") or request.headers.get("X-Read-Consistency", "")
+    return value.lower() == "strong"
+
+
+def read_replica(view):
+    """
+    Marks a read-only endpoint as safe to serve from a replica.
+    Must be placed below @jwt_required() so the caller's identity is known.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user_id = _jwt_user_id()
+        if not wants_primary() and not (user_id and _recently_wrote(int(user_id))):
+            g.db_read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,120 @@
+"""
+Version-driven HTTP caching for polled reads (profile, chat list, presence).
+
+Writers bump per-user version counters (bump_version). A cached endpoint describes its
+inputs as a version key; the key yields a strong ETag, so an unchanged poll is answered
+with 304 Not Modified, and a bounded in-process cache keyed by (endpoint, user, version)
+serves the serialized body to clients that don't send If-None-Match.
+
+Counters live in this process (the app runs one worker, see Procfile) and restart
+from a fresh epoch, so ETags from a previous process never match. Versions come from
+one process-wide clock, and at most MAX_TRACKED_VERSIONS keys are kept. A key that was
+never bumped, or has been evicted, reports the floor: the clock value at the last
+eviction, newer than any version handed out before it, so an evicted key's old ETags
+can't match again.
+"""
+import hashlib
+import itertools
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, g, has_app_context, make_response, request
+from flask_jwt_extended import get_jwt_identity
+
+_EPOCH = uuid.uuid4().hex[:8]
+MAX_CACHED_RESPONSES = 5000
+MAX_TRACKED_VERSIONS = 200000
+
+_clock = itertools.count(1)
+_floor = 0                     # version of every key not in _versions
+_versions = OrderedDict()      # (scope, user_id) -> version, least recently used first
+_bumped_at = OrderedDict()     # (scope, user_id) -> time.monotonic() of the last bump, oldest first
+_responses = OrderedDict()  # (endpoint, user_id, versions, scope_keys) -> (body, mimetype)
+
+
+def _sticky_window():
+    return current_app.config.get('SQLALCHEMY_REPLICA_STICKY_SECONDS', 5) if has_app_context() else 5
+
+
+def bump_version(scope, *user_ids):
+    """Invalidates `scope` ('profile', 'chatlist', 'presence') for these users."""
+    global _floor
+    now = time.monotonic()
+    for user_id in user_ids:
+        if user_id is None:
+            continue
+        key = (scope, int(user_id))
+        _versions.pop(key, None)
+        _versions[key] = next(_clock)
+        _bumped_at.pop(key, None)
+        _bumped_at[key] = now
+
+    if len(_versions) > MAX_TRACKED_VERSIONS:
+        # A tenth at a time: every untracked key's ETag changes with the floor
+        for _ in range(len(_versions) - MAX_TRACKED_VERSIONS * 9 // 10):
+            _versions.popitem(last=False)
+        _floor = next(_clock)
+    # Only bumps inside the sticky window matter to _recently_bumped
+    window = _sticky_window()
+    while _bumped_at and now - next(iter(_bumped_at.values())) >= window:
+        _bumped_at.popitem(last=False)
+
+
+def version(scope, user_id):
+    return _version((scope, int(user_id)))
+
+
+def _version(key):
+    value = _versions.get(key)
+    if value is None:
+        return _floor
+    _versions.move_to_end(key)
+    return value
+
+
+def _recently_bumped(scope_keys):
+    window = _sticky_window()
+    now = time.monotonic()
+    return any(now - _bumped_at.get(key, -window) < window for key in scope_keys)
+
+
+def versioned_etag(endpoint, scopes):
+    """
+    Decorator for a GET view (below @jwt_required() / @read_replica).
+    `scopes(user_id)` returns the (scope, user_id) pairs whose versions determine the response.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user_id = int(get_jwt_identity())
+            scope_keys = tuple(scopes(user_id))
+            cache_key = (endpoint, user_id, tuple(_version(key) for key in scope_keys), scope_keys)
+            etag = hashlib.sha1(f"{_EPOCH}:{cache_key!r}".encode()).hexdigest()[:32]
+
+            if etag in request.if_none_match:
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            cached = _responses.get(cache_key)
+            if cached is not None:
+                _responses.move_to_end(cache_key)
+                response = Response(cached[0], mimetype=cached[1])
+                response.set_etag(etag)
+                return response
+
+            # A replica may not have the write behind a fresh bump yet; don't cache its answer
+            if _recently_bumped(scope_keys):
+                g.db_read_replica = False
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                _responses[cache_key] = (response.get_data(), response.mimetype)
+                while len(_responses) > MAX_CACHED_RESPONSES:
+                    _responses.popitem(last=False)
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
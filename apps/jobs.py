@@ -0,0 +1,135 @@
+import atexit
+import logging
+from datetime import datetime
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from apps.archive import archive_old_messages
+from apps.account_purge import run_account_purges
+from apps.changes import prune_change_log
+from apps.content_conversion import convert_legacy_content
+from apps.key_rotation import rotate_message_keys
+from apps.otp import sweep_expired_otps
+
+logger = logging.getLogger(__name__)
+
+
+def run_message_archival(app):
+    """Moves cold months of history out of the hot message table."""
+    with app.app_context():
+        try:
+            archive_old_messages(batch_size=app.config.get('MESSAGE_ARCHIVE_BATCH_SIZE', 1000))
+        except Exception:
+            from apps.models import db
+            db.session.rollback()
+            logger.exception("message archival failed")
+
+
+def run_change_log_pruning(app):
+    """Drops sync change log rows past the retention window; older sync tokens get a full reset."""
+    with app.app_context():
+        try:
+            prune_change_log(retention_days=app.config.get('CHANGE_LOG_RETENTION_DAYS', 7))
+        except Exception:
+            from apps.models import db
+            db.session.rollback()
+            logger.exception("change log pruning failed")
+
+
+def run_content_conversion(app):
+    """Moves legacy base64 message content to the binary column; a no-op once finished."""
+    with app.app_context():
+        try:
+            convert_legacy_content(batch_size=app.config.get('CONTENT_CONVERSION_BATCH_SIZE', 1000))
+        except Exception:
+            from apps.models import db
+            db.session.rollback()
+            logger.exception("message content conversion failed")
+
+
+def run_key_rotation(app):
+    """Re-encrypts stored messages under the current key; a no-op once done for that key."""
+    with app.app_context():
+        try:
+            rotate_message_keys(batch_size=app.config.get('KEY_ROTATION_BATCH_SIZE', 500))
+        except Exception:
+            from apps.models import db
+            db.session.rollback()
+            logger.exception("message key rotation failed")
+
+
+def run_otp_sweep(app):
+    """Deletes expired one-time codes, in the store and as `otp` rows."""
+    with app.app_context():
+        try:
+            sweep_expired_otps()
+        except Exception:
+            from apps.models import db
+            db.session.rollback()
+            logger.exception("otp sweep failed")
+
+
+def start_background_jobs(app):
+    """
+    Starts the periodic maintenance jobs for this process.
+    Only one worker should run them (BACKGROUND_JOBS_ENABLED), see Procfile.
+    """
+    scheduler = BackgroundScheduler()
+    scheduler.add_job(
+        func=run_message_archival,
+        trigger="cron",
+        hour=3,
+        args=[app],
+        id='message_archiver',
+        replace_existing=True
+    )
+    scheduler.add_job(
+        func=run_change_log_pruning,
+        trigger="cron",
+        hour=4,
+        args=[app],
+        id='change_log_pruner',
+        replace_existing=True
+    )
+    # Resumes purges interrupted by a restart, then keeps picking up new ones
+    scheduler.add_job(
+        func=run_account_purges,
+        trigger="interval",
+        minutes=10,
+        next_run_time=datetime.now(),
+        args=[app],
+        id='account_purger',
+        replace_existing=True
+    )
+    # Resumes from its checkpoint after a restart; later runs return at once when done
+    scheduler.add_job(
+        func=run_content_conversion,
+        trigger="interval",
+        minutes=30,
+        next_run_time=datetime.now(),
+        args=[app],
+        id='content_converter',
+        replace_existing=True
+    )
+    scheduler.add_job(
+        func=run_key_rotation,
+        trigger="interval",
+        minutes=30,
+        next_run_time=datetime.now(),
+        args=[app],
+        id='key_rotator',
+        replace_existing=True
+    )
+    scheduler.add_job(
+        func=run_otp_sweep,
+        trigger="interval",
+        minutes=15,
+        next_run_time=datetime.now(),
+        args=[app],
+        id='otp_sweeper',
+        replace_existing=True
+    )
+    scheduler.start()
+    atexit.register(lambda: scheduler.shutdown())
+    logger.info("background jobs started")
+    return scheduler
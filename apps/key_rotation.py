@@ -0,0 +1,125 @@
+"""
+Online re-encryption of stored messages after an encryption key rotation.
+
+Content names its key in the header (apps.utils), so old and new keys are readable side
+by side and rotation needs no downtime: add the new key to ENCRYPTION_KEYS, restart, and
+this job moves existing rows to it. It walks `message`, `message_archive` and
+`group_message` in primary-key order, a batch per transaction with a pause in between,
+and re-encrypts every row whose key isn't the current one (legacy base64 rows included;
+they come out in the binary format). Only the AES layer is redone: compressed payloads stay compressed.
+
+Progress is a JobCheckpoint per table and target key, so a restart resumes after the
+last batch and a later rotation starts over by itself. An UPDATE only applies while the
+row still holds the ciphertext that was read, so an edit landing mid-batch wins. As with
+apps.content_conversion, the job finishes after a full pass that re-encrypted nothing;
+rows that fail to authenticate are logged and left alone. Retire an old key only after
+a `flask rotate-message-keys` run has completed.
+"""
+import logging
+import time
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import and_, bindparam, null, or_, select, update
+
+from apps import utils
+from apps.content_conversion import checkpoint
+from apps.models import db, ArchivedMessage, GroupMessage, Message
+from apps.offload import run_cpu
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = 'key_rotation'
+
+
+def _reencrypt_batch(rows):
+    """[(id, old content, old content_bin, new content_bin)] for the rows that need a new key."""
+    changed = []
+    for row_id, content, content_bin in rows:
+        stored = content_bin if content_bin is not None else content
+        rotated = utils.reencrypt_message(stored)
+        if rotated is not None:
+            changed.append((row_id, content, content_bin, rotated))
+    return changed
+
+
+def rotate_table(table, batch_size=500, pause=0.1):
+    """Re-encrypts one message table under the current key. Returns the number of rows rewritten."""
+    if utils.CURRENT_KEY_ID == utils.LEGACY_KEY_ID:
+        # Nothing was ever written with another key
+        return 0
+    state = checkpoint(f"{JOB_NAME}:{utils.CURRENT_KEY_ID}:{table.name}")
+    if state.finished_at is not None:
+        return 0
+
+    if 'content' in table.c:
+        content = table.c.content
+        rewrite = (update(table)
+                   .where(table.c.id == bindparam('row_id'),
+                          or_(table.c.content_bin == bindparam('old_bin'),
+                              and_(table.c.content_bin.is_(None), table.c.content == bindparam('old_text'))))
+                   .values(content_bin=bindparam('rotated'), content=''))
+    else:
+        # Binary-only tables (group_message) never held legacy text
+        content = null().label('content')
+        rewrite = (update(table)
+                   .where(table.c.id == bindparam('row_id'), table.c.content_bin == bindparam('old_bin'))
+                   .values(content_bin=bindparam('rotated')))
+    rotated = 0
+    while state.finished_at is None:
+        started_from, pass_rotated = state.last_id, 0
+        while True:
+            rows = db.session.execute(
+                select(table.c.id, content, table.c.content_bin)
+                .where(table.c.id > state.last_id)
+                .order_by(table.c.id)
+                .limit(batch_size)).all()
+            if not rows:
+                break
+
+            # A batch is a few hundred AES-GCM calls; keep them off the eventlet hub
+            changed = run_cpu('reencrypt_batch', _reencrypt_batch, [tuple(row) for row in rows])
+            if changed:
+                db.session.execute(rewrite, [
+                    {'row_id': row_id, 'old_text': content if content_bin is None else None,
+                     'old_bin': content_bin, 'rotated': new_bin}
+                    for row_id, content, content_bin, new_bin in changed])
+            state.last_id = rows[-1].id
+            state.rows_done += len(changed)
+            db.session.commit()
+            pass_rotated += len(changed)
+
+            # Give request handlers a chance to run between batches
+            time.sleep(pause)
+
+        rotated += pass_rotated
+        if started_from == 0 and pass_rotated == 0:
+            state.finished_at = datetime.utcnow()
+        else:
+            # Check again from the first id for rows the archiver moved behind the cursor
+            state.last_id = 0
+        db.session.commit()
+
+    logger.info("message keys rotated", extra={
+        "table": table.name, "key_id": utils.CURRENT_KEY_ID, "rotated": rotated, "rows_done": state.rows_done})
+    return rotated
+
+
+def rotate_message_keys(batch_size=500, pause=0.1):
+    """
+    Re-encrypts all three message tables (message, message_archive, group_message) under
+    the current key; safe to call repeatedly.
+    """
+    return sum(rotate_table(model.__table__, batch_size, pause)
+               for model in (Message, ArchivedMessage, GroupMessage))
+
+
+@click.command('rotate-message-keys')
+@click.option('--batch-size', type=int, default=500)
+@click.option('--pause', type=float, default=0.1, help='Seconds to sleep between batches.')
+@with_appcontext
+def rotate_message_keys_command(batch_size, pause):
+    """Re-encrypts stored messages with the current ENCRYPTION_KEY_ID."""
+    rotated = rotate_message_keys(batch_size, pause)
+    click.echo(f"Re-encrypted {rotated} messages with key {utils.CURRENT_KEY_ID}.")
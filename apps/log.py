@@ -0,0 +1,152 @@
+"""
+Application logging: leveled, structured, and off the eventlet hub.
+
+Modules log through `logging.getLogger(__name__)` (all under the "apps" logger).
+configure_logging() gives that tree a QueueHandler; a QueueListener running on a real
+OS thread (not a green thread) does the formatting and the blocking write to stdout, so
+a request or socket handler only pays for merging the message arguments and a
+non-blocking queue put. When the queue is
+full the record is dropped and counted rather than stalling the caller.
+
+Structured fields go in `extra`: logger.info("message sent", extra={"user_id": 1}).
+LOG_FORMAT=json renders one JSON object per line; the default "text" is key=value.
+
+For hot events use lazy %-style arguments (no formatting happens below the level) and,
+for very frequent ones like `typing`, a SampledLogger that keeps one record in N.
+"""
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import time
+
+try:
+    from eventlet import patcher
+    _threading = patcher.original('threading')
+    _queue = patcher.original('queue')
+except ImportError:  # pragma: no cover - eventlet is always installed in production
+    import queue as _queue
+    import threading as _threading
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_listener = None
+
+
+def record_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _RESERVED}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + '.%03dZ' % record.msecs,
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class KeyValueFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record."""
+    dropped = 0
+
+    def prepare(self, record):
+        """
+        Only merges the %-arguments into the message, so later changes to them can't show up
+        in the line. The base class runs the whole formatter here, on the caller's greenlet;
+        the listener's handler does that instead. The record never leaves the process, so
+        exc_info is kept for it to format too.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except _queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+
+class ThreadQueueListener(logging.handlers.QueueListener):
+    """QueueListener whose worker is a real OS thread even under eventlet.monkey_patch()."""
+
+    def start(self):
+        self._thread = _threading.Thread(target=self._monitor, name='log-writer', daemon=True)
+        self._thread.start()
+
+
+class SampledLogger:
+    """Logs one call in `every` for a high-frequency event; the record carries sampled=<every>."""
+
+    def __init__(self, logger, every=100):
+        self.logger = logger
+        self.every = max(1, int(every))
+        self._calls = 0
+
+    def log(self, level, msg, *args, **kwargs):
+        if not self.logger.isEnabledFor(level):
+            return
+        self._calls += 1
+        if self._calls % self.every:
+            return
+        kwargs['extra'] = dict(kwargs.get('extra') or {}, sampled=self.every)
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+
+def configure_logging(level=None, fmt=None, queue_size=None):
+    """Sets up the "apps" logger once per process. Arguments default to LOG_LEVEL / LOG_FORMAT / LOG_QUEUE_SIZE."""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+    fmt = fmt or os.environ.get('LOG_FORMAT', 'text')
+    queue_size = queue_size or int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if fmt == 'json' else KeyValueFormatter())
+
+    log_queue = _queue.Queue(maxsize=queue_size)
+    _listener = ThreadQueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger('apps')
+    root.setLevel(level)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.propagate = False
+
+
+def stop_logging():
+    """Flushes queued records (atexit)."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
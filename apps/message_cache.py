@@ -0,0 +1,278 @@
+"""
+Hot-conversation cache for the first page of message history.
+
+Both participants of an active chat load get_messages(offset=0) over and over. The cache
+keeps the newest MESSAGE_CACHE_WINDOW messages of recently opened conversations, already
+decrypted and shaped as history payloads, with each participant's visible message count
+and block flags, so that first page is answered without touching the database.
+
+send_message, edit_message and delete_message update cached windows in place; block
+toggles and account purges drop what they affect. Whole conversations are evicted least
+recently used first once the estimated size passes MESSAGE_CACHE_MAX_BYTES.
+
+A window is loaded from the primary by the request that missed. Any write to the
+conversation while that request is running discards its result instead of caching a
+page that is already stale. Hits and misses are counted in message_cache_requests.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import g
+from sqlalchemy import and_, or_
+
+from apps.metrics import Counter, Gauge
+from apps.models import ArchivedMessage, Message
+from apps.offload import decrypt_many
+
+# Rough per-message overhead of the cached objects, on top of the text itself
+MESSAGE_OVERHEAD_BYTES = 400
+
+
+def message_payload(msg, content=None):
+    """
+    History entry for a message; deleted-for-everyone messages only keep a placeholder.
+    `content` is the already decrypted text, if the caller decrypted a batch.
+    """
+    if msg.is_deleted_for_everyone:
+        return {
+            'id': msg.id,
+            'sender_id': msg.sender_id,
+            'is_deleted_for_everyone': True,
+            'content': 'This message was deleted.',
+            'timestamp': msg.timestamp.isoformat(),
+        }
+    return msg.to_dict(content)
+
+
+def _key(a, b):
+    a, b = int(a), int(b)
+    return (a, b) if a < b else (b, a)
+
+
+def _hidden_for(msg):
+    """Participants who deleted the message for themselves."""
+    hidden = set()
+    if msg.is_deleted_for_sender:
+        hidden.add(msg.sender_id)
+    if msg.is_deleted_for_recipient:
+        hidden.add(msg.receiver_id)
+    return hidden
+
+
+class _CachedMessage:
+    __slots__ = ('id', 'hidden_for', 'payload', 'size')
+
+    def __init__(self, msg, content):
+        self.id = msg.id
+        self.hidden_for = _hidden_for(msg)
+        self.payload = message_payload(msg, content)
+        self.size = MESSAGE_OVERHEAD_BYTES + len(self.payload.get('content') or '') + len(msg.media_url or '')
+
+
+class _Conversation:
+    __slots__ = ('messages', 'complete', 'totals', 'blocked', 'size')
+
+    def __init__(self, messages, complete):
+        self.messages = messages  # newest first
+        self.complete = complete  # the window holds the whole conversation
+        self.totals = {}          # user_id -> messages that user can see (get_messages' total_count)
+        self.blocked = {}         # user_id -> whether that user blocked the other one
+        self.size = sum(m.size for m in messages)
+
+
+class MessageCache:
+    def __init__(self, window=50, max_bytes=32 * 1024 * 1024):
+        self.enabled = True
+        self.window = window
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._conversations = OrderedDict()  # (low id, high id) -> _Conversation
+        self._writes = {}  # key -> [requests loading it, writes seen while they run]
+
+    def configure(self, enabled=True, window=None, max_bytes=None):
+        self.enabled = enabled
+        self.window = window or self.window
+        self.max_bytes = max_bytes or self.max_bytes
+        self.clear()
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def clear(self):
+        self._conversations.clear()
+        self.size = 0
+
+    # ---- reads ---------------------------------------------------------------------
+
+    def page(self, viewer_id, other_id, limit):
+        """
+        (newest-first payloads, total_count, blocked_by_me, blocked_by_them) for the first
+        page of the conversation as `viewer_id` sees it, or None if it can't be served.
+        """
+        if not self.enabled:
+            return None
+        viewer_id, other_id = int(viewer_id), int(other_id)
+        key = _key(viewer_id, other_id)
+        conv = self._conversations.get(key)
+        if conv is None or viewer_id not in conv.totals:
+            cache_misses.inc()
+            return None
+        visible = [m.payload for m in conv.messages if viewer_id not in m.hidden_for][:limit]
+        if len(visible) < limit and not conv.complete:
+            cache_misses.inc()
+            return None
+        self._conversations.move_to_end(key)
+        cache_hits.inc()
+        return visible, conv.totals[viewer_id], conv.blocked[viewer_id], conv.blocked[other_id]
+
+    @contextmanager
+    def loading(self, viewer_id, other_id):
+        """
+        Wraps the reads of a request that missed; yields the token for load(), or None if
+        the cache is off. The request's reads go to the primary so a lagging replica can't
+        seed the cache. Leaving the block, even by an exception, ends the load.
+        """
+        if not self.enabled:
+            yield None
+            return
+        g.db_read_replica = False
+        key = _key(viewer_id, other_id)
+        pending = self._writes.setdefault(key, [0, 0])
+        pending[0] += 1
+        try:
+            yield pending[1]
+        finally:
+            pending[0] -= 1
+            if not pending[0]:
+                del self._writes[key]
+
+    def load(self, token, viewer_id, other_id, total_count, blocked_by_me, blocked_by_them):
+        """
+        Caches the conversation (and the counts the request computed) unless it was written
+        to meanwhile. Called inside the loading() block that gave `token`.
+        """
+        if token is None:
+            return
+        viewer_id, other_id = int(viewer_id), int(other_id)
+        key = _key(viewer_id, other_id)
+        conv = self._conversations.get(key)
+        if self._writes[key][1] != token:
+            return
+        if conv is None:
+            conv = self._fetch(key)
+            if self._writes[key][1] != token:
+                return
+
+        conv.totals[viewer_id] = total_count
+        conv.blocked[viewer_id] = bool(blocked_by_me)
+        conv.blocked[other_id] = bool(blocked_by_them)
+        if key in self._conversations:
+            self._conversations.move_to_end(key)
+        else:
+            self._conversations[key] = conv
+            self.size += conv.size
+            self._evict()
+
+    def _fetch(self, key):
+        a, b = key
+        rows = []
+        # Hot table first; the archive continues it once the hot rows run out
+        for model in (Message, ArchivedMessage):
+            rows += (model.query
+                     .filter(or_(and_(model.sender_id == a, model.receiver_id == b),
+                                 and_(model.sender_id == b, model.receiver_id == a)))
+                     .order_by(model.timestamp.desc())
+                     .limit(self.window - len(rows))
+                     .all())
+            if len(rows) >= self.window:
+                break
+        contents = decrypt_many('' if msg.is_deleted_for_everyone else msg.ciphertext for msg in rows)
+        return _Conversation([_CachedMessage(msg, content) for msg, content in zip(rows, contents)],
+                             complete=len(rows) < self.window)
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._conversations:
+            _, conv = self._conversations.popitem(last=False)
+            self.size -= conv.size
+
+    # ---- writes --------------------------------------------------------------------
+
+    def _written(self, key):
+        pending = self._writes.get(key)
+        if pending is not None:
+            pending[1] += 1
+        return self._conversations.get(key)
+
+    def add(self, msg, content):
+        """A new message (send_message, after commit); `content` is its plaintext."""
+        conv = self._written(_key(msg.sender_id, msg.receiver_id))
+        if conv is None:
+            return
+        cached = _CachedMessage(msg, content)
+        conv.messages.insert(0, cached)
+        conv.size += cached.size
+        self.size += cached.size
+        for user_id in conv.totals:
+            conv.totals[user_id] += 1
+        while len(conv.messages) > self.window:
+            dropped = conv.messages.pop()
+            conv.size -= dropped.size
+            self.size -= dropped.size
+            conv.complete = False
+        self._evict()
+
+    def update(self, msg, content=None):
+        """An edited or deleted message, after commit. `content`: the new plaintext, if edited."""
+        key = _key(msg.sender_id, msg.receiver_id)
+        conv = self._written(key)
+        if conv is None:
+            return
+        for index, cached in enumerate(conv.messages):
+            if cached.id == msg.id:
+                break
+        else:
+            # Outside the window: a delete-for-me still changes that user's count
+            for user_id in _hidden_for(msg):
+                conv.totals.pop(user_id, None)
+            return
+
+        for user_id in _hidden_for(msg) - cached.hidden_for:
+            if user_id in conv.totals:
+                conv.totals[user_id] -= 1
+        if content is None:
+            content = cached.payload.get('content', '')
+        updated = conv.messages[index] = _CachedMessage(msg, content)
+        conv.size += updated.size - cached.size
+        self.size += updated.size - cached.size
+
+    def set_blocked(self, blocker_id, other_id, blocked):
+        conv = self._written(_key(blocker_id, other_id))
+        if conv is not None:
+            conv.blocked[int(blocker_id)] = bool(blocked)
+
+    def invalidate_user(self, user_id):
+        """Drops every cached conversation of `user_id` (account purge)."""
+        user_id = int(user_id)
+        for key in {key for key in list(self._conversations) + list(self._writes) if user_id in key}:
+            conv = self._written(key)
+            if conv is not None:
+                del self._conversations[key]
+                self.size -= conv.size
+
+
+message_cache = MessageCache()
+
+_requests = Counter('message_cache_requests', 'First-page history reads by hot-conversation cache result.',
+                    ('result',))
+cache_hits = _requests.labels('hit')
+cache_misses = _requests.labels('miss')
+Gauge('message_cache_bytes', 'Estimated size of the hot-conversation cache.', function=lambda: message_cache.size)
+Gauge('message_cache_conversations', 'Conversations held by the hot-conversation cache.',
+      function=lambda: len(message_cache))
+
+
+def init_app(app):
+    """MESSAGE_CACHE_ENABLED, MESSAGE_CACHE_WINDOW (messages per conversation), MESSAGE_CACHE_MAX_BYTES."""
+    message_cache.configure(enabled=app.config.get('MESSAGE_CACHE_ENABLED', True),
+                            window=app.config.get('MESSAGE_CACHE_WINDOW'),
+                            max_bytes=app.config.get('MESSAGE_CACHE_MAX_BYTES'))
@@ -0,0 +1,302 @@
+"""
+In-process metrics in the Prometheus text format, served on GET /metrics.
+
+Counter, Gauge and Histogram follow the prometheus_client API closely enough for the
+uses here (`.labels(...)`, `.inc()`, `.observe()`, `.set()`) without the dependency.
+Recording is a dict lookup plus an add (and a bisect for histograms), so it is cheap
+enough for every request, socket event, query and decrypt. Values are per process,
+which is the whole app since it runs a single worker (see Procfile).
+
+/metrics answers only requests carrying `Authorization: Bearer <METRICS_TOKEN>`. Without a
+token it is a 404, unless METRICS_PUBLIC=True opens it to anyone for local development.
+"""
+import hmac
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import Response, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from apps import profiler
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+CRYPTO_BUCKETS = (.00001, .000025, .00005, .0001, .00025, .0005, .001, .005, .01)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100, 250, 1000)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    inner = ','.join('%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+                     for k, v in pairs)
+    return '{' + inner + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        _registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """Yields (suffix, label values, extra label pairs, value)."""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, values, extra)} {value}")
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield '_total', values, (), child.value
+
+
+class Gauge(_Metric):
+    """A settable value, or one read from `function()` at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def _samples(self):
+        if self.function is not None:
+            yield '', (), (), self.function()
+            return
+        for values, child in list(self._children.items()):
+            yield '', values, (), child.value
+
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                yield '_bucket', values, (('le', '+Inf' if bound == float('inf') else repr(bound)),), cumulative
+            yield '_sum', values, (), child.sum
+            yield '_count', values, (), cumulative
+
+
+def render_all():
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+# ---- Application metrics -------------------------------------------------------------
+
+http_requests = Counter('http_requests', 'HTTP requests by route, method and status.',
+                        ('route', 'method', 'status'))
+http_latency = Histogram('http_request_duration_seconds', 'HTTP request latency by route.',
+                         ('route', 'method'))
+http_queries = Histogram('http_request_db_queries', 'DB queries issued per HTTP request.',
+                         ('route',), buckets=COUNT_BUCKETS)
+socket_events = Counter('socket_events', 'Socket.IO events handled, by event and outcome.',
+                        ('event', 'outcome'))
+socket_latency = Histogram('socket_event_duration_seconds', 'Socket.IO handler latency by event.',
+                           ('event',))
+socket_queries = Histogram('socket_event_db_queries', 'DB queries issued per socket event.',
+                           ('event',), buckets=COUNT_BUCKETS)
+emit_fanout = Histogram('socket_emit_recipients', 'Connected recipients per server emit, by event.',
+                        ('event',), buckets=COUNT_BUCKETS)
+db_queries = Counter('db_queries', 'SQL statements executed (all engines).')
+crypto_latency = Histogram('message_crypto_duration_seconds', 'Message encryption/decryption time.',
+                           ('operation',), buckets=CRYPTO_BUCKETS)
+cpu_offload_latency = Histogram('cpu_offload_duration_seconds',
+                                'Hand-off to result for work run on the native thread pool, queueing included.',
+                                ('operation',))
+cpu_offload_inflight = Gauge('cpu_offload_inflight', 'Calls waiting on or running in the native thread pool.')
+
+# Queries issued by the current request or socket event; a ContextVar so nested
+# app contexts (the socket handlers open their own) still count toward it
+_query_count = ContextVar('query_count', default=None)
+_db_queries_total = db_queries.labels()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    _db_queries_total.inc()
+    box = _query_count.get()
+    if box is not None:
+        box[0] += 1
+
+
+def timed_crypto(operation):
+    """Decorator for encrypt/decrypt functions."""
+    child = crypto_latency.labels(operation)
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def timed_event(event_name):
+    """Decorator for Socket.IO handlers (below @socketio.on)."""
+    latency = socket_latency.labels(event_name)
+    queries = socket_queries.labels(event_name)
+
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(*args, **kwargs):
+            box = [0]
+            token = _query_count.set(box)
+            start = time.perf_counter()
+            outcome = 'ok'
+            try:
+                with profiler.scope(f"socket {event_name}"):
+                    result = handler(*args, **kwargs)
+                if result is False:
+                    outcome = 'rejected'  # e.g. a refused connect
+                return result
+            except Exception:
+                outcome = 'error'
+                raise
+            finally:
+                latency.observe(time.perf_counter() - start)
+                queries.observe(box[0])
+                socket_events.labels(event_name, outcome).inc()
+                _query_count.reset(token)
+        return wrapper
+    return decorator
+
+
+def _route_label():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'  # raw paths would explode the label set
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_queries = [0]
+    _query_count.set(g.metrics_queries)
+
+
+def _after_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    route = _route_label()
+    http_latency.labels(route, request.method).observe(time.perf_counter() - start)
+    http_requests.labels(route, request.method, str(response.status_code)).inc()
+    http_queries.labels(route).observe(g.metrics_queries[0])
+    _query_count.set(None)
+    return response
+
+
+def exposed():
+    """The scrape endpoints exist only with a METRICS_TOKEN, or with METRICS_PUBLIC for local runs."""
+    return bool(current_app.config.get('METRICS_TOKEN') or current_app.config.get('METRICS_PUBLIC'))
+
+
+def authorized():
+    """True if the request carries METRICS_TOKEN as a bearer token, or no token is needed (METRICS_PUBLIC)."""
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        return bool(current_app.config.get('METRICS_PUBLIC'))
+    supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    # As bytes: compare_digest refuses non-ASCII str, which would be a 500 instead of a 401
+    return hmac.compare_digest(supplied.encode(), token.encode())
+
+
+def metrics_view():
+    if not exposed():
+        return Response('Not Found\n', status=404, mimetype='text/plain')
+    if not authorized():
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_all(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
@@ -1,20 +1,29 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash # Keep imports clean
+from apps.offload import hash_password, verify_password  # hashed off the eventlet hub
 from apps.utils import decrypt_message
 from zoneinfo import ZoneInfo
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, validates
+from apps.db_routing import RoutingSession
 
-db = SQLAlchemy()
+# RoutingSession sends @read_replica endpoints to the replica binds (if any are configured)
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 ist_now = lambda: datetime.now(ZoneInfo("Asia/Kolkata")).replace(tzinfo=None)
 
+
+def normalize_name(name):
+    """Search key for usernames. Must match LOWER(name) used to backfill existing rows."""
+    return name.lower() if name is not None else None
+
 # Models
 # ==============================================================================
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(150), unique=True, nullable=False)
     name = db.Column(db.String(120), unique=True, nullable=False)   # add unique=True
+    # Lower-cased copy of `name` for index-backed prefix search (kept in sync by _sync_name_normalized)
+    name_normalized = db.Column(db.String(120), nullable=True, index=True)
     password_hash = db.Column(db.String(200), nullable=False)
     verified = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -26,14 +35,21 @@ class User(db.Model):
     birthday = db.Column(db.Date, nullable=True)
     
     last_seen = db.Column(db.DateTime, nullable=True)
+    # Set when the account is deleted; its rows are then purged in the background (apps.account_purge)
+    deleted_at = db.Column(db.DateTime, nullable=True)
 
 
         
+    @validates('name')
+    def _sync_name_normalized(self, key, name):
+        self.name_normalized = normalize_name(name)
+        return name
+
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
 
     def to_dict(self):
         return {
@@ -53,12 +69,23 @@ class OTP(db.Model):
     code = db.Column(db.String(6), nullable=False)  # store plain for simplicity
     # expires_at = db.Column(db.DateTime, nullable=False)
     expires_at = db.Column(db.DateTime, default=ist_now)
+    # Rows are only written with OTP_STORAGE_URL=database (apps/otp.py); null on older rows
+    purpose = db.Column(db.String(20), nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
-class Message(db.Model):
+    __table_args__ = (
+        db.Index('ix_otp_user_id', 'user_id'),
+    )
+
+class MessageMixin:
+    """Columns and serialization shared by the hot `message` table and `message_archive`."""
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
-    content = db.Column(db.String(512), nullable=False)
+    # Legacy base64 ciphertext; empty once the row stores content_bin (see apps.content_conversion)
+    content = db.Column(db.String(512), nullable=False, default='')
+    # Binary ciphertext with a version/flags/key id header (apps.utils.encrypt_message)
+    content_bin = db.Column(db.LargeBinary, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     
     # === NEW COLUMNS FOR EDIT/DELETE ===
@@ -73,11 +100,14 @@ class Message(db.Model):
     media_url = db.Column(db.String(512), nullable=True) # URL from Cloudinary
     media_type = db.Column(db.String(50), nullable=True) # e.g., 'image', 'video', 'pdf', 'raw'
     
-    sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_messages')
-    receiver = db.relationship('User', foreign_keys=[receiver_id], backref='received_messages')
-    
-    def to_dict(self):
-        decrypted_content = decrypt_message(self.content)
+    @property
+    def ciphertext(self):
+        """The stored encrypted content, binary or (not yet converted) legacy text."""
+        return self.content_bin if self.content_bin is not None else self.content
+
+    def to_dict(self, content=None):
+        """`content`: the plaintext, when the caller already decrypted it (see offload.decrypt_many)."""
+        decrypted_content = decrypt_message(self.ciphertext) if content is None else content
         return {
             'id': self.id,
             'sender_id': self.sender_id,
@@ -93,6 +123,25 @@ class Message(db.Model):
             # as the server's message fetching logic must use them to filter messages.
         }
 
+
+class Message(MessageMixin, db.Model):
+    sender = db.relationship('User', foreign_keys='Message.sender_id', backref='sent_messages')
+    receiver = db.relationship('User', foreign_keys='Message.receiver_id', backref='received_messages')
+
+
+class ArchivedMessage(MessageMixin, db.Model):
+    """
+    Cold history: messages older than MESSAGE_HOT_MONTHS are moved here in batches by
+    apps.archive, keeping their original ids. Reads continue here past the hot boundary.
+    """
+    __tablename__ = 'message_archive'
+    __table_args__ = (
+        db.Index('ix_message_archive_pair_ts', 'sender_id', 'receiver_id', 'timestamp'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    archived_at = db.Column(db.DateTime, nullable=True)
+
     # New requirement: Model for storing which users a user has 'added' to their chat list
 class UserChatList(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -120,6 +169,8 @@ class FriendRequest(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('sender_id', 'receiver_id', name='_unique_friend_request'),
+        # Lookups by receiver ("requests sent to me") can't use the sender-first unique index
+        db.Index('ix_friend_request_receiver_sender', 'receiver_id', 'sender_id'),
     )
 
     def to_dict(self):
@@ -171,4 +222,130 @@ class Notification(db.Model):
             'actor_name': self.actor.name if self.actor else None,
             'request_id': self.request_id,
             'timestamp': self.timestamp.isoformat()
-        }
\ No newline at end of file
+        }
+
+
+class AccountPurge(db.Model):
+    """Progress of the background purge of a deleted account. Survives restarts so the purge can resume."""
+    __tablename__ = 'account_purge'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Plain column, not a foreign key: the user row itself is deleted by the last stage
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    stage = db.Column(db.String(50), nullable=False, default='chat_list')
+    rows_deleted = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class ChangeLog(db.Model):
+    """
+    One row per change a user's client needs to know about, written in the same transaction
+    as the change itself. The autoincrement id is the sync token for GET /api/sync.
+    kind: 'message', 'message_deleted', 'chat', 'block', 'pins', 'notification', 'friend_request'
+    """
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        db.Index('ix_change_log_user_id_id', 'user_id', 'id'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(30), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class JobCheckpoint(db.Model):
+    """
+    Progress of a resumable batch job that walks a table in primary-key order
+    (e.g. apps.content_conversion). Committed with every batch, so a restart resumes after last_id.
+    """
+    __tablename__ = 'job_checkpoint'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+class ChatGroup(db.Model):
+    """
+    A group conversation. Messages are stored once per group (GroupMessage), not per
+    recipient; each member's progress is a read watermark on their GroupMember row.
+    """
+    __tablename__ = 'chat_group'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    description = db.Column(db.String(500), nullable=True)
+    image_url = db.Column(db.String(512), nullable=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="SET NULL"), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Newest GroupMessage.id, so group lists show activity without scanning messages
+    last_message_id = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'description': self.description,
+            'image_url': self.image_url,
+            'created_by': self.created_by,
+            'created_at': self.created_at.isoformat(),
+            'last_message_id': self.last_message_id,
+        }
+
+
+class GroupMember(db.Model):
+    __tablename__ = 'group_member'
+    __table_args__ = (
+        db.UniqueConstraint('group_id', 'user_id', name='_group_member_uc'),
+        # "My groups" lookups, including the room joins on every socket connect
+        db.Index('ix_group_member_user_id', 'user_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('chat_group.id', ondelete="CASCADE"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
+    role = db.Column(db.String(20), nullable=False, default='member')  # 'admin' or 'member'
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Highest GroupMessage.id this member has read; unread = messages above it
+    last_read_message_id = db.Column(db.Integer, nullable=False, default=0)
+
+
+class GroupMessage(db.Model):
+    __tablename__ = 'group_message'
+    __table_args__ = (
+        # History pages and unread counts walk one group's messages by id
+        db.Index('ix_group_message_group_id_id', 'group_id', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('chat_group.id', ondelete="CASCADE"), nullable=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete="CASCADE"), nullable=False)
+    # Binary ciphertext with a version/flags/key id header (apps.utils.encrypt_message)
+    content_bin = db.Column(db.LargeBinary, nullable=True)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    media_url = db.Column(db.String(512), nullable=True)
+    media_type = db.Column(db.String(50), nullable=True)
+
+    @property
+    def ciphertext(self):
+        return self.content_bin
+
+    def to_dict(self, content=None):
+        """`content`: the plaintext, when the caller already decrypted it (see offload.decrypt_many)."""
+        return {
+            'id': self.id,
+            'group_id': self.group_id,
+            'sender_id': self.sender_id,
+            'content': decrypt_message(self.content_bin) if content is None else content,
+            'timestamp': self.timestamp.isoformat(),
+            'media_url': self.media_url,
+            'media_type': self.media_type,
+        }
@@ -0,0 +1,79 @@
+"""
+Runs CPU-heavy work (password hashing, bulk message decryption) off the eventlet hub.
+
+Under eventlet every greenlet shares one OS thread, so a password hash that takes tens
+of milliseconds stalls message delivery on every socket for that long, and a burst of
+logins stacks those stalls up. `run_cpu` hands the call to eventlet.tpool's native
+thread pool (CPU_POOL_SIZE threads) and lets the hub keep serving while it waits.
+hashlib's scrypt/pbkdf2 and OpenSSL release the GIL, so the work really runs beside
+the hub. The default pool leaves one core to the hub: more hashing threads than spare
+cores only take CPU time from it (benchmarks/login_storm.py shows the difference).
+Outside a monkey-patched process (flask CLI, scripts) calls run inline.
+
+Decrypting fewer than OFFLOAD_MIN_BATCH messages stays inline: the hand-off costs
+more than a few AES-GCM calls.
+"""
+import os
+import time
+
+from eventlet import patcher, tpool
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from apps.metrics import cpu_offload_inflight, cpu_offload_latency
+from apps.utils import decrypt_message
+
+OFFLOAD_MIN_BATCH = 32
+
+_enabled = True
+
+# Undecorated: the crypto latency histogram is updated from the hub only
+_decrypt = getattr(decrypt_message, '__wrapped__', decrypt_message)
+
+
+def default_pool_size():
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def offloading():
+    return _enabled and patcher.is_monkey_patched('thread')
+
+
+def run_cpu(operation, fn, *args, **kwargs):
+    """Calls fn(*args, **kwargs) on the native thread pool when running under eventlet."""
+    if not offloading():
+        return fn(*args, **kwargs)
+    cpu_offload_inflight.inc()
+    start = time.perf_counter()
+    try:
+        return tpool.execute(fn, *args, **kwargs)
+    finally:
+        cpu_offload_inflight.dec()
+        cpu_offload_latency.labels(operation).observe(time.perf_counter() - start)
+
+
+def hash_password(password):
+    return run_cpu('hash_password', generate_password_hash, password)
+
+
+def verify_password(password_hash, password):
+    return run_cpu('check_password', check_password_hash, password_hash, password)
+
+
+def _decrypt_all(contents):
+    return [_decrypt(content) for content in contents]
+
+
+def decrypt_many(contents):
+    """Plaintexts of a list of stored message contents, in order."""
+    contents = list(contents)
+    if len(contents) < OFFLOAD_MIN_BATCH or not offloading():
+        return [decrypt_message(content) for content in contents]
+    return run_cpu('decrypt_batch', _decrypt_all, contents)
+
+
+def init_app(app):
+    """CPU_OFFLOAD_ENABLED (default on) and CPU_POOL_SIZE (native threads)."""
+    global _enabled
+    _enabled = app.config.get('CPU_OFFLOAD_ENABLED', True)
+    if _enabled and patcher.is_monkey_patched('thread'):
+        tpool.set_num_threads(app.config.get('CPU_POOL_SIZE') or default_pool_size())
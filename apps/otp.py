@@ -0,0 +1,268 @@
+"""
+One-time codes for email verification, password reset and account deletion.
+
+Codes used to be `otp` rows: written on every send, looked up by (user_id, code) without
+an index, and never deleted once expired. They now live in a TTL store keyed by purpose
+and user, so issuing and checking a code doesn't touch the database and a code sent to
+reset a password can't be used to delete the account:
+
+- in this process (default): fine for the single eventlet worker in the Procfile. A
+  restart forgets pending codes; the user asks for another one.
+- redis://... (OTP_STORAGE_URL, optional `redis` package): shared by every worker,
+  expired by redis itself.
+- "database": the `otp` table, for several workers without redis.
+
+Issuing a code replaces the pending one for that purpose. Codes are compared in constant
+time, and after OTP_MAX_ATTEMPTS wrong guesses the code is discarded so a 4-digit space
+can't be walked. sweep_expired_otps (apps/jobs.py) drops expired entries and deletes
+expired `otp` rows in one statement, including the ones written before this module.
+"""
+import hmac
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, update
+
+from apps.metrics import Counter, Gauge
+from apps.models import db, OTP
+from apps.utils import gen_otp
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+PURPOSES = ('verify_email', 'reset_password', 'delete_account')
+
+# verify() results
+VERIFIED = 'verified'
+INVALID = 'invalid'
+TOO_MANY_ATTEMPTS = 'too_many_attempts'
+
+issued = Counter('otp_issued', 'One-time codes issued.', ('purpose',))
+verifications = Counter('otp_verifications', 'One-time code checks by outcome.', ('purpose', 'result'))
+
+
+class MemoryStore:
+    """key -> [code, expires (time.monotonic()), attempts], soonest expiry first."""
+
+    def __init__(self):
+        self._codes = OrderedDict()
+
+    def put(self, key, code, ttl):
+        now = time.monotonic()
+        self._codes.pop(key, None)
+        # Every entry has the same TTL, so appending keeps the dict in expiry order
+        self._codes[key] = [code, now + ttl, 0]
+        self._expire(now)
+
+    def get(self, key):
+        """(code, attempts) while the code is live, else None."""
+        entry = self._codes.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0], entry[2]
+
+    def fail(self, key):
+        """Counts a wrong guess; returns the attempts so far, or None if the code is gone."""
+        entry = self._codes.get(key)
+        if entry is None:
+            return None
+        entry[2] += 1
+        return entry[2]
+
+    def delete(self, key):
+        """True if this call removed the code, so only one of two racing checks can use it."""
+        return self._codes.pop(key, None) is not None
+
+    def sweep(self):
+        return self._expire(time.monotonic())
+
+    def _expire(self, now):
+        removed = 0
+        while self._codes and next(iter(self._codes.values()))[1] <= now:
+            self._codes.popitem(last=False)
+            removed += 1
+        return removed
+
+    def __len__(self):
+        return len(self._codes)
+
+
+# Counts a wrong guess without recreating (and un-expiring) a code that just expired
+_FAIL_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+end
+return -1
+"""
+
+
+class RedisStore:
+    """A hash (code, attempts) per key, expired by redis."""
+
+    def __init__(self, url, prefix='otp'):
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._fail = self._client.register_script(_FAIL_SCRIPT)
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def put(self, key, code, ttl):
+        pipe = self._client.pipeline()
+        pipe.delete(self._key(key))
+        pipe.hset(self._key(key), mapping={'code': code, 'attempts': 0})
+        pipe.expire(self._key(key), int(ttl))
+        pipe.execute()
+
+    def get(self, key):
+        code, attempts = self._client.hmget(self._key(key), 'code', 'attempts')
+        if code is None:
+            return None
+        return code.decode(), int(attempts or 0)
+
+    def fail(self, key):
+        attempts = int(self._fail(keys=[self._key(key)]))
+        return attempts if attempts >= 0 else None
+
+    def delete(self, key):
+        return bool(self._client.delete(self._key(key)))
+
+    def sweep(self):
+        return 0
+
+
+class DatabaseStore:
+    """`otp` rows (user_id, purpose); the key is "<purpose>:<user_id>"."""
+
+    @staticmethod
+    def _where(key):
+        purpose, user_id = key.split(':')
+        return (OTP.user_id == int(user_id), OTP.purpose == purpose)
+
+    def put(self, key, code, ttl):
+        purpose, user_id = key.split(':')
+        db.session.execute(delete(OTP).where(*self._where(key)))
+        db.session.add(OTP(user_id=int(user_id), purpose=purpose, code=code,
+                           expires_at=datetime.utcnow() + timedelta(seconds=ttl)))
+        db.session.commit()
+
+    def get(self, key):
+        row = OTP.query.filter(*self._where(key), OTP.expires_at > datetime.utcnow()).first()
+        return (row.code, row.attempts) if row is not None else None
+
+    def fail(self, key):
+        # The UPDATE holds the row lock until commit, so the count read back in the same
+        # transaction includes every earlier wrong guess and no later one
+        db.session.execute(update(OTP).where(*self._where(key)).values(attempts=OTP.attempts + 1))
+        attempts = db.session.execute(select(OTP.attempts).where(*self._where(key))).scalar()
+        db.session.commit()
+        return attempts
+
+    def delete(self, key):
+        removed = db.session.execute(delete(OTP).where(*self._where(key))).rowcount
+        db.session.commit()
+        return bool(removed)
+
+    def sweep(self):
+        return 0  # purge_expired_rows covers the table
+
+
+def store_from_url(url):
+    """The store for OTP_STORAGE_URL: redis://..., "database", or this process (memory://, the default)."""
+    if url == 'database':
+        return DatabaseStore()
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        if redis is not None:
+            return RedisStore(url)
+        logger.critical("OTP_STORAGE_URL needs the redis package; keeping codes in this process")
+    elif url and not url.startswith('memory://'):
+        logger.critical("unknown OTP_STORAGE_URL %r; keeping codes in this process", url.split(':', 1)[0])
+    return MemoryStore()
+
+
+class OTPService:
+    def __init__(self):
+        self.ttl = 600
+        self.max_attempts = 5
+        self.length = 4
+        self.store = MemoryStore()
+
+    def configure(self, ttl=None, max_attempts=None, length=None, store=None):
+        if ttl is not None:
+            self.ttl = ttl
+        if max_attempts is not None:
+            self.max_attempts = max_attempts
+        if length is not None:
+            self.length = length
+        if store is not None:
+            self.store = store
+
+    @property
+    def ttl_minutes(self):
+        """For the email text."""
+        return max(1, round(self.ttl / 60))
+
+    def issue(self, purpose, user_id):
+        """A new code for `purpose`, replacing any pending one. Returns the code to send."""
+        code = gen_otp(length=self.length)
+        self.store.put(f"{purpose}:{user_id}", code, self.ttl)
+        issued.labels(purpose).inc()
+        return code
+
+    def verify(self, purpose, user_id, code):
+        """VERIFIED (and the code is used up), INVALID, or TOO_MANY_ATTEMPTS (and the code is gone)."""
+        key = f"{purpose}:{user_id}"
+        pending = self.store.get(key)
+        if pending is None or not code:
+            result = INVALID
+        elif pending[1] >= self.max_attempts:
+            self.store.delete(key)
+            result = TOO_MANY_ATTEMPTS
+        elif hmac.compare_digest(pending[0].encode(), str(code).encode()):
+            result = VERIFIED if self.store.delete(key) else INVALID
+        else:
+            # Decided on the count the store returns, not `pending`: concurrent wrong guesses
+            # all read the same attempts, but each increment is counted once
+            attempts = self.store.fail(key)
+            if attempts is not None and attempts >= self.max_attempts:
+                self.store.delete(key)
+                result = TOO_MANY_ATTEMPTS
+            else:
+                result = INVALID
+        verifications.labels(purpose, result).inc()
+        return result
+
+
+otps = OTPService()
+
+pending_codes = Gauge('otp_pending', 'Unexpired one-time codes held in this process.',
+                      function=lambda: len(otps.store) if isinstance(otps.store, MemoryStore) else 0)
+
+
+def purge_expired_rows():
+    """Deletes every expired `otp` row in one statement. Returns the number removed."""
+    removed = db.session.execute(delete(OTP).where(OTP.expires_at < datetime.utcnow())).rowcount
+    db.session.commit()
+    return removed
+
+
+def sweep_expired_otps():
+    """Drops expired codes from the store and the `otp` table."""
+    removed = otps.store.sweep() + purge_expired_rows()
+    if removed:
+        logger.info("expired one-time codes removed", extra={"removed": removed})
+    return removed
+
+
+def init_app(app):
+    """OTP_TTL_SECONDS, OTP_MAX_ATTEMPTS, OTP_LENGTH, OTP_STORAGE_URL."""
+    otps.configure(ttl=app.config.get('OTP_TTL_SECONDS'),
+                   max_attempts=app.config.get('OTP_MAX_ATTEMPTS'),
+                   length=app.config.get('OTP_LENGTH'),
+                   store=store_from_url(app.config.get('OTP_STORAGE_URL')))
@@ -0,0 +1,71 @@
+"""
+Pinned chats, shared by the `pin_chat` socket event and the POST /api/pin route.
+
+A pin action is one transaction: lock the user's pinned rows plus the target row,
+apply the whole reorder with a single set-based UPDATE, and read the new pin set back
+before committing. Concurrent taps by the same user serialize on the row locks.
+"""
+from sqlalchemy import and_, case, func, or_, update
+
+from apps.models import db, UserChatList
+from apps.changes import record_change
+from apps.http_cache import bump_version
+
+MAX_PINS = 3
+
+
+def apply_pin(user_id, other_user_id, pin=True):
+    """
+    Pins `other_user_id` at the top (priority 1) or unpins it and closes the gap.
+    Pins pushed past MAX_PINS are unpinned.
+    Returns the new pins as [{"other_user_id", "pin_priority"}], or None if the chat isn't in the list.
+    """
+    priority = func.coalesce(UserChatList.pin_priority, 0)
+    mine = UserChatList.user_id == user_id
+    affected = or_(UserChatList.other_user_id == other_user_id, priority > 0)
+
+    locked = (db.session.query(UserChatList.id, UserChatList.other_user_id, priority)
+              .filter(mine, affected)
+              .with_for_update()
+              .all())
+    entry = next((row for row in locked if row.other_user_id == other_user_id), None)
+    if entry is None:
+        db.session.rollback()
+        return None
+
+    entry_id, old = entry[0], entry[2]
+    if pin and old != 1:
+        # Everything above the entry's old slot (all pins, if it wasn't pinned) moves down one
+        shifted = and_(priority > 0, priority < old) if old else priority > 0
+        new_priority = case(
+            (UserChatList.id == entry_id, 1),
+            (shifted, case((priority + 1 > MAX_PINS, 0), else_=priority + 1)),
+            else_=priority,
+        )
+    elif not pin and old:
+        new_priority = case(
+            (UserChatList.id == entry_id, 0),
+            (priority > old, priority - 1),
+            else_=priority,
+        )
+    else:
+        new_priority = None  # already in the requested state
+
+    if new_priority is not None:
+        db.session.execute(
+            update(UserChatList)
+            .where(mine, affected)
+            .values(pin_priority=new_priority)
+            .execution_options(synchronize_session=False)
+        )
+        record_change(user_id, 'pins')
+
+    pins = (db.session.query(UserChatList.other_user_id, UserChatList.pin_priority)
+            .filter(mine, UserChatList.pin_priority > 0)
+            .order_by(UserChatList.pin_priority.asc())
+            .all())
+    db.session.commit()
+    if new_priority is not None:
+        bump_version('chatlist', user_id)
+
+    return [{"other_user_id": uid, "pin_priority": pri} for (uid, pri) in pins]
@@ -0,0 +1,202 @@
+"""
+Opt-in SQL profiler and N+1 detector.
+
+With SQL_PROFILER_ENABLED, every HTTP request and socket event (and any block wrapped
+in `scope(name)`) records its statements through SQLAlchemy engine events: count,
+total DB time, and how often each statement fingerprint repeats. A scope is flagged
+when it runs more than SQL_PROFILER_MAX_QUERIES statements, spends more than
+SQL_PROFILER_SLOW_MS in the database, or repeats one fingerprint at least
+SQL_PROFILER_REPEAT_THRESHOLD times (the N+1 signature: one lazy load per row).
+Flagged scopes are logged and kept for GET /debug/sql-profile (METRICS_TOKEN / METRICS_PUBLIC apply).
+
+`assert_max_queries(n)` works with the profiler disabled too, for tests:
+
+    with assert_max_queries(3):
+        client.get('/api/users/chatlist', headers=...)
+"""
+import logging
+import re
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, jsonify, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+_enabled = False
+_installed = False
+_settings = {'max_queries': 20, 'slow_ms': 250, 'repeat_threshold': 5}
+
+_current = ContextVar('sql_profile_scope', default=None)
+_flagged = deque(maxlen=100)   # recent reports of flagged scopes, newest last
+_totals = OrderedDict()        # scope name -> aggregate stats
+MAX_SCOPE_NAMES = 500
+
+_IN_LIST = re.compile(r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_SPACES = re.compile(r'\s+')
+
+
+def fingerprint(statement):
+    """Statement text with literals, IN-lists and whitespace normalized."""
+    text = _IN_LIST.sub('(?)', statement)
+    text = _LITERALS.sub('?', text)
+    return _SPACES.sub(' ', text).strip()
+
+
+class QueryScope:
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent  # enclosing scope; it counts this scope's statements too
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.fingerprints = Counter()
+
+    def repeated(self, threshold):
+        return [(fp, n) for fp, n in self.fingerprints.most_common() if n >= threshold]
+
+    def flags(self):
+        flags = []
+        if self.queries > _settings['max_queries']:
+            flags.append('too_many_queries')
+        if self.db_seconds * 1000 > _settings['slow_ms']:
+            flags.append('slow')
+        if self.repeated(_settings['repeat_threshold']):
+            flags.append('repeated_statement')
+        return flags
+
+    def report(self):
+        return {
+            'scope': self.name,
+            'queries': self.queries,
+            'db_ms': round(self.db_seconds * 1000, 2),
+            'repeated': [{'fingerprint': fp, 'count': n}
+                         for fp, n in self.repeated(_settings['repeat_threshold'])],
+            'flags': self.flags(),
+        }
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        context._profiler_start = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    current = _current.get()
+    if current is None:
+        return
+    elapsed = time.perf_counter() - getattr(context, '_profiler_start', time.perf_counter())
+    key = fingerprint(statement)
+    while current is not None:
+        current.queries += 1
+        current.db_seconds += elapsed
+        current.fingerprints[key] += 1
+        current = current.parent
+
+
+def _install():
+    global _installed
+    if not _installed:
+        event.listen(Engine, 'before_cursor_execute', _before_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_execute)
+        _installed = True
+
+
+def _finish(profile):
+    totals = _totals.get(profile.name)
+    if totals is None:
+        totals = _totals[profile.name] = {'calls': 0, 'queries': 0, 'max_queries': 0, 'db_ms': 0.0, 'flagged': 0}
+        while len(_totals) > MAX_SCOPE_NAMES:
+            _totals.popitem(last=False)
+    totals['calls'] += 1
+    totals['queries'] += profile.queries
+    totals['max_queries'] = max(totals['max_queries'], profile.queries)
+    totals['db_ms'] += profile.db_seconds * 1000
+
+    flags = profile.flags()
+    if flags:
+        totals['flagged'] += 1
+        report = profile.report()
+        _flagged.append(report)
+        logger.warning("sql profile flagged %s", profile.name, extra=report)
+
+
+@contextmanager
+def scope(name):
+    """Profiles the statements run inside the block (no-op unless the profiler is enabled)."""
+    if not _enabled:
+        yield None
+        return
+    profile = QueryScope(name, _current.get())
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+        _finish(profile)
+
+
+@contextmanager
+def assert_max_queries(limit, name='assert_max_queries'):
+    """Fails with the repeated fingerprints if the block runs more than `limit` statements."""
+    _install()
+    profile = QueryScope(name, _current.get())
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+    if profile.queries > limit:
+        repeated = '\n'.join(f'  {n}x {fp}' for fp, n in profile.fingerprints.most_common(5))
+        raise AssertionError(f"{name}: {profile.queries} queries (max {limit}); most frequent:\n{repeated}")
+
+
+def _before_request():
+    if request.endpoint == 'sql_profile':
+        return
+    rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    g.sql_profile = QueryScope(f"{request.method} {rule}", _current.get())
+    g.sql_profile_token = _current.set(g.sql_profile)
+
+
+def _teardown_request(exc):
+    profile = g.pop('sql_profile', None)
+    if profile is not None:
+        _current.reset(g.pop('sql_profile_token'))
+        _finish(profile)
+
+
+def sql_profile_view():
+    from apps.metrics import authorized, exposed
+    if not exposed():
+        return jsonify({'msg': 'Not found'}), 404
+    if not authorized():
+        return jsonify({'msg': 'Unauthorized'}), 401
+    by_queries = sorted(_totals.items(), key=lambda item: item[1]['queries'] / item[1]['calls'], reverse=True)
+    return jsonify({
+        'thresholds': _settings,
+        'scopes': [dict(stats, scope=name, avg_queries=round(stats['queries'] / stats['calls'], 2))
+                   for name, stats in by_queries],
+        'flagged': list(reversed(_flagged)),
+    })
+
+
+def init_app(app):
+    """Turns the profiler on when SQL_PROFILER_ENABLED is set."""
+    global _enabled
+    if not app.config.get('SQL_PROFILER_ENABLED'):
+        return
+    _settings.update(
+        max_queries=app.config.get('SQL_PROFILER_MAX_QUERIES', _settings['max_queries']),
+        slow_ms=app.config.get('SQL_PROFILER_SLOW_MS', _settings['slow_ms']),
+        repeat_threshold=app.config.get('SQL_PROFILER_REPEAT_THRESHOLD', _settings['repeat_threshold']),
+    )
+    _enabled = True
+    _install()
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/debug/sql-profile', 'sql_profile', sql_profile_view, methods=['GET'])
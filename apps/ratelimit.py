@@ -0,0 +1,244 @@
+"""
+Token-bucket rate limits for socket events and the unauthenticated email/OTP routes.
+
+The socket events write to the database on every call, /register and the send-otp routes
+send an email, and the verify-otp routes check a guessable code; nothing else stops a
+client from firing them in a loop. Each limited event has a bucket per key (user id for
+socket events, client IP and email address for the routes) that holds up to N tokens
+and refills at N per period, so a burst of N goes through and the sustained rate is N
+per period. A call that finds the bucket empty is refused with the seconds until the
+next token: socket events get a `rate_limited` event back, routes a 429 with Retry-After.
+
+Limits are DEFAULT_LIMITS (send_message and send_group_message 30/10s, typing 10/s,
+send_friend_request 20/h, register and send_otp 5/h, verify_otp 10/h) with the
+"event=N/period" pairs in RATE_LIMITS applied over them; "event=off" disables one. A
+bucket is two numbers; one idle for a whole period is full again and is dropped, oldest
+first, so memory follows the keys active in the last period and is capped at
+RATE_LIMIT_MAX_KEYS per event. Buckets live in this process unless
+RATE_LIMIT_STORAGE_URL names a redis server (optional `redis` package), which every
+worker then shares. A failing shared store lets calls through rather than failing them.
+"""
+import logging
+import math
+import re
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import jsonify, request
+
+from apps.log import SampledLogger
+from apps.metrics import Counter, Gauge
+
+try:
+    import redis
+except ImportError:  # pragma: no cover - optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+store_error_logger = SampledLogger(logger, every=100)
+
+# capacity per period; the period also bounds how long an idle bucket is kept
+Limit = namedtuple('Limit', 'capacity period')
+
+DEFAULT_LIMITS = {
+    'send_message': '30/10s',
+    'send_group_message': '30/10s',
+    'typing': '10/s',
+    'send_friend_request': '20/h',
+    # the email routes, per client IP and per address
+    'register': '5/h',
+    'send_otp': '5/h',
+    # wrong codes also use up the code itself (OTP_MAX_ATTEMPTS); this caps guesses across codes
+    'verify_otp': '10/h',
+}
+
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_SPEC = re.compile(r'^\s*(\d+)\s*/\s*(\d*)\s*([smhd])\s*$')
+
+rejections = Counter('rate_limit_rejections', 'Calls refused for an empty token bucket.', ('event',))
+
+
+def parse_limit(spec):
+    """'30/10s' -> Limit(30, 10.0); 'off' or '0' -> None."""
+    if spec.strip().lower() in ('off', '0', ''):
+        return None
+    match = _SPEC.match(spec)
+    if not match or not int(match.group(1)):
+        raise ValueError(f"bad rate limit {spec!r}, expected N/period like 30/10s or 5/h")
+    count, multiple, unit = match.groups()
+    return Limit(int(count), float(int(multiple or 1) * _UNITS[unit]))
+
+
+def parse_limits(spec=None):
+    """DEFAULT_LIMITS with the "event=N/period,..." overrides in `spec` applied."""
+    limits = {event: parse_limit(value) for event, value in DEFAULT_LIMITS.items()}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        event, _, value = item.partition('=')
+        limits[event.strip()] = parse_limit(value)
+    return limits
+
+
+class MemoryStore:
+    """Buckets in this process: (tokens, updated) per key, least recently used first."""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}  # event -> OrderedDict key -> (tokens, time.monotonic() of the last take)
+
+    def take(self, event, keys, limit):
+        """
+        Takes a token from every key's bucket, or from none of them if any is empty.
+        Returns 0 if taken, else the seconds until the emptiest bucket has a token.
+        """
+        now = time.monotonic()
+        buckets = self._buckets.setdefault(event, OrderedDict())
+        rate = limit.capacity / limit.period
+        levels = [min(limit.capacity, tokens + (now - updated) * rate)
+                  for tokens, updated in (buckets.pop(key, (limit.capacity, now)) for key in keys)]
+        retry_after = max([(1 - tokens) / rate for tokens in levels if tokens < 1], default=0.0)
+        for key, tokens in zip(keys, levels):
+            buckets[key] = (tokens if retry_after else tokens - 1, now)
+
+        # Front entries are the longest idle; a bucket idle for a period is full, same as absent
+        while buckets:
+            oldest = next(iter(buckets))
+            if now - buckets[oldest][1] < limit.period and len(buckets) <= self.max_keys:
+                break
+            del buckets[oldest]
+        return retry_after
+
+    def __len__(self):
+        return sum(len(buckets) for buckets in self._buckets.values())
+
+
+# KEYS: one bucket hash per key; ARGV capacity, period (s). Same all-or-nothing take as
+# MemoryStore.take, in one script so it is atomic; uses the server clock so workers agree.
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * capacity / period)
+    if tokens < 1 then
+        retry_after = math.max(retry_after, (1 - tokens) * period / capacity)
+    end
+    levels[i] = tokens
+end
+for i, key in ipairs(KEYS) do
+    local tokens = levels[i]
+    if retry_after == 0 then
+        tokens = tokens - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('PEXPIRE', key, math.ceil(period * 1000))
+end
+return tostring(retry_after)
+"""
+
+
+class RedisStore:
+    """Buckets shared by every worker: one hash per key, expiring after a period idle."""
+
+    def __init__(self, url, prefix='ratelimit'):
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(_TAKE_SCRIPT)
+
+    def take(self, event, keys, limit):
+        # {event} is a hash tag: one script touches several keys, which redis cluster
+        # only allows within a slot
+        return float(self._take(keys=[f"{self.prefix}:{{{event}}}:{key}" for key in keys],
+                                args=[limit.capacity, limit.period]))
+
+
+def store_from_url(url, max_keys=100000):
+    """The store for RATE_LIMIT_STORAGE_URL: redis://... when redis is installed, else this process."""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        if redis is not None:
+            return RedisStore(url)
+        logger.critical("RATE_LIMIT_STORAGE_URL needs the redis package; limiting per process")
+    elif url and not url.startswith('memory://'):
+        logger.critical("unknown RATE_LIMIT_STORAGE_URL scheme %r; limiting per process", url.split(':', 1)[0])
+    return MemoryStore(max_keys)
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = True
+        self.limits = parse_limits()
+        self.store = MemoryStore()
+
+    def configure(self, enabled=None, limits=None, store=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if limits is not None:
+            self.limits = limits
+        if store is not None:
+            self.store = store
+
+    def hit(self, event, *keys):
+        """
+        Takes a token for `event` from each key's bucket (None keys are skipped), only if
+        every one of them has a token: a refused call costs none. Returns 0 if the call may
+        go ahead, else the seconds until it may be retried.
+        """
+        limit = self.limits.get(event)
+        keys = [key for key in keys if key is not None]
+        if not self.enabled or limit is None or not keys:
+            return 0.0
+        try:
+            retry_after = self.store.take(event, keys, limit)
+        except Exception as e:
+            store_error_logger.info("rate limit store failed: %s", e, extra={"event": event})
+            return 0.0
+        if retry_after:
+            rejections.labels(event).inc()
+        return retry_after
+
+
+limiter = RateLimiter()
+
+tracked_keys = Gauge('rate_limit_tracked_keys', 'Token buckets held in this process.',
+                     function=lambda: len(limiter.store) if isinstance(limiter.store, MemoryStore) else 0)
+
+
+def client_ip():
+    """The caller's address; behind proxies, set TRUSTED_PROXY_HOPS so this isn't the proxy's."""
+    return f"ip:{request.remote_addr}"
+
+
+def json_email():
+    """The email address in the JSON body, so one inbox can't be flooded from many IPs."""
+    email = (request.get_json(silent=True) or {}).get('email')
+    return f"email:{email.strip().lower()}" if isinstance(email, str) and email.strip() else None
+
+
+def rate_limit(event, *key_funcs):
+    """Refuses the route with a 429 once any of the keys from `key_funcs` is out of tokens for `event`."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            retry_after = limiter.hit(event, *(key_func() for key_func in key_funcs))
+            if retry_after:
+                seconds = math.ceil(retry_after)
+                response = jsonify({"msg": "Too many requests, try again later", "retry_after": seconds})
+                response.headers['Retry-After'] = str(seconds)
+                return response, 429
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    """RATE_LIMIT_ENABLED, RATE_LIMITS, RATE_LIMIT_STORAGE_URL, RATE_LIMIT_MAX_KEYS."""
+    limiter.configure(enabled=app.config.get('RATE_LIMIT_ENABLED', True),
+                      limits=parse_limits(app.config.get('RATE_LIMITS')),
+                      store=store_from_url(app.config.get('RATE_LIMIT_STORAGE_URL'),
+                                           app.config.get('RATE_LIMIT_MAX_KEYS', 100000)))
@@ -0,0 +1,65 @@
+"""
+In-memory replay of recently emitted socket events.
+
+Every replayable event gets a process-wide sequence number (stamped into the payload
+as "seq") and is kept in a small ring buffer per recipient. A client reconnecting with
+{"epoch", "last_seq"} gets the gap replayed; if its epoch is from another server
+process, or the gap has already rotated out of the buffer, it must resync instead.
+"""
+import uuid
+from collections import OrderedDict, deque
+
+
+class ReplayBuffer:
+    def __init__(self, per_user=100, max_users=10000):
+        # Changes on every restart so clients can tell their last_seq is meaningless here
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.per_user = per_user
+        self.max_users = max_users
+        self._events = OrderedDict()  # user_id -> deque[(seq, event, payload)]
+        self._dropped = {}            # user_id -> highest seq rotated out of that user's buffer
+        self._evicted_upto = 0        # highest seq held by any buffer evicted to respect max_users
+
+    def configure(self, per_user=None, max_users=None):
+        self.per_user = per_user or self.per_user
+        self.max_users = max_users or self.max_users
+
+    def record(self, user_ids, event, payload):
+        """Stores the event for each recipient and returns the payload stamped with its seq."""
+        self.seq += 1
+        stamped = dict(payload, seq=self.seq)
+        entry = (self.seq, event, stamped)
+
+        for user_id in user_ids:
+            buf = self._events.get(user_id)
+            if buf is None:
+                buf = self._events[user_id] = deque(maxlen=self.per_user)
+                self._evict_idle()
+            else:
+                self._events.move_to_end(user_id)
+            if len(buf) == buf.maxlen:
+                self._dropped[user_id] = buf[0][0]
+            buf.append(entry)
+        return stamped
+
+    def _evict_idle(self):
+        while len(self._events) > self.max_users:
+            user_id, buf = self._events.popitem(last=False)
+            self._dropped.pop(user_id, None)
+            if buf:
+                self._evicted_upto = max(self._evicted_upto, buf[-1][0])
+
+    def since(self, user_id, last_seq):
+        """
+        Events for `user_id` after `last_seq` as [(event, payload)], oldest first,
+        or None if some of them are no longer buffered.
+        """
+        if last_seq > self.seq:
+            return None
+        buf = self._events.get(user_id)
+        if buf is None:
+            return None if last_seq < self._evicted_upto else []
+        if self._dropped.get(user_id, 0) > last_seq:
+            return None
+        return [(event, payload) for seq, event, payload in buf if seq > last_seq]
@@ -9,27 +9,51 @@ import os
 from flask import Flask
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
+from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Import extensions and blueprints
 from apps.models import db
+from apps.db_routing import replica_binds_from_env
+from apps.archive import archive_messages_command
+from apps.account_purge import purge_accounts_command, is_deleted_account
+from apps.content_conversion import convert_message_content_command
+from apps.key_rotation import rotate_message_keys_command
+from apps.jobs import start_background_jobs
+from apps import backpressure, message_cache, metrics, offload, otp, profiler, ratelimit
+from apps.log import configure_logging, stop_logging
+from apps.utils import configure_compression
 from apps.routes.user import user_bp
+from apps.routes.group import group_bp
 from apps.routes.socket import socketio, register_socket_handlers, check_and_send_birthday_notifications
 from flask_migrate import Migrate
 
 from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
+import logging
 from datetime import datetime, timedelta
 
 migrate = Migrate()
 
+logger = logging.getLogger(__name__)
+
 # Initialize JWTManager globally
 jwt = JWTManager()
 
+
+@jwt.token_in_blocklist_loader
+def _account_deleted(jwt_header, jwt_payload):
+    """Tokens of a deleted account stop working once it is tombstoned."""
+    return is_deleted_account(jwt_payload['sub'])
+
 def create_app(test_config=None):
     """
     The Application Factory function. 
     It creates, configures, and returns the Flask application instance.
     """
+    # Leveled logging through a queue (LOG_LEVEL, LOG_FORMAT), flushed at exit
+    configure_logging()
+    atexit.register(stop_logging)
+
     # --- Template path resolution ---
     # Current Directory: .../apps/routes
     current_dir = os.path.abspath(os.path.dirname(__file__))
@@ -48,6 +72,69 @@ def create_app(test_config=None):
         # Load configuration from environment variables (provided by load_dotenv in app.py)
         app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI')
         app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        # Optional read replicas, comma separated. History/search/list reads are routed there.
+        app.config['SQLALCHEMY_BINDS'] = replica_binds_from_env(os.environ.get('SQLALCHEMY_REPLICA_URIS'))
+        app.config['SQLALCHEMY_REPLICA_STICKY_SECONDS'] = float(os.environ.get('SQLALCHEMY_REPLICA_STICKY_SECONDS', 5))
+        # Messages older than this many whole months are moved to message_archive
+        app.config['MESSAGE_HOT_MONTHS'] = int(os.environ.get('MESSAGE_HOT_MONTHS', 6))
+        app.config['ACCOUNT_PURGE_BATCH_SIZE'] = int(os.environ.get('ACCOUNT_PURGE_BATCH_SIZE', 500))
+        # Rows per transaction when moving legacy base64 message content to content_bin
+        app.config['CONTENT_CONVERSION_BATCH_SIZE'] = int(os.environ.get('CONTENT_CONVERSION_BATCH_SIZE', 1000))
+        # Rows per transaction when re-encrypting messages after a key rotation (ENCRYPTION_KEYS)
+        app.config['KEY_ROTATION_BATCH_SIZE'] = int(os.environ.get('KEY_ROTATION_BATCH_SIZE', 500))
+        # Message text at least this long is deflated before encryption (0 turns it off)
+        app.config['MESSAGE_COMPRESS_MIN_BYTES'] = int(os.environ.get('MESSAGE_COMPRESS_MIN_BYTES', 512))
+        app.config['MESSAGE_COMPRESS_LEVEL'] = int(os.environ.get('MESSAGE_COMPRESS_LEVEL', 1))
+        # Delta sync (/api/sync): page size, settle window for out-of-order commits, log retention
+        app.config['SYNC_PAGE_SIZE'] = int(os.environ.get('SYNC_PAGE_SIZE', 500))
+        app.config['SYNC_SETTLE_SECONDS'] = int(os.environ.get('SYNC_SETTLE_SECONDS', 5))
+        app.config['CHANGE_LOG_RETENTION_DAYS'] = int(os.environ.get('CHANGE_LOG_RETENTION_DAYS', 7))
+        # Largest group chat (members); every message is still one row and one room emit
+        app.config['GROUP_MAX_MEMBERS'] = int(os.environ.get('GROUP_MAX_MEMBERS', 5000))
+        # chat_room: conversation events go to chat_{a}_{b} rooms (join_chat); user_rooms: to both users' own rooms
+        app.config['MESSAGE_ROUTING'] = os.environ.get('MESSAGE_ROUTING', 'chat_room')
+        # Outbound queue limits per socket session (packets): drop typing/presence above the soft
+        # limit, disconnect sessions that stay above the hard limit for the grace period
+        app.config['SOCKET_QUEUE_SOFT_LIMIT'] = int(os.environ.get('SOCKET_QUEUE_SOFT_LIMIT', 100))
+        app.config['SOCKET_QUEUE_HARD_LIMIT'] = int(os.environ.get('SOCKET_QUEUE_HARD_LIMIT', 1000))
+        app.config['SOCKET_SLOW_CONSUMER_GRACE'] = float(os.environ.get('SOCKET_SLOW_CONSUMER_GRACE', 10))
+        app.config['SOCKET_BACKPRESSURE_INTERVAL'] = float(os.environ.get('SOCKET_BACKPRESSURE_INTERVAL', 1))
+        app.config['SOCKET_DROPPABLE_EVENTS'] = os.environ.get('SOCKET_DROPPABLE_EVENTS', 'typing,presence_update').split(',')
+        # Token buckets per user/IP for socket events and the email and OTP routes (apps/ratelimit.py):
+        # "event=N/period" overrides, and redis://... to share them across workers
+        app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', 'True') == 'True'
+        app.config['RATE_LIMITS'] = os.environ.get('RATE_LIMITS', '')
+        app.config['RATE_LIMIT_STORAGE_URL'] = os.environ.get('RATE_LIMIT_STORAGE_URL')
+        app.config['RATE_LIMIT_MAX_KEYS'] = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+        # One-time codes (apps/otp.py): kept in this process unless OTP_STORAGE_URL is redis://... or database
+        app.config['OTP_TTL_SECONDS'] = int(os.environ.get('OTP_TTL_SECONDS', 600))
+        app.config['OTP_MAX_ATTEMPTS'] = int(os.environ.get('OTP_MAX_ATTEMPTS', 5))
+        app.config['OTP_LENGTH'] = int(os.environ.get('OTP_LENGTH', 4))
+        app.config['OTP_STORAGE_URL'] = os.environ.get('OTP_STORAGE_URL')
+        # Reverse proxies in front of the app whose X-Forwarded-For is trusted for the client IP
+        app.config['TRUSTED_PROXY_HOPS'] = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+        # Per-user buffer of recent socket events replayed on reconnect
+        app.config['REPLAY_BUFFER_SIZE'] = int(os.environ.get('REPLAY_BUFFER_SIZE', 100))
+        app.config['REPLAY_BUFFER_MAX_USERS'] = int(os.environ.get('REPLAY_BUFFER_MAX_USERS', 10000))
+        # Negotiated gzip/br for large JSON reads; smaller bodies go out uncompressed
+        app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+        app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+        # Password hashing and bulk decryption run on a native thread pool, off the eventlet hub
+        app.config['CPU_OFFLOAD_ENABLED'] = os.environ.get('CPU_OFFLOAD_ENABLED', 'True') == 'True'
+        app.config['CPU_POOL_SIZE'] = int(os.environ.get('CPU_POOL_SIZE', 0)) or None  # default: cores - 1
+        # Newest MESSAGE_CACHE_WINDOW messages of recently opened chats, for first-page history reads
+        app.config['MESSAGE_CACHE_ENABLED'] = os.environ.get('MESSAGE_CACHE_ENABLED', 'True') == 'True'
+        app.config['MESSAGE_CACHE_WINDOW'] = int(os.environ.get('MESSAGE_CACHE_WINDOW', 50))
+        app.config['MESSAGE_CACHE_MAX_BYTES'] = int(os.environ.get('MESSAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+        app.config['SQL_PROFILER_ENABLED'] = os.environ.get('SQL_PROFILER_ENABLED', 'False') == 'True'
+        app.config['SQL_PROFILER_MAX_QUERIES'] = int(os.environ.get('SQL_PROFILER_MAX_QUERIES', 20))
+        app.config['SQL_PROFILER_SLOW_MS'] = float(os.environ.get('SQL_PROFILER_SLOW_MS', 250))
+        app.config['SQL_PROFILER_REPEAT_THRESHOLD'] = int(os.environ.get('SQL_PROFILER_REPEAT_THRESHOLD', 5))
+        # Bearer token for GET /metrics and /debug/sql-profile; without one they are off
+        # unless METRICS_PUBLIC=True (local development only: they expose traffic and SQL)
+        app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+        app.config['METRICS_PUBLIC'] = os.environ.get('METRICS_PUBLIC', 'False') == 'True'
+        app.config['BACKGROUND_JOBS_ENABLED'] = os.environ.get('BACKGROUND_JOBS_ENABLED', 'False') == 'True'
         app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'default-dev-secret-key')
         app.config['JWT_SECRET_KEY'] = os.environ.get('JWT_SECRET_KEY', 'jwt-secret-default')
         app.config['JWT_TOKEN_LOCATION'] = ['headers', 'cookies'] # Common config for JWT
@@ -59,7 +146,7 @@ def create_app(test_config=None):
     
     # Check for critical configuration
     if not app.config['SQLALCHEMY_DATABASE_URI']:
-        print("❌ CRITICAL ERROR: DATABASE_URL not found.")
+        logger.critical("DATABASE_URL not found")
         
     # ===============================
     # 2. Initialize Extensions
@@ -68,6 +155,18 @@ def create_app(test_config=None):
     jwt.init_app(app)
     
     migrate.init_app(app, db)
+    # Request/query instrumentation and GET /metrics
+    metrics.init_app(app)
+    # Opt-in per-request/per-event SQL profiling (SQL_PROFILER_ENABLED), GET /debug/sql-profile
+    profiler.init_app(app)
+    offload.init_app(app)
+    message_cache.init_app(app)
+    backpressure.init_app(app)
+    ratelimit.init_app(app)
+    otp.init_app(app)
+    if app.config.get('TRUSTED_PROXY_HOPS'):
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_HOPS'])
+    configure_compression(app.config.get('MESSAGE_COMPRESS_MIN_BYTES'), app.config.get('MESSAGE_COMPRESS_LEVEL'))
     
     # Initialize SocketIO
     socketio.init_app(app, cors_allowed_origins="https://joyful-haupia-8b0566.netlify.app", async_mode="eventlet")
@@ -84,6 +183,7 @@ def create_app(test_config=None):
     # ===============================
     # All API routes are now under the 'user' blueprint
     app.register_blueprint(user_bp, url_prefix='/api')
+    app.register_blueprint(group_bp, url_prefix='/api')
     
     # Return the initialized application
     @app.route("/")
@@ -102,7 +202,7 @@ def create_app(test_config=None):
             scheduler = BackgroundScheduler()
             
             run_date = datetime.now() + timedelta(minutes=1)
-            print(f"Scheduling birthday check to run for testing at: {run_date.isoformat()}")
+            logger.info("birthday check scheduled for testing at %s", run_date.isoformat())
 
             scheduler.add_job(
                 func=check_and_send_birthday_notifications, 
@@ -114,19 +214,27 @@ def create_app(test_config=None):
             )
             scheduler.start()
             atexit.register(lambda: scheduler.shutdown())
-            print("✅ Scheduler started successfully")
+            logger.info("scheduler started")
         except Exception as e:
-            print(f"⚠️ Scheduler setup failed: {e}")
+            logger.warning("scheduler setup failed: %s", e)
     
+    # Maintenance: `flask archive-messages`, `flask purge-accounts` and the periodic jobs in apps/jobs.py
+    app.cli.add_command(archive_messages_command)
+    app.cli.add_command(purge_accounts_command)
+    app.cli.add_command(convert_message_content_command)
+    app.cli.add_command(rotate_message_keys_command)
+    if app.config.get('BACKGROUND_JOBS_ENABLED'):
+        start_background_jobs(app)
+
     # ===============================
     # 5. Create tables and check database connection
     # ===============================
     with app.app_context():
         if app.debug:  # only for local developement
             db.create_all()
-            print("Tables created in development.")
+            logger.info("tables created in development")
         else:
-            print("Skipping db.create_all() in production.")
+            logger.debug("skipping db.create_all() in production")
 
     # Return the initialized application, jwt, and db instance
     return app
\ No newline at end of file
@@ -0,0 +1,266 @@
+"""
+Group conversations.
+
+A group message is stored once (GroupMessage) and delivered with one emit to the
+`group_{id}` room that members' sockets join on connect. Nothing is written per
+recipient: each member only has a read watermark (GroupMember.last_read_message_id),
+unread counts are computed from it, and members who were offline page through
+GET /api/groups/<id>/messages. Members can only be added from the adder's chat list.
+"""
+import logging
+
+from flask import Blueprint, current_app, jsonify, request
+from flask_jwt_extended import get_jwt_identity, jwt_required
+from sqlalchemy import and_, func, update
+
+from apps.db_routing import read_replica
+from apps.models import db, ChatGroup, GroupMember, GroupMessage, User, UserChatList
+from apps.offload import decrypt_many
+from apps.compression import compressed
+from apps.routes.socket import emit_event, set_group_room
+
+logger = logging.getLogger(__name__)
+
+group_bp = Blueprint('group', __name__)
+
+
+def _membership(group_id, user_id):
+    return GroupMember.query.filter_by(group_id=group_id, user_id=user_id).first()
+
+
+def _user_ids(values):
+    """Distinct ints from a JSON list, or None if it isn't a list of ids."""
+    if not isinstance(values, list):
+        return None
+    try:
+        return sorted({int(value) for value in values})
+    except (TypeError, ValueError):
+        return None
+
+
+def _addable(my_id, user_ids):
+    """The ids in `user_ids` that are in my chat list and not blocked by me."""
+    if not user_ids:
+        return []
+    return [uid for (uid,) in db.session.query(UserChatList.other_user_id).filter(
+        UserChatList.user_id == my_id,
+        UserChatList.other_user_id.in_(user_ids),
+        UserChatList.is_blocked == False)]
+
+
+def _member_payload(member, user):
+    return {
+        "id": user.id,
+        "name": user.name,
+        "image_url": user.image_url,
+        "role": member.role,
+        "joined_at": member.joined_at.isoformat(),
+    }
+
+
+def _announce(event, group, user_ids):
+    for user_id in user_ids:
+        emit_event(event, group.to_dict(), room=f"user_{user_id}")
+
+
+@group_bp.route('/groups', methods=['POST'])
+@jwt_required()
+def create_group():
+    my_id = int(get_jwt_identity())
+    data = request.json or {}
+    name = (data.get('name') or '').strip()
+    if not name:
+        return jsonify({"msg": "Group name is required"}), 400
+    requested = _user_ids(data.get('member_ids', []))
+    if requested is None:
+        return jsonify({"msg": "member_ids must be a list of user ids"}), 400
+    member_ids = [uid for uid in _addable(my_id, requested) if uid != my_id]
+    if len(member_ids) + 1 > current_app.config.get('GROUP_MAX_MEMBERS', 5000):
+        return jsonify({"msg": "Too many members"}), 400
+
+    group = ChatGroup(name=name[:120], description=data.get('description'), created_by=my_id)
+    db.session.add(group)
+    db.session.flush()
+    db.session.add(GroupMember(group_id=group.id, user_id=my_id, role='admin'))
+    db.session.add_all(GroupMember(group_id=group.id, user_id=uid) for uid in member_ids)
+    db.session.commit()
+
+    set_group_room(group.id, [my_id, *member_ids])
+    _announce("group_added", group, member_ids)
+    logger.info("group created", extra={"group_id": group.id, "user_id": my_id, "members": len(member_ids) + 1})
+    return jsonify({**group.to_dict(), "member_count": len(member_ids) + 1, "role": "admin"}), 201
+
+
+@group_bp.route('/groups', methods=['GET'])
+@jwt_required()
+@read_replica
+def list_groups():
+    """My groups, most recently active first, with my unread count in each."""
+    my_id = int(get_jwt_identity())
+    rows = (db.session.query(ChatGroup, GroupMember)
+            .join(GroupMember, GroupMember.group_id == ChatGroup.id)
+            .filter(GroupMember.user_id == my_id)
+            .order_by(ChatGroup.last_message_id.desc(), ChatGroup.id.desc())
+            .all())
+    # One grouped count over the (group_id, id) index, above each of my watermarks
+    unread = dict(db.session.query(GroupMessage.group_id, func.count(GroupMessage.id))
+                  .join(GroupMember, and_(GroupMember.group_id == GroupMessage.group_id,
+                                          GroupMember.user_id == my_id))
+                  .filter(GroupMessage.id > GroupMember.last_read_message_id)
+                  .group_by(GroupMessage.group_id))
+    return jsonify([
+        {**group.to_dict(), "role": member.role, "last_read_message_id": member.last_read_message_id,
+         "unread_count": unread.get(group.id, 0)}
+        for group, member in rows
+    ])
+
+
+@group_bp.route('/groups/<int:group_id>', methods=['GET'])
+@jwt_required()
+@read_replica
+@compressed
+def get_group(group_id):
+    """The group and a page of its members (offset/limit)."""
+    my_id = int(get_jwt_identity())
+    me = _membership(group_id, my_id)
+    if me is None:
+        return jsonify({"msg": "Group not found"}), 404
+    offset = int(request.args.get('offset', 0))
+    limit = min(int(request.args.get('limit', 100)), 500)
+
+    group = db.session.get(ChatGroup, group_id)
+    member_count = GroupMember.query.filter_by(group_id=group_id).count()
+    members = (db.session.query(GroupMember, User)
+               .join(User, User.id == GroupMember.user_id)
+               .filter(GroupMember.group_id == group_id)
+               .order_by(GroupMember.id.asc())
+               .offset(offset).limit(limit).all())
+    return jsonify({
+        **group.to_dict(),
+        "role": me.role,
+        "last_read_message_id": me.last_read_message_id,
+        "member_count": member_count,
+        "members": [_member_payload(member, user) for member, user in members],
+    }), 200
+
+
+@group_bp.route('/groups/<int:group_id>/members', methods=['POST'])
+@jwt_required()
+def add_group_members(group_id):
+    my_id = int(get_jwt_identity())
+    me = _membership(group_id, my_id)
+    if me is None:
+        return jsonify({"msg": "Group not found"}), 404
+    if me.role != 'admin':
+        return jsonify({"msg": "Only admins can add members"}), 403
+    requested = _user_ids((request.json or {}).get('user_ids'))
+    if requested is None:
+        return jsonify({"msg": "user_ids must be a list of user ids"}), 400
+
+    existing = {uid for (uid,) in db.session.query(GroupMember.user_id).filter(
+        GroupMember.group_id == group_id, GroupMember.user_id.in_(requested))}
+    added = [uid for uid in _addable(my_id, requested) if uid not in existing]
+    member_count = GroupMember.query.filter_by(group_id=group_id).count()
+    if member_count + len(added) > current_app.config.get('GROUP_MAX_MEMBERS', 5000):
+        return jsonify({"msg": "Too many members"}), 400
+
+    group = db.session.get(ChatGroup, group_id)
+    # New members start with nothing unread; the history is still theirs to page through
+    db.session.add_all(GroupMember(group_id=group_id, user_id=uid, last_read_message_id=group.last_message_id)
+                       for uid in added)
+    db.session.commit()
+
+    set_group_room(group_id, added)
+    _announce("group_added", group, added)
+    return jsonify({"added": added, "member_count": member_count + len(added)}), 200
+
+
+@group_bp.route('/groups/<int:group_id>/members/<int:user_id>', methods=['DELETE'])
+@jwt_required()
+def remove_group_member(group_id, user_id):
+    """Leave the group (your own id) or, as an admin, remove someone."""
+    my_id = int(get_jwt_identity())
+    me = _membership(group_id, my_id)
+    if me is None:
+        return jsonify({"msg": "Group not found"}), 404
+    if user_id != my_id and me.role != 'admin':
+        return jsonify({"msg": "Only admins can remove members"}), 403
+    member = me if user_id == my_id else _membership(group_id, user_id)
+    if member is None:
+        return jsonify({"msg": "Not a member"}), 404
+
+    was_admin = member.role == 'admin'
+    db.session.delete(member)
+    db.session.flush()
+    if was_admin and not GroupMember.query.filter_by(group_id=group_id, role='admin').first():
+        # Never leave a group without an admin: the longest-standing member takes over
+        successor = GroupMember.query.filter_by(group_id=group_id).order_by(GroupMember.id.asc()).first()
+        if successor is not None:
+            successor.role = 'admin'
+    db.session.commit()
+
+    group = db.session.get(ChatGroup, group_id)
+    set_group_room(group_id, [user_id], joined=False)
+    _announce("group_removed", group, [user_id])
+    return jsonify({"ok": True}), 200
+
+
+@group_bp.route('/groups/<int:group_id>/messages', methods=['GET'])
+@jwt_required()
+@read_replica
+@compressed
+def get_group_messages(group_id):
+    """
+    A page of group history by message id: the newest `limit` messages before `before_id`
+    (scrolling back), or the oldest after `after_id` (catching up). Oldest first.
+    """
+    my_id = int(get_jwt_identity())
+    if _membership(group_id, my_id) is None:
+        return jsonify({"msg": "Group not found"}), 404
+    limit = min(int(request.args.get('limit', 30)), 200)
+    before_id = request.args.get('before_id', type=int)
+    after_id = request.args.get('after_id', type=int)
+
+    query = GroupMessage.query.filter(GroupMessage.group_id == group_id)
+    if after_id is not None:
+        messages = (query.filter(GroupMessage.id > after_id)
+                    .order_by(GroupMessage.id.asc()).limit(limit + 1).all())
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+    else:
+        if before_id is not None:
+            query = query.filter(GroupMessage.id < before_id)
+        messages = query.order_by(GroupMessage.id.desc()).limit(limit + 1).all()
+        has_more = len(messages) > limit
+        messages = messages[:limit][::-1]
+
+    contents = decrypt_many(msg.ciphertext for msg in messages)
+    return jsonify({
+        "messages": [msg.to_dict(content) for msg, content in zip(messages, contents)],
+        "has_more": has_more,
+    }), 200
+
+
+@group_bp.route('/groups/<int:group_id>/read', methods=['POST'])
+@jwt_required()
+def mark_group_read(group_id):
+    """Moves my read watermark forward to `message_id` (never back)."""
+    my_id = int(get_jwt_identity())
+    try:
+        message_id = int((request.json or {}).get('message_id'))
+    except (TypeError, ValueError):
+        return jsonify({"msg": "message_id is required"}), 400
+    member = _membership(group_id, my_id)
+    if member is None:
+        return jsonify({"msg": "Group not found"}), 404
+    group = db.session.get(ChatGroup, group_id)
+    message_id = min(message_id, group.last_message_id)
+
+    if message_id > member.last_read_message_id:
+        # Guarded so a stale request from another device can't move it back
+        db.session.execute(
+            update(GroupMember)
+            .where(GroupMember.id == member.id, GroupMember.last_read_message_id < message_id)
+            .values(last_read_message_id=message_id))
+        db.session.commit()
+    return jsonify({"last_read_message_id": max(message_id, member.last_read_message_id)}), 200
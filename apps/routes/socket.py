@@ -8,23 +8,176 @@ from flask import request
 from flask_socketio import SocketIO, join_room, leave_room, emit
 from flask_jwt_extended import decode_token
 from datetime import datetime, date
-from apps.models import db, Message, UserChatList, FriendRequest, User, Notification # Import User and FriendRequest
+from apps.models import db, Message, UserChatList, FriendRequest, User, Notification, ChatGroup, GroupMember, GroupMessage # Import User and FriendRequest
 from apps.utils import get_chat_room_name, decrypt_message, encrypt_message
+from apps.db_routing import note_write
+from apps.archive import find_message
+from apps.account_purge import is_deleted_account
+from apps.suggestions import invalidate_friend_graph
+from apps.pins import apply_pin
+from apps.changes import record_change
+from apps.replay import ReplayBuffer
+from apps.http_cache import bump_version
+from apps.message_cache import message_cache
+from apps import compact
+from apps.backpressure import backpressure
+from apps.ratelimit import limiter
+from apps.metrics import Gauge, emit_fanout, timed_event
+from apps import profiler
+from sqlalchemy import update
 from zoneinfo import ZoneInfo
+import logging
+from apps.log import SampledLogger
 # Initialize SocketIO without the app object yet
 socketio = SocketIO()
 
+logger = logging.getLogger(__name__)
+# typing fires on every keystroke; keep one debug record in 100
+typing_logger = SampledLogger(logger, every=100)
+# a client over its limit keeps sending; rejections are counted in rate_limit_rejections
+rate_limited_logger = SampledLogger(logger, every=100)
+
 IST = ZoneInfo("Asia/Kolkata")
 
 online_users = set()
 
+# Recent new_message / message_edited / message_deleted / chat_pins_updated / notification
+# events per user, replayed to clients that reconnect with their last seen seq
+replay_buffer = ReplayBuffer()
+
+
+# sids of clients that connected with {"encoding": "msgpack"} (see apps/compact.py)
+compact_sids = set()
+
+# MESSAGE_ROUTING: where new_message, message_edited, message_deleted and typing go.
+#   "chat_room"  - the chat_{a}_{b} room, which a client joins per open chat (join_chat)
+#   "user_rooms" - both users' personal rooms, joined on connect, in one multi-room emit;
+#                  join_chat isn't needed and recipients get messages for chats they haven't opened
+ROUTING_MODES = ("chat_room", "user_rooms")
+message_routing = "chat_room"
+
+
+def conversation_rooms(user_a_id, user_b_id):
+    """Room (or rooms) for the events of the a-b conversation under MESSAGE_ROUTING."""
+    if message_routing == "user_rooms":
+        return sorted({f"user_{user_a_id}", f"user_{user_b_id}"})
+    return get_chat_room_name(user_a_id, user_b_id)
+
+
+def _room_size(room):
+    """Connected sids in `room` (None: every client; a list: any of those rooms) on this server."""
+    if isinstance(room, list):
+        return sum(1 for _ in socketio.server.manager.get_participants("/", room)) if room else 0
+    return len(socketio.server.manager.rooms.get("/", {}).get(room, ()))
+
+
+connected_clients = Gauge("socket_connected_clients", "Connected Socket.IO clients.",
+                          function=lambda: _room_size(None) if socketio.server else 0)
+
+
+def emit_event(event, payload, room=None):
+    """
+    socketio.emit for server-initiated events. JSON clients in `room` (everyone if None,
+    a list of rooms is one emit to all of them) get the payload as is; compact clients
+    get it packed once and sent to their sid.
+    """
+    emit_fanout.labels(event).observe(_room_size(room))
+    # Sessions too far behind don't get typing/presence updates (apps.backpressure)
+    skip = backpressure.skip_for(event, room)
+    if compact_sids:
+        if room is None:
+            targets = set(compact_sids)
+        else:
+            targets = compact_sids.intersection(
+                sid for sid, _ in socketio.server.manager.get_participants("/", room))
+        targets.difference_update(skip)
+        if targets:
+            socketio.emit(event, payload, room=room, skip_sid=list(targets) + skip)
+            packed = compact.pack(payload)
+            for sid in targets:
+                socketio.emit(event, packed, to=sid)
+            return
+    socketio.emit(event, payload, room=room, skip_sid=skip or None)
+
+
+def emit_replayable(event, payload, user_ids, room=None):
+    """
+    Emits an event that reconnecting clients can replay. The payload gets a "seq".
+    Sent to `room` (or list of rooms) if given, otherwise to each user's personal room.
+    """
+    stamped = replay_buffer.record(user_ids, event, payload)
+    if room:
+        emit_event(event, stamped, room=room)
+    else:
+        for user_id in user_ids:
+            emit_event(event, stamped, room=f"user_{user_id}")
+
+
+def token_user_id(token):
+    """
+    The user id in a socket event's JWT. Raises like decode_token for a bad token, and for
+    accounts deleted since it was issued (decode_token doesn't check the blocklist).
+    """
+    user_id = int(decode_token(token)['sub'])
+    if is_deleted_account(user_id):
+        raise PermissionError("account deleted")
+    return user_id
+
+
+def disconnect_user(user_id):
+    """Closes every socket session of `user_id` (all are in its personal room)."""
+    if socketio.server is None:
+        return
+    for sid, _ in list(socketio.server.manager.get_participants("/", f"user_{user_id}")):
+        socketio.server.disconnect(sid, namespace="/")
+
+
+def over_limit(event, user_id, notify=True):
+    """
+    True if `user_id` has used up its `event` tokens (apps/ratelimit.py). The caller drops
+    the event; unless `notify` is off the client is sent when it may try again.
+    """
+    retry_after = limiter.hit(event, f"user:{user_id}")
+    if not retry_after:
+        return False
+    rate_limited_logger.info("%s rate limited", event, extra={"user_id": user_id, "retry_after": retry_after})
+    if notify:
+        emit("rate_limited", {"event": event, "retry_after": round(retry_after, 2)})
+    return True
+
+
+def group_room(group_id):
+    return f"group_{group_id}"
+
+
+def set_group_room(group_id, user_ids, joined=True):
+    """Adds (or removes) the connected sessions of `user_ids` to the group's room after a membership change."""
+    server = socketio.server
+    if server is None:
+        return
+    room = group_room(group_id)
+    for user_id in user_ids:
+        for sid, _ in list(server.manager.get_participants("/", f"user_{user_id}")):
+            if joined:
+                server.enter_room(sid, room, namespace="/")
+            else:
+                server.leave_room(sid, room, namespace="/")
+
 
 def register_socket_handlers(app):
     """Registers the SocketIO handlers with the initialized app."""
     # Since socketio is initialized globally, we only need to call it once
+    replay_buffer.configure(per_user=app.config.get('REPLAY_BUFFER_SIZE'),
+                            max_users=app.config.get('REPLAY_BUFFER_MAX_USERS'))
+    global message_routing
+    message_routing = app.config.get('MESSAGE_ROUTING', 'chat_room')
+    if message_routing not in ROUTING_MODES:
+        logger.warning("unknown MESSAGE_ROUTING %r, using chat_room", message_routing)
+        message_routing = "chat_room"
     
     
     @socketio.on('connect')
+    @timed_event('connect')
     def socket_connect(auth):
         """Authenticates the client connection using JWT."""
         # ... (keep existing logic for connect) ...
@@ -35,27 +188,63 @@ def register_socket_handlers(app):
             token = request.args.get('token')
 
         if not token:
-            print("Socket auth failed: No token provided")
+            logger.info("socket auth failed: no token", extra={"sid": request.sid})
             return False
 
         try:
-            decoded = decode_token(token)
-            user_id = int(decoded['sub'])
+            user_id = token_user_id(token)
             
-            # 1. Join a personal room for notifications
+            # Compact encoding is negotiated here and holds for the whole connection
+            use_compact = bool(auth and auth.get('encoding') == 'msgpack' and compact.available())
+            if use_compact:
+                compact_sids.add(request.sid)
+
+            backpressure.start(socketio)
+
+            # 1. Join a personal room for notifications, and a room per group chat
             join_room(f"user_{user_id}")
+            for (group_id,) in db.session.query(GroupMember.group_id).filter_by(user_id=user_id):
+                join_room(group_room(group_id))
             online_users.add(user_id)
+            bump_version("presence", user_id)
 
             # Broadcast presence (true)
-            socketio.emit("presence_update", {
+            emit_event("presence_update", {
                 "user_id": user_id,
                 "online": True,
                 "last_seen": None
             }) 
-            print(f"Socket connected for user {user_id}. Joined room user_{user_id}")
+            logger.info("socket connected", extra={"user_id": user_id, "sid": request.sid, "compact": use_compact})
+
+            # Replay what this client missed while disconnected, if it tells us where it left off
+            replayed, resync = 0, False
+            if auth and auth.get('last_seq') is not None:
+                missed = None
+                try:
+                    last_seq = int(auth['last_seq'])
+                except (TypeError, ValueError):
+                    last_seq = None  # not a seq we handed out: resync rather than refuse the connection
+                if last_seq is not None and auth.get('epoch') == replay_buffer.epoch:
+                    missed = replay_buffer.since(user_id, last_seq)
+                if missed is None:
+                    resync = True
+                else:
+                    for event, payload in missed:
+                        emit(event, compact.pack(payload) if use_compact else payload)
+                    replayed = len(missed)
+            # Always JSON: it tells the client which encoding the rest of the connection uses
+            emit("replay_state", {
+                "epoch": replay_buffer.epoch,
+                "seq": replay_buffer.seq,
+                "replayed": replayed,
+                "resync": resync, # True: the gap is gone, refetch (or /api/sync)
+                "encoding": "msgpack" if use_compact else "json",
+            })
             
         except Exception as e:
-            print(f"Socket auth failed: {e}")
+            logger.info("socket auth failed: %s", e, extra={"sid": request.sid})
+            # A refused connection never gets a disconnect event to clean up after it
+            compact_sids.discard(request.sid)
             return False
         
     
@@ -88,7 +277,9 @@ def register_socket_handlers(app):
     
     
     @socketio.on("disconnect")
+    @timed_event("disconnect")
     def handle_disconnect():
+        compact_sids.discard(request.sid)
         try:
             token = request.args.get("token")
             if not token:
@@ -100,6 +291,7 @@ def register_socket_handlers(app):
             # ✅ Remove from in-memory set
             if user_id in online_users:
                 online_users.remove(user_id)
+            bump_version("presence", user_id)
 
             # ✅ Update last_seen in DB (with app context)
             # from apps.routes.__init__ import create_app
@@ -113,21 +305,21 @@ def register_socket_handlers(app):
             #         print(f"✅ Updated last_seen for user {user_id}:", user.last_seen)
 
             # ✅ Broadcast presence update to all
-            socketio.emit(
+            emit_event(
                 "presence_update",
                 {
                     "user_id": user_id,
                     "online": False,
                     "last_seen": datetime.now(IST).isoformat(),
                 },
-                broadcast=True,
             )
 
-        except Exception as e:
-            print("❌ Disconnect error:", e)
+        except Exception:
+            logger.exception("disconnect handling failed")
             
 
     @socketio.on('join_chat')
+    @timed_event('join_chat')
     def on_join_chat(data):
         """Joins the specific chat room for two users."""
         # ... (keep existing logic for join_chat) ...
@@ -136,44 +328,51 @@ def register_socket_handlers(app):
         
         if not (token and other_id):
             return
+        if message_routing == "user_rooms":
+            # Conversation events already reach the personal room joined on connect
+            return
 
         try:
-            my_id = int(decode_token(token)['sub'])
+            my_id = token_user_id(token)
             other_id = int(other_id)
             
             # Check if user has "added" the other person (optional security layer)
             if not UserChatList.query.filter_by(user_id=my_id, other_user_id=other_id).first():
-                 print(f"user {my_id} tried to join chat with {other_id} but not in chat list.")
+                 logger.warning("join_chat refused: not in chat list", extra={"user_id": my_id, "other_id": other_id})
                  return # Fail silently or emit an error
 
             a, b = sorted([my_id, other_id])
             room = f"chat_{a}_{b}"
             join_room(room)
-            print(f"user {my_id} joined chat room {room}")
+            logger.debug("joined chat room %s", room, extra={"user_id": my_id})
             
         except Exception as e:
-            print(f"join_chat failed: {e}")
+            logger.info("join_chat failed: %s", e)
             
             
     @socketio.on("typing")
+    @timed_event("typing")
     def handle_typing(data):
         # data: {token, to_id, is_typing: bool}
         token = data.get("token"); to_id = data.get("to_id"); is_typing = data.get("is_typing")
         if not (token and to_id is not None): return
         try:
-            my_id = int(decode_token(token)["sub"])
+            my_id = token_user_id(token)
             to_id = int(to_id)
         except Exception as e:
-            print("typing auth error:", e); return
+            logger.info("typing auth error: %s", e); return
+        # The next keystroke sends a fresh one; don't answer a flood with more events
+        if over_limit("typing", my_id, notify=False):
+            return
 
-        # Only emit inside the A-B room so C never receives it
-        a, b = sorted([my_id, to_id])
-        room = f"chat_{a}_{b}"
-        socketio.emit("typing", {
+        # Only emit inside the A-B room (or to B's own room) so C never receives it
+        room = f"user_{to_id}" if message_routing == "user_rooms" else get_chat_room_name(my_id, to_id)
+        emit_event("typing", {
             "from_id": my_id,
             "to_id": to_id,
             "is_typing": bool(is_typing)
         }, room=room)
+        typing_logger.debug("typing", extra={"user_id": my_id, "to_id": to_id})
 
     # @socketio.on('send_message')
     # def handle_send_message(data):
@@ -242,6 +441,7 @@ def register_socket_handlers(app):
 
 
     @socketio.on('send_message')
+    @timed_event('send_message')
     def handle_send_message(data):
         """Receives a message, saves it, and broadcasts it."""
         token = data.get('token')
@@ -253,19 +453,27 @@ def register_socket_handlers(app):
         
         # 🌟 FIX 1: The message is valid if it has (token, to_id) AND (content OR media_url)
         if not (token and to_id and (content or media_url)):
-            print(f"socket error: Missing required fields for send_message. Content: {content}, Media: {media_url}")
+            logger.info("send_message rejected: missing fields", extra={"has_content": bool(content), "has_media": bool(media_url)})
             return
 
         try:
-            my_id = int(decode_token(token)['sub'])
+            my_id = token_user_id(token)
             to_id = int(to_id)
         except Exception as e:
-            print(f"socket auth error on send_message: {e}")
+            logger.info("send_message auth error: %s", e)
+            return
+
+        if over_limit("send_message", my_id):
+            return
+
+        # The chat list outlives a deleted account until its purge reaches it
+        if is_deleted_account(to_id):
+            logger.info("send_message refused: recipient deleted", extra={"user_id": my_id, "to_id": to_id})
             return
 
         # Check if user is allowed to chat (in their chat list)
         if not UserChatList.query.filter_by(user_id=my_id, other_user_id=to_id).first():
-            print(f"User {my_id} not allowed to send message to {to_id}.")
+            logger.warning("send_message refused: not in chat list", extra={"user_id": my_id, "to_id": to_id})
             return
         
         
@@ -277,20 +485,25 @@ def register_socket_handlers(app):
             new_message = Message(
                 sender_id=my_id,
                 receiver_id=to_id,
-                content=encrypted_content,
+                content_bin=encrypted_content,
                 timestamp=datetime.utcnow(),
                 media_url=media_url,
                 media_type=media_type,
             )
             db.session.add(new_message)
             
-            # 2. COMMIT: Save the message instantly. 
+            # 2. COMMIT: Save the message instantly, with its change log rows for /api/sync
             try:
+                db.session.flush()
+                record_change([my_id, to_id], 'message', new_message.id)
                 db.session.commit()
-            except Exception as e:
+            except Exception:
                 db.session.rollback()
-                print(f"Failed to save message to DB: {e}")
+                logger.exception("failed to save message", extra={"user_id": my_id, "to_id": to_id})
                 return
+            # Both sides may open the chat right away: read their history from the primary
+            note_write(my_id, to_id)
+            message_cache.add(new_message, content)
             
             # 3. Prepare the broadcast payload
             msg_payload = {
@@ -304,15 +517,77 @@ def register_socket_handlers(app):
                 'media_type': media_type
             }
             
-            # 4. Determine the room name (must be consistent with on_join_chat)
-            a, b = sorted([my_id, to_id])
-            room = f"chat_{a}_{b}"
+            # 4. Determine the room name (must be consistent with on_join_chat and MESSAGE_ROUTING)
+            room = conversation_rooms(my_id, to_id)
             
             # 5. Broadcast the message to the room
-            socketio.emit("new_message", msg_payload, room=room)
-            print(f"Message sent to room {room} and saved to DB.")
+            emit_replayable("new_message", msg_payload, [my_id, to_id], room=room)
+            logger.debug("message sent", extra={"message_id": new_message.id, "room": room})
+
+    @socketio.on('send_group_message')
+    @timed_event('send_group_message')
+    def handle_send_group_message(data):
+        """
+        Stores one row for the whole group and emits it once to the group's room; members
+        who were offline read it from GET /api/groups/<id>/messages.
+        """
+        token = data.get('token')
+        group_id = data.get('group_id')
+        content = data.get('content')
+        media_url = data.get('media_url')
+        media_type = data.get('media_type')
+
+        if not (token and group_id and (content or media_url)):
+            logger.info("send_group_message rejected: missing fields", extra={"has_content": bool(content), "has_media": bool(media_url)})
+            return
+
+        try:
+            my_id = token_user_id(token)
+            group_id = int(group_id)
+        except Exception as e:
+            logger.info("send_group_message auth error: %s", e)
+            return
+
+        if over_limit("send_group_message", my_id):
+            return
+
+        membership = GroupMember.query.filter_by(group_id=group_id, user_id=my_id).first()
+        if membership is None:
+            logger.warning("send_group_message refused: not a member", extra={"user_id": my_id, "group_id": group_id})
+            return
+
+        message = GroupMessage(
+            group_id=group_id,
+            sender_id=my_id,
+            content_bin=encrypt_message(content),
+            timestamp=datetime.utcnow(),
+            media_url=media_url,
+            media_type=media_type,
+        )
+        db.session.add(message)
+        try:
+            db.session.flush()
+            # Guarded: concurrent sends can commit out of id order, and neither value may move back
+            db.session.execute(update(ChatGroup)
+                               .where(ChatGroup.id == group_id, ChatGroup.last_message_id < message.id)
+                               .values(last_message_id=message.id))
+            # The sender has read everything up to their own message
+            db.session.execute(update(GroupMember)
+                               .where(GroupMember.id == membership.id,
+                                      GroupMember.last_read_message_id < message.id)
+                               .values(last_read_message_id=message.id))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("failed to save group message", extra={"user_id": my_id, "group_id": group_id})
+            return
+
+        room = group_room(group_id)
+        emit_event("new_group_message", message.to_dict(content or ''), room=room)
+        logger.debug("group message sent", extra={"message_id": message.id, "room": room})
 
     @socketio.on('send_friend_request')
+    @timed_event('send_friend_request')
     def handle_send_friend_request(data):
         """Creates a friend request and notifies the receiver."""
         token = data.get('token')
@@ -321,10 +596,13 @@ def register_socket_handlers(app):
         if not (token and receiver_id): return
         
         try:
-            my_id = int(decode_token(token)['sub'])
+            my_id = token_user_id(token)
             receiver_id = int(receiver_id)
         except Exception as e:
-            print(f"socket auth error on send_friend_request: {e}")
+            logger.info("send_friend_request auth error: %s", e)
+            return
+
+        if over_limit("send_friend_request", my_id):
             return
             
         if my_id == receiver_id: return # Cannot send request to self
@@ -337,12 +615,12 @@ def register_socket_handlers(app):
             ).first()
             
             if existing_req:
-                print("Request already exists or is pending.")
+                logger.debug("friend request already pending", extra={"user_id": my_id, "receiver_id": receiver_id})
                 return
 
             # Check if already in chat list
             if UserChatList.query.filter_by(user_id=my_id, other_user_id=receiver_id).first():
-                print("Already added.")
+                logger.debug("friend request for an existing chat", extra={"user_id": my_id, "receiver_id": receiver_id})
                 return
 
             sender_user = User.query.get(my_id)
@@ -351,6 +629,8 @@ def register_socket_handlers(app):
             # Create request
             new_request = FriendRequest(sender_id=my_id, receiver_id=receiver_id)
             db.session.add(new_request)
+            db.session.flush()
+            record_change(receiver_id, 'friend_request', new_request.id)
             db.session.commit()
             
             # Prepare notification payload
@@ -363,16 +643,17 @@ def register_socket_handlers(app):
             }
             
             # Notify receiver
-            socketio.emit("notification", payload, room=f"user_{receiver_id}")
-            print(f"Sent friend request from {my_id} to {receiver_id}. Notified room user_{receiver_id}")
+            emit_replayable("notification", payload, [receiver_id])
+            logger.debug("friend request sent", extra={"user_id": my_id, "receiver_id": receiver_id})
             
             # Also notify sender that the request was sent successfully
             # Optional: Add status to DB and fetch on connect to persist
-            socketio.emit("request_sent", {"receiver_id": receiver_id}, room=f"user_{my_id}")
+            emit_event("request_sent", {"receiver_id": receiver_id}, room=f"user_{my_id}")
 
     # In apps/routes/socket.py
 
     @socketio.on('respond_friend_request')
+    @timed_event('respond_friend_request')
     def handle_respond_friend_request(data):
         """Handles accepting or rejecting a friend request, and creates persistent notifications."""
         token = data.get('token')
@@ -382,17 +663,17 @@ def register_socket_handlers(app):
         if not (token and request_id and action): return
         
         try:
-            my_id = int(decode_token(token)['sub'])
+            my_id = token_user_id(token)
             request_id = int(request_id)
         except Exception as e:
-            print(f"socket auth error on respond_friend_request: {e}")
+            logger.info("respond_friend_request auth error: %s", e)
             return
             
         with app.app_context():
             request_obj = FriendRequest.query.get(request_id)
             
             if not request_obj or request_obj.receiver_id != my_id:
-                print(f"Invalid request ID or user {my_id} is not the receiver.")
+                logger.warning("respond_friend_request refused: unknown request or not the receiver", extra={"user_id": my_id})
                 return
             
             sender_id = request_obj.sender_id
@@ -465,6 +746,14 @@ def register_socket_handlers(app):
             # Mark the request for deletion
             db.session.delete(request_obj)
 
+            db.session.flush()
+            record_change(my_id, 'friend_request', request_id)
+            record_change(sender_id, 'notification', sender_notification.id)
+            record_change(my_id, 'notification', receiver_notification.id)
+            if action == 'accept':
+                record_change(my_id, 'chat', sender_id)
+                record_change(sender_id, 'chat', my_id)
+
             # Final DB Commit (CRITICAL: Safely commit all pending changes)
             try:
                 db.session.commit()
@@ -473,23 +762,27 @@ def register_socket_handlers(app):
                 sender_response_payload['id'] = sender_notification.id
                 receiver_response_payload['id'] = receiver_notification.id
                 
+                note_write(sender_id, my_id)
+                if action == 'accept':
+                    invalidate_friend_graph(sender_id, my_id)
+                    bump_version('chatlist', sender_id, my_id)
+
                 # Emit socket events now that the database is safe
                 if action == 'accept':
                     # Notify sender and receiver to update their chat list
-                    socketio.emit("chat_list_update", connection_payload, room=f"user_{sender_id}")
-                    socketio.emit("chat_list_update", connection_payload, room=f"user_{my_id}")
+                    emit_event("chat_list_update", connection_payload, room=f"user_{sender_id}")
+                    emit_event("chat_list_update", connection_payload, room=f"user_{my_id}")
                     
                 # Emit response to the requester (sender)
-                socketio.emit("notification", sender_response_payload, room=f"user_{sender_id}")
+                emit_replayable("notification", sender_response_payload, [sender_id])
                 # Emit response to the responder (receiver)
-                socketio.emit("notification", receiver_response_payload, room=f"user_{my_id}")
+                emit_replayable("notification", receiver_response_payload, [my_id])
 
 
             except Exception as e:
                 # If commit fails (e.g., unique constraint violation), ROLLBACK all pending changes
                 db.session.rollback()
-                print(f"!!! CRITICAL DB ERROR in handle_respond_friend_request: {e}")
-                print("!!! Transaction rolled back. Chat list was NOT saved.")
+                logger.exception("respond_friend_request failed; transaction rolled back", extra={"user_id": my_id})
                 return
             
          
@@ -497,40 +790,42 @@ def register_socket_handlers(app):
     # 💡 FIX 1: Message Editing (The change must be broadcast)
     # =========================================================
     @socketio.on('edit_message')
+    @timed_event('edit_message')
     def handle_edit_message(data):
         try:
             # 💡 FIX: Decode the token to get the actual user_id
             token = data.get('token')
             if not token: return
-            auth_user_id = int(decode_token(token)['sub']) # Correctly get the user ID
+            auth_user_id = token_user_id(token) # Correctly get the user ID
             
             message_id = data.get('message_id')
             new_content = data.get('new_content')
             
-            print("TOKEN WE GET IN EIDT MESSAGE--", token)
-            print("auth_user_id WE GET IN EIDT MESSAGE--", auth_user_id)
-            print("message_id WE GET IN EIDT MESSAGE--", message_id)
-            print("new_content WE GET IN EIDT MESSAGE--", new_content)
+            logger.debug("edit_message", extra={"user_id": auth_user_id, "message_id": message_id})
             
             encrypted_content = encrypt_message(new_content)
             
             # --- Inside app context for DB operations ---
             with app.app_context(): 
-                message = Message.query.get(message_id)
+                message = find_message(message_id)
                 # 💡 FIX: Compare sender_id with the *authenticated* user ID
                 if not message or message.sender_id != auth_user_id:
-                    print(f"Auth error: User {auth_user_id} tried to edit message {message_id} which they didn't send.")
+                    logger.warning("edit_message refused: not the sender", extra={"user_id": auth_user_id, "message_id": message_id})
                     return
 
                 # 1. Update the database record
-                message.content = encrypted_content
+                message.content_bin = encrypted_content
+                message.content = ''
                 message.is_edited = True
+                record_change([message.sender_id, message.receiver_id], 'message', message.id)
                 db.session.commit()
+                note_write(message.sender_id, message.receiver_id)
+                message_cache.update(message, new_content)
 
                 # 2. Identify the room and broadcast the change
                 # Get the ID of the other user in the chat
                 other_user_id = message.receiver_id if message.sender_id == auth_user_id else message.sender_id
-                chat_room = get_chat_room_name(auth_user_id, other_user_id)
+                chat_room = conversation_rooms(auth_user_id, other_user_id)
                 
                 payload = {
                     'message_id': message.id,
@@ -538,40 +833,38 @@ def register_socket_handlers(app):
                     'is_edited': True,
                 }
                 # Emit to the chat room so both users get the updated message
-                socketio.emit('message_edited', payload, room=chat_room) 
+                emit_replayable('message_edited', payload, [auth_user_id, other_user_id], room=chat_room)
             
-        except Exception as e:
+        except Exception:
             # The 'app.app_context()' is needed for 'db.session.rollback()', 
             # or the rollback should be handled after getting the context.
             # Assuming 'db' is available outside the context if the handler is registered correctly, 
             # but it's safer to wrap all DB calls in 'with app.app_context():'
             # db.session.rollback() # If within an app context
-            print(f"ERROR during message edit: {e}")
+            logger.exception("edit_message failed")
             return
 
     # =========================================================
     # 💡 FIX 2: Message Deletion (The change must be broadcast)
     # =========================================================
     @socketio.on('delete_message')
+    @timed_event('delete_message')
     def handle_delete_message(data):
         try:
             # 💡 FIX: Decode the token to get the actual user_id
             token = data.get('token')
             if not token: return
-            auth_user_id = int(decode_token(token)['sub']) # Correctly get the user ID
+            auth_user_id = token_user_id(token) # Correctly get the user ID
             
             message_id = data.get('message_id')
             action = data.get('action') # 'delete_for_me' or 'delete_for_everyone'
 
                 
-            print("TOKEN WE GET IN EIDT MESSAGE--", token)
-            print("auth_user_id WE GET IN EIDT MESSAGE--", auth_user_id)
-            print("message_id WE GET IN EIDT MESSAGE--", message_id)
-            print("action WE GET IN EIDT MESSAGE--", action)
+            logger.debug("delete_message", extra={"user_id": auth_user_id, "message_id": message_id, "action": action})
             
             # --- Inside app context for DB operations ---
             with app.app_context():
-                message = Message.query.get(message_id)
+                message = find_message(message_id)
                 if not message:
                     return
 
@@ -580,11 +873,14 @@ def register_socket_handlers(app):
                     if message.sender_id == auth_user_id:
                         # 1. Update the database flag
                         message.is_deleted_for_everyone = True
+                        record_change([message.sender_id, message.receiver_id], 'message', message.id)
                         db.session.commit()
+                        note_write(message.sender_id, message.receiver_id)
+                        message_cache.update(message)
                         
                         # 2. Identify the room and broadcast the change
                         other_user_id = message.receiver_id if message.sender_id == auth_user_id else message.sender_id
-                        chat_room = get_chat_room_name(auth_user_id, other_user_id)
+                        chat_room = conversation_rooms(auth_user_id, other_user_id)
                         
                         payload = {
                             'message_id': message.id,
@@ -592,9 +888,9 @@ def register_socket_handlers(app):
                             'action': 'delete_for_everyone', 
                         }
                         # Emit to the chat room so both users see the deletion
-                        socketio.emit('message_deleted', payload, room=chat_room)
+                        emit_replayable('message_deleted', payload, [auth_user_id, other_user_id], room=chat_room)
                     else:
-                        print(f"Auth error: User {auth_user_id} tried to 'delete_for_everyone' message {message_id} which they didn't send.")
+                        logger.warning("delete_for_everyone refused: not the sender", extra={"user_id": auth_user_id, "message_id": message_id})
                         return # User must be the sender for 'delete_for_everyone'
                         
                 elif action == 'delete_for_me':
@@ -603,95 +899,54 @@ def register_socket_handlers(app):
                     if message.sender_id == auth_user_id:
                         # User is the sender, mark it as deleted for the sender
                         message.is_deleted_for_sender = True
-                        print(f"DEBUG: Message {message_id} marked as DELETED FOR SENDER (User {auth_user_id})")
+                        logger.debug("message deleted for sender", extra={"user_id": auth_user_id, "message_id": message_id})
                     elif message.receiver_id == auth_user_id:
                         # User is the receiver, mark it as deleted for the recipient
                         message.is_deleted_for_recipient = True
-                        print(f"DEBUG: Message {message_id} marked as DELETED FOR RECIPIENT (User {auth_user_id})")
+                        logger.debug("message deleted for recipient", extra={"user_id": auth_user_id, "message_id": message_id})
+                    record_change(auth_user_id, 'message_deleted', message.id)
                     db.session.commit() # Save the change to the database
+                    note_write(auth_user_id)
+                    message_cache.update(message)
                     
                     # Emit a confirmation to the user's private room as intended:
                     payload = {
                         'message_id': message.id,
                         'action': 'delete_for_me',
                     }
-                    emit('message_deleted', payload, room=f"user_{auth_user_id}")
+                    emit_replayable('message_deleted', payload, [auth_user_id])
                 
-        except Exception as e:
+        except Exception:
             # db.session.rollback() # If within an app context
-            print(f"ERROR during message delete: {e}")
+            logger.exception("delete_message failed")
             return
         
         
     #  PINNED CHATTES
     @socketio.on("pin_chat")
+    @timed_event("pin_chat")
     def handle_pin_chat(data):
         token = data.get("token")
         other_user_id = int(data.get("other_user_id"))
         should_pin = bool(data.get("pin", True))
 
         try:
-            my_id = int(decode_token(token)['sub'])
+            my_id = token_user_id(token)
         except Exception as e:
-            print(f"pin_chat auth error: {e}")
+            logger.info("pin_chat auth error: %s", e)
             return
 
         with app.app_context():
-            entry = UserChatList.query.filter_by(user_id=my_id, other_user_id=other_user_id).first()
-            if not entry:
+            pins = apply_pin(my_id, other_user_id, should_pin)
+            if pins is None:
                 return
+            note_write(my_id)
 
-            pins = (UserChatList.query
-                    .filter_by(user_id=my_id)
-                    .filter(UserChatList.pin_priority > 0)
-                    .order_by(UserChatList.pin_priority.asc())
-                    .all())
-
-            if should_pin:
-                if (entry.pin_priority or 0) > 0:
-                    old_pri = entry.pin_priority or 0
-                    for p in pins:
-                        if p.id == entry.id:
-                            continue
-                        if (p.pin_priority or 0) < old_pri:
-                            p.pin_priority = (p.pin_priority or 0) + 1
-                    entry.pin_priority = 1
-                else:
-                    for p in pins:
-                        p.pin_priority = min((p.pin_priority or 0) + 1, 3)
-                    entry.pin_priority = 1
-
-
-                overflow = (UserChatList.query
-                            .filter_by(user_id=my_id)
-                            .filter(UserChatList.pin_priority > 3)
-                            .all())
-                for p in overflow:
-                    p.pin_priority = 0
-            else:
-                removed_pri = entry.pin_priority
-                entry.pin_priority = 0
-                if removed_pri > 0:
-                    for p in pins:
-                        if p.id != entry.id and p.pin_priority > removed_pri:
-                            p.pin_priority -= 1
-
-            db.session.commit()
-
-            new_pins = (UserChatList.query
-                .filter_by(user_id=my_id)
-                .filter(UserChatList.pin_priority > 0)
-                .with_entities(UserChatList.other_user_id, UserChatList.pin_priority)
-                .order_by(UserChatList.pin_priority.asc())
-                .all())
-
-            payload = {
-                "pins": [{"other_user_id": uid, "pin_priority": pri} for (uid, pri) in new_pins]
-            }
-            socketio.emit("chat_pins_updated", payload, room=f"user_{my_id}")
+            emit_replayable("chat_pins_updated", {"pins": pins}, [my_id])
       
     # TOOGEELE FAVOURITES
     @socketio.on("toggle_favorite")
+    @timed_event("toggle_favorite")
     def handle_toggle_favorite(data):
         token = data.get("token")
         other_user_id = data.get("other_user_id")
@@ -701,20 +956,23 @@ def register_socket_handlers(app):
             return
 
         try:
-            my_id = int(decode_token(token)["sub"])
+            my_id = token_user_id(token)
             other_user_id = int(other_user_id)
         except Exception as e:
-            print(f"Socket auth error in toggle_favorite: {e}")
+            logger.info("toggle_favorite auth error: %s", e)
             return
 
         with app.app_context():
             chat_entry = UserChatList.query.filter_by(user_id=my_id, other_user_id=other_user_id).first()
             if chat_entry:
                 chat_entry.is_favorite = favorite
+                record_change(my_id, 'chat', other_user_id)
                 db.session.commit()
+                bump_version('chatlist', my_id)
+                note_write(my_id)
 
                 # Notify frontend to update
-                socketio.emit(
+                emit_event(
                     "favorites_updated",
                     {"user_id": my_id, "favorites": [{"other_user_id": other_user_id, "is_favorite": favorite}]},
                     room=f"user_{my_id}"
@@ -732,7 +990,8 @@ def notify_new_user(user):
     }
 
     # 1. Save the notification for ALL users (can be optimized to only connected/active users)
-    all_users = User.query.filter(User.id != user.id).all() # Notify everyone except the new user
+    all_users = User.query.filter(User.id != user.id, User.deleted_at == None).all() # Notify everyone except the new user
+    notifications = []
     for receiver in all_users:
         new_notification = Notification(
             user_id=receiver.id,
@@ -741,17 +1000,19 @@ def notify_new_user(user):
             actor_id=user.id # The new user is the actor
         )
         db.session.add(new_notification)
+        notifications.append(new_notification)
+    db.session.flush()
+    for n in notifications:
+        record_change(n.user_id, 'notification', n.id)
     db.session.commit()
 
     # 2. Emit the real-time notification
     # socketio.emit("notification", payload)
     
-    for receiver in all_users:
-        socketio.emit(
-            "notification",
-            payload,
-            room=f"user_{receiver.id}"
-        )
+    # One broadcast, not replayable: recording it for every user would push the replay
+    # buffer past REPLAY_BUFFER_MAX_USERS on each signup and turn every reconnect into a
+    # resync. Clients that were offline get it from the notification list and /api/sync.
+    emit_event("notification", payload)
     
     
 def check_and_send_birthday_notifications(app):
@@ -759,7 +1020,7 @@ def check_and_send_birthday_notifications(app):
     Checks for birthdays today and sends notifications to friends of the birthday user.
     This must be run by a scheduler inside the app context.
     """
-    with app.app_context():
+    with app.app_context(), profiler.scope("job birthday_notifications"):
         # IMPORTANT: Run this inside app_context to access DB and Models
         
         today = date.today()
@@ -773,11 +1034,11 @@ def check_and_send_birthday_notifications(app):
         ).all()
         
         if not birthday_users:
-            print(f"[{datetime.now()}] No birthdays today.")
+            logger.info("no birthdays today")
             return
 
         for bday_user in birthday_users:
-            print(f"[{datetime.now()}] Happy Birthday to {bday_user.name} (ID: {bday_user.id})!")
+            logger.info("birthday", extra={"user_id": bday_user.id})
             
             # 2. Find all users who have the birthday user in their chat list (i.e., their friends)
             # Find all UserChatList entries where the *other_user_id* is the birthday user
@@ -801,6 +1062,7 @@ def check_and_send_birthday_notifications(app):
                 )
                 db.session.add(new_notification)
                 db.session.flush() # Flushes the session to assign an ID
+                record_change(friend_id, 'notification', new_notification.id)
                 
                 # b. Prepare real-time payload for Sidebar.jsx
                 payload = {
@@ -813,13 +1075,13 @@ def check_and_send_birthday_notifications(app):
                 }
                 
                 # c. Send live notification to the friend's personal room
-                socketio.emit("notification", payload, room=f"user_{friend_id}")
-                print(f"Sent birthday notification to user_{friend_id}")
+                emit_replayable("notification", payload, [friend_id])
+                logger.debug("birthday notification sent", extra={"user_id": friend_id})
         
         # 4. Commit all new notifications to the database
         try:
             db.session.commit()
-            print(f"[{datetime.now()}] Successfully saved and sent birthday notifications.")
-        except Exception as e:
+            logger.info("birthday notifications saved and sent")
+        except Exception:
             db.session.rollback()
-            print(f"[{datetime.now()}] ERROR saving birthday notifications: {e}")
\ No newline at end of file
+            logger.exception("saving birthday notifications failed")
\ No newline at end of file
@@ -1,14 +1,27 @@
+import logging
 import os
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify, render_template
+from flask import Blueprint, request, jsonify, render_template, current_app
 from flask_jwt_extended import (
     create_access_token, jwt_required, get_jwt_identity, decode_token
 )
-from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy import or_, and_
-from apps.models import db, User, OTP, Message, UserChatList, FriendRequest, Notification
-from apps.utils import send_email, gen_otp, decrypt_message
-from apps.routes.socket import socketio, notify_new_user
+from apps.models import db, normalize_name, User, Message, ArchivedMessage, UserChatList, FriendRequest, Notification
+from apps.utils import send_email
+from apps.otp import otps, VERIFIED, TOO_MANY_ATTEMPTS
+from apps.offload import decrypt_many
+from apps.message_cache import message_cache, message_payload
+from apps.routes.socket import socketio, notify_new_user, emit_replayable, emit_event, disconnect_user
+from apps.db_routing import read_replica
+from apps.archive import conversation_page
+from apps.account_purge import tombstone_user, run_account_purges
+from apps.suggestions import suggestion_page, parse_cursor, invalidate_friend_graph
+from apps.pins import apply_pin
+from apps.changes import record_change, changes_since
+from apps.http_cache import versioned_etag, bump_version
+from apps.compression import compressed
+from apps.ratelimit import rate_limit, client_ip, json_email
 
 
 import cloudinary
@@ -20,6 +33,8 @@ from zoneinfo import ZoneInfo
 
 IST = ZoneInfo("Asia/Kolkata")
 
+logger = logging.getLogger(__name__)
+
 # Configure Cloudinary
 cloudinary.config(
   cloud_name = os.getenv('CLOUDINARY_CLOUD_NAME'),
@@ -61,8 +76,15 @@ def index():
 
 
 
+def _presence_scopes(user_id):
+    ids_param = request.args.get("ids", "")
+    return [("presence", int(x)) for x in sorted(set(ids_param.split(","))) if x.strip().isdigit()]
+
+
 @user_bp.route("/presence", methods=["GET"])
 @jwt_required()
+@read_replica
+@versioned_etag("presence", _presence_scopes)
 def presence():
     ids_param = request.args.get("ids", "")
     try:
@@ -87,13 +109,14 @@ def presence():
 
 # ===== Auth Routes =====
 @user_bp.route('/register', methods=['POST'])
+@rate_limit('register', client_ip, json_email)
 def register():
     data = request.json
     name = data.get('name')
     email = data.get('email')
     password = data.get('password') # Frontend should handle confirm_password check
     
-    print("DATA FOR REGISTER", data)
+    logger.debug("register", extra={"email": email})
     
     if not (name and email and password):
         return jsonify({"msg": "Missing required fields"}), 400
@@ -111,37 +134,58 @@ def register():
     db.session.add(u)
     db.session.commit()
 
-    code = gen_otp()
-    otp = OTP(user_id=u.id, code=code, expires_at=(datetime.now(IST) + timedelta(minutes=10)).replace(tzinfo=None))
-    db.session.add(otp)
-    db.session.commit()
+    code = otps.issue('verify_email', u.id)
 
     # Send email
     subject = "Your Chat App OTP"
-    body = f"Hi {name},\n\nYour verification code is: {code}\nIt expires in 10 minutes."
+    body = f"Hi {name},\n\nYour verification code is: {code}\nIt expires in {otps.ttl_minutes} minutes."
     send_email(email, subject, body)
 
     return jsonify({"msg": "Registration successful, OTP sent to email"}), 201
 
+@user_bp.route('/resend-otp', methods=['POST'])
+@rate_limit('send_otp', client_ip, json_email)
+def resend_otp():
+    """
+    A new email verification code for an unverified account: the pending one expired,
+    was lost on a restart, or was discarded after too many wrong guesses.
+    """
+    email = (request.json or {}).get('email')
+    if not email:
+        return jsonify({"msg": "Email is required"}), 400
+
+    u = User.query.filter_by(email=email).first()
+    if not u or u.deleted_at is not None:
+        return jsonify({"msg": "User not found"}), 404
+    if u.verified:
+        return jsonify({"msg": "Email already verified"}), 400
+
+    code = otps.issue('verify_email', u.id)
+    subject = "Your Chat App OTP"
+    body = f"Hi {u.name},\n\nYour new verification code is: {code}\nIt expires in {otps.ttl_minutes} minutes."
+    send_email(u.email, subject, body)
+
+    return jsonify({"msg": "A new OTP was sent to your email"}), 200
+
 @user_bp.route('/verify-otp', methods=['POST'])
+@rate_limit('verify_otp', client_ip, json_email)
 def verify_otp():
     data = request.json
     email = data.get('email')
     code = data.get('pin')
 
-    print("DATA FOR OTP ", data)
     u = User.query.filter_by(email=email).first()
-    print("VERIFY OTP USER ", u)
+    logger.debug("verify otp", extra={"email": email, "user_id": u.id if u else None})
     if not u:
         return jsonify({"msg": "User not found"}), 404
 
-    otp = OTP.query.filter_by(user_id=u.id, code=code).order_by(OTP.expires_at.desc()).first()
-    
-    if not otp or otp.expires_at < datetime.now():
+    result = otps.verify('verify_email', u.id, code)
+    if result == TOO_MANY_ATTEMPTS:
+        return jsonify({"msg": "Too many incorrect codes, request a new OTP"}), 429
+    if result != VERIFIED:
         return jsonify({"msg": "Invalid or expired OTP"}), 400
     
     u.verified = True
-    db.session.delete(otp)
     db.session.commit()
 
     # Notify all connected clients about the new verified user via function
@@ -173,10 +217,10 @@ def login():
 # ==============================================================================
 
 @user_bp.route('/forgot-password/send-otp', methods=['POST'])
+@rate_limit('send_otp', client_ip, json_email)
 def forgot_password_send_otp():
     """
-    Step 1: Accepts email, finds user, generates 4-digit OTP, sends email,
-    and stores/updates OTP in the database.
+    Step 1: Accepts email, finds user, generates 4-digit OTP (apps/otp.py) and sends it by email.
     """
     data = request.json
     email = data.get('email')
@@ -189,26 +233,12 @@ def forgot_password_send_otp():
         # User enumeration protection: return generic error.
         return jsonify({"msg": "No user found with that email address"}), 404
     
-    # Check if a pending OTP already exists
-    otp_record = OTP.query.filter_by(user_id=user.id).first()
-    
-    otp_code = gen_otp(length=4)
-    expires_at = datetime.utcnow() + timedelta(minutes=10) # OTP valid for 10 minutes
-
-    if otp_record:
-        # Update existing record
-        otp_record.code = otp_code
-        otp_record.expires_at = expires_at
-    else:
-        # Create new record
-        new_otp = OTP(user_id=user.id, code=otp_code, expires_at=expires_at)
-        db.session.add(new_otp)
-    
-    db.session.commit()
+    # Replaces any pending reset code
+    otp_code = otps.issue('reset_password', user.id)
 
     # Send the email
     subject = "Password Reset OTP"
-    body = f"Your 4-digit One-Time Password (OTP) for password reset is: {otp_code}. This code is valid for 10 minutes."
+    body = f"Your 4-digit One-Time Password (OTP) for password reset is: {otp_code}. This code is valid for {otps.ttl_minutes} minutes."
     send_email(user.email, subject, body)
 
     # Return success, the frontend will navigate to the OTP verification page
@@ -216,6 +246,7 @@ def forgot_password_send_otp():
 
 
 @user_bp.route('/forgot-password/verify-otp', methods=['POST'])
+@rate_limit('verify_otp', client_ip, json_email)
 def forgot_password_verify_otp():
     """
     Step 2: Accepts email and OTP, verifies, and returns a temporary password reset token (JWT).
@@ -231,15 +262,12 @@ def forgot_password_verify_otp():
     if not user:
         return jsonify({"msg": "Invalid verification data"}), 401
 
-    otp_record = OTP.query.filter_by(user_id=user.id, code=otp_code).first()
-
-    if not otp_record:
-        return jsonify({"msg": "Invalid OTP code"}), 401
-
-    if otp_record.expires_at < datetime.utcnow():
-        db.session.delete(otp_record)
-        db.session.commit()
-        return jsonify({"msg": "OTP expired"}), 401
+    # Used up on success, discarded after too many wrong guesses
+    result = otps.verify('reset_password', user.id, otp_code)
+    if result == TOO_MANY_ATTEMPTS:
+        return jsonify({"msg": "Too many incorrect codes, request a new OTP"}), 429
+    if result != VERIFIED:
+        return jsonify({"msg": "Invalid or expired OTP code"}), 401
 
     # OTP is valid. Generate a temporary, short-lived JWT token for password reset
     reset_token = create_access_token(
@@ -247,10 +275,7 @@ def forgot_password_verify_otp():
         expires_delta=timedelta(minutes=5), # Token only valid for 5 minutes for reset
         additional_claims={"reset_context": True} # Add custom claim for security
     )
-    
-    # IMPORTANT: Delete the OTP record immediately after successful use
-    db.session.delete(otp_record)
-    db.session.commit()
+
 
     return jsonify({
         "msg": "OTP verified successfully. Proceed to reset password.",
@@ -280,7 +305,7 @@ def reset_password():
         
         if not user_id_str:
              # This handles if the 'sub' claim is completely missing
-             print("Token decoding/validation error: 'sub' claim missing from token.")
+             logger.info("reset token rejected: 'sub' claim missing")
              return jsonify({"msg": "Invalid token structure"}), 403
              
         # Explicitly convert to integer for safe comparison against the DB User.id
@@ -288,7 +313,7 @@ def reset_password():
             user_id = int(user_id_str)
         except ValueError:
             # This handles the case where 'sub' is a string but not an integer (e.g., 'null' or bad data)
-            print("Token decoding/validation error: 'sub' claim is not a valid integer string.")
+            logger.info("reset token rejected: 'sub' claim is not an integer")
             return jsonify({"msg": "Invalid or expired password reset token"}), 403
 
 
@@ -306,7 +331,7 @@ def reset_password():
     except Exception as e:
         # This catches general JWT errors (like signature verification failure, expiration, 
         # or the specific "Subject must be a string" error you were seeing).
-        print(f"Token decoding/validation error: {e}")
+        logger.info("reset token rejected: %s", e)
         return jsonify({"msg": "Invalid or expired password reset token"}), 403
 
     # 2. Update the password
@@ -320,7 +345,6 @@ def reset_password():
 @user_bp.route('/change-password', methods=['PUT'])
 def change_password():
     data = request.json
-    print("DATA CHANGE PASSWORD", data)
 
     email = data.get('email')
     current_password = data.get('current_password')
@@ -336,7 +360,7 @@ def change_password():
             return jsonify({"msg": "User not found"}), 404
 
         # Verify current password
-        if not check_password_hash(user.password_hash, current_password):
+        if not user.check_password(current_password):
             return jsonify({"msg": "Incorrect current password"}), 400
 
         # Check new + confirm match
@@ -350,7 +374,7 @@ def change_password():
         return jsonify({"msg": "Password updated successfully!"}), 200
 
     except Exception as e:
-        print("ERRORRRR:", e)
+        logger.exception("change password failed")
         return jsonify({"msg": "Failed to update password"}), 500
 
 
@@ -359,9 +383,9 @@ def change_password():
 # send otp for delete user account
 @user_bp.route('/send-otp-delete-account', methods=['POST'])
 @jwt_required()
+@rate_limit('send_otp', client_ip, json_email)
 def send_otp_delete_account():
     data = request.json
-    print("DATA EMAIL", data)
     email = data.get('email')
 
     if not email:
@@ -372,27 +396,12 @@ def send_otp_delete_account():
         # User enumeration protection: return generic error.
         return jsonify({"msg": "No user found with that email address"}), 404
     
-    # Check if a pending OTP already exists
-    otp_record = OTP.query.filter_by(user_id=user.id).first()
-    
-    otp_code = gen_otp(length=4)
-    expires_at = (datetime.now(IST) + timedelta(minutes=10)).replace(tzinfo=None) # OTP valid for 10 minutes
-        # otp = OTP(user_id=u.id, code=code, expires_at=(datetime.datetime.now(IST) + timedelta(minutes=10)).replace(tzinfo=None))
-
-    if otp_record:
-        # Update existing record
-        otp_record.code = otp_code
-        otp_record.expires_at = expires_at
-    else:
-        # Create new record
-        new_otp = OTP(user_id=user.id, code=otp_code, expires_at=expires_at)
-        db.session.add(new_otp)
-    
-    db.session.commit()
+    # Replaces any pending deletion code
+    otp_code = otps.issue('delete_account', user.id)
 
     # Send the email
     subject = "Delete Account OTP"
-    body = f"Your 4-digit One-Time Password (OTP) for deleting your account is: {otp_code}. This code is valid for 10 minutes."
+    body = f"Your 4-digit One-Time Password (OTP) for deleting your account is: {otp_code}. This code is valid for {otps.ttl_minutes} minutes."
     send_email(user.email, subject, body)
 
     # Return success, the frontend will navigate to the OTP verification page
@@ -401,6 +410,7 @@ def send_otp_delete_account():
 
 
 @user_bp.route('/verify-otp-delete-account', methods=['POST'])
+@rate_limit('verify_otp', client_ip, json_email)
 def verify_otp_delete_account():
     data = request.json
     email = data.get('email')
@@ -409,47 +419,25 @@ def verify_otp_delete_account():
     if not email or not code:
         return jsonify({"msg": "Missing email or OTP"}), 400
     
-    print("DATA FOR OTP ", data)
     u = User.query.filter_by(email=email).first()
-    print("VERIFY OTP USER ", u)
+    logger.debug("verify otp", extra={"email": email, "user_id": u.id if u else None})
     if not u:
         return jsonify({"msg": "User not found"}), 404
 
-    otp = OTP.query.filter_by(user_id=u.id, code=code).order_by(OTP.expires_at.desc()).first()
-    
-    if not otp or otp.expires_at < datetime.now():
+    result = otps.verify('delete_account', u.id, code)
+    if result == TOO_MANY_ATTEMPTS:
+        return jsonify({"msg": "Too many incorrect codes, request a new OTP"}), 429
+    if result != VERIFIED:
         return jsonify({"msg": "Invalid or expired OTP"}), 400
     
-    # message = Message.query.filter_by(sender_id = u.id, receiver_id = u.id)
-    # chatlist = UserChatList.query.filter_by(user_id = u.id, other_user_id = u.id)
-    # notification = Notification.query.filter_by(user_id=u.id)
-    # friend_request = FriendRequest.query.filter_by(sender_id=u.id, receiver_id=u.id)
-    
-    Message.query.filter(
-        (Message.sender_id == u.id) | (Message.receiver_id == u.id)
-    ).delete(synchronize_session=False)
-
-    # 2. Delete all chatlist entries associated with the user
-    UserChatList.query.filter(
-        (UserChatList.user_id == u.id) | (UserChatList.other_user_id == u.id)
-    ).delete(synchronize_session=False)
-
-    # 3. Delete all friend requests involving the user
-    FriendRequest.query.filter(
-        (FriendRequest.sender_id == u.id) | (FriendRequest.receiver_id == u.id)
-    ).delete(synchronize_session=False)
-    
-    # 4. Delete all notifications for the user
-    Notification.query.filter_by(user_id=u.id).delete(synchronize_session=False)
-    
-    
-    db.session.delete(otp)
-    db.session.delete(u)
-    # db.session.delete(message)
-    # db.session.delete(chatlist)
-    # db.session.delete(friend_request)
-    # db.session.delete(notification)
+    # Tombstone now; the user's messages, chat list, requests and notifications
+    # are deleted in small batches by the background purge (apps/account_purge.py)
+    tombstone_user(u)
     db.session.commit()
+    # Open sockets were authenticated before the deletion; end them now
+    disconnect_user(u.id)
+
+    socketio.start_background_task(run_account_purges, current_app._get_current_object())
 
     return jsonify({"msg": "Your Account Deleted Successfully!"}), 200
 
@@ -458,6 +446,7 @@ def verify_otp_delete_account():
 # ===== User Profile Routes =====
 @user_bp.route('/profile', methods=['GET'])
 @jwt_required()
+@versioned_etag('profile', lambda user_id: [('profile', user_id)])
 def get_user_profile():
     """Retrieves the current user's profile data."""
     my_id = int(get_jwt_identity())
@@ -510,7 +499,7 @@ def profile_image_upload():
         return jsonify({"msg": "File uploaded successfully", "media_url": media_url}), 200
 
     except Exception as e:
-        print(f"Cloudinary upload error: {e}")
+        logger.exception("cloudinary upload failed")
         return jsonify({"msg": f"Media upload failed: {str(e)}"}), 500
 
 
@@ -525,6 +514,36 @@ def check_username():
 
 
 
+@user_bp.route('/users/search', methods=['GET'])
+@jwt_required()
+@read_replica
+def search_users():
+    """
+    Username typeahead: verified users whose name starts with `q` (case-insensitive).
+    Served by a range scan on the indexed name_normalized column. Query params: q, limit (default 10, max 25).
+    """
+    my_id = int(get_jwt_identity())
+    prefix = normalize_name(request.args.get('q', '').strip())
+    try:
+        limit = min(max(int(request.args.get('limit', 10)), 1), 25)
+    except ValueError:
+        return jsonify({"msg": "Invalid limit"}), 400
+
+    if not prefix:
+        return jsonify({"users": []})
+
+    rows = (User.query
+            .with_entities(User.id, User.name, User.image_url)
+            .filter(User.name_normalized.startswith(prefix, autoescape=True),
+                    User.verified == True,
+                    User.id != my_id)
+            .order_by(User.name_normalized.asc())
+            .limit(limit)
+            .all())
+
+    return jsonify({"users": [{"id": uid, "name": name, "image_url": image_url} for uid, name, image_url in rows]})
+
+
 @user_bp.route('/profile', methods=['PUT'])
 @jwt_required()
 def update_user_profile():
@@ -537,7 +556,6 @@ def update_user_profile():
     image_url = data.get('image_url')
     
     birthday_str = data.get('birthday')
-    print("BIRTHDAY STR", birthday_str)
     
     user = User.query.get(my_id)
     if not user:
@@ -548,7 +566,6 @@ def update_user_profile():
     if name is not None:
         # Check if username already exists (excluding the current user)
         existing_user = User.query.filter(User.name == name, User.id != my_id).first()
-        print("EXITING USER", existing_user)
         if existing_user:
             return jsonify({"msg": "Username already exists!"}), 400
         
@@ -573,7 +590,12 @@ def update_user_profile():
     
     # Note: Email/Password updates should ideally be in separate, more secure routes.
     
+    # Everyone who has me in their chat list sees my new name/picture on their next sync
+    followers = [uid for (uid,) in db.session.query(UserChatList.user_id).filter_by(other_user_id=my_id)]
+    record_change(followers, 'chat', my_id)
     db.session.commit()
+    bump_version('profile', my_id)
+    bump_version('chatlist', *followers)
     
     # Return the updated profile data
     return jsonify({"msg": "Profile updated successfully", "user": user.to_dict()}), 200
@@ -581,49 +603,25 @@ def update_user_profile():
 
 @user_bp.route('/users/suggestions', methods=['GET'])
 @jwt_required()
+@read_replica
+@compressed
 def get_user_suggestions():
     """
-    Get all verified users, excluding self, users already in the chat list, 
-    and users with a pending friend request (RECEIVED only). Users with SENT requests 
-    are kept to show the 'Pending' button on the frontend.
+    Cursor-paginated suggestions, ranked by mutual connections.
+    Excludes self, users already in the chat list and users who sent ME a pending
+    request. Users I sent a request to are kept with status 'Pending'.
+    Query params: limit (default 20, max 100), cursor (the previous page's next_cursor).
     """
     my_id = int(get_jwt_identity())
-    
-    # 1. Get IDs of users already in my chat list
-    added_ids = [item.other_user_id for item in UserChatList.query.filter_by(user_id=my_id).all()]
-    added_ids.append(my_id) # Exclude myself
-    
-    # 2. Get IDs of users who have sent ME a pending friend request
-    # Users I sent a request to will NOT be excluded, allowing the frontend to display the 'Pending' button.
-    received_request_ids = [req.sender_id for req in FriendRequest.query.filter_by(receiver_id=my_id).all()]
-    
-    for user_id in received_request_ids:
-        # Add the sender's ID to the exclusion list if not already added 
-        if user_id not in added_ids:
-            added_ids.append(user_id)
-    
-    # 3. Get all verified users not in the exclusion list
-    users = User.query.filter(User.id.notin_(added_ids), User.verified == True).all()
-    
-    # --- NEW LOGIC START ---
-    # Fetch SENT requests
-    sent_request_ids = [req.receiver_id for req in FriendRequest.query.filter_by(sender_id=my_id).all()]
-    
-    out = []
-    for u in users:
-        status = "Request"
-        if u.id in sent_request_ids:
-            status = "Pending"
-        
-        out.append({
-            "id": u.id, 
-            "name": u.name, 
-            "email": u.email,
-            "status": status # Include the status
-        })
-    # --- NEW LOGIC END ---
-    
-    return jsonify(out)
+
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        cursor = parse_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({"msg": "Invalid limit or cursor"}), 400
+
+    users, next_cursor = suggestion_page(my_id, cursor=cursor, limit=limit)
+    return jsonify({"users": users, "next_cursor": next_cursor})
 
 # @user_bp.route('/users/chatlist', methods=['POST'])
 # @jwt_required()
@@ -680,6 +678,8 @@ def get_user_suggestions():
 # GET USER CHAT LIST
 @user_bp.route('/users/chatlist', methods=['GET'])
 @jwt_required()
+@read_replica
+@versioned_etag('chatlist', lambda user_id: [('chatlist', user_id)])
 def get_chatlist():
     my_id = int(get_jwt_identity())
 
@@ -698,18 +698,23 @@ def get_chatlist():
     for item in chat_list_items:
         user = User.query.get(item.other_user_id)
         if user:
-            chat_users.append({
-                "id": user.id,
-                "name": user.name,
-                "email": user.email,
-                "image_url": user.image_url,
-                "description": user.description,
-                "pin_priority": item.pin_priority,
-                "is_favorite":item.is_favorite
-            })
+            chat_users.append(chat_list_payload(item, user))
     return jsonify(chat_users)
 
 
+def chat_list_payload(item, user):
+    """One sidebar entry: the other user's profile plus my pin/favorite state for them."""
+    return {
+        "id": user.id,
+        "name": user.name,
+        "email": user.email,
+        "image_url": user.image_url,
+        "description": user.description,
+        "pin_priority": item.pin_priority,
+        "is_favorite":item.is_favorite
+    }
+
+
 # POST FOR PINNED CHAT
 @user_bp.route('/pin/<int:other_user_id>', methods=['POST'])
 @jwt_required()
@@ -718,65 +723,14 @@ def pin_chat(other_user_id):
     data = request.json or {}
     should_pin = data.get("pin", True)
 
-    entry = UserChatList.query.filter_by(user_id=my_id, other_user_id=other_user_id).first()
-    if not entry:
+    pins = apply_pin(my_id, other_user_id, bool(should_pin))
+    if pins is None:
         return jsonify({"msg": "Chat not found in list"}), 404
 
-    # fetch my current pins ordered by priority
-    pins = (UserChatList.query
-            .filter_by(user_id=my_id)
-            .filter(UserChatList.pin_priority > 0)
-            .order_by(UserChatList.pin_priority.asc())
-            .all())
-
-    if should_pin:
-        # if already pinned -> move to top (1) and shift others
-        if entry.pin_priority > 0:
-            old_pri = entry.pin_priority
-            for p in pins:
-                if p.id == entry.id:
-                    continue
-                if p.pin_priority < old_pri:
-                    p.pin_priority += 1
-            entry.pin_priority = 1
-        else:
-            # insert at top
-            for p in pins:
-                p.pin_priority = min(p.pin_priority + 1, 3)
-            entry.pin_priority = 1
-
-        # enforce max 3: any pin with pri>3 becomes 0
-        overflow = (UserChatList.query
-                    .filter_by(user_id=my_id)
-                    .filter(UserChatList.pin_priority > 3)
-                    .all())
-        for p in overflow:
-            p.pin_priority = 0
-    else:
-        # unpin and close the gap (shift lower priorities up)
-        removed_pri = entry.pin_priority
-        entry.pin_priority = 0
-        if removed_pri > 0:
-            for p in pins:
-                if p.id != entry.id and p.pin_priority > removed_pri:
-                    p.pin_priority -= 1
-
-    db.session.commit()
-
-    # prepare minimal payload for client
-    new_pins = (UserChatList.query
-        .filter_by(user_id=my_id)
-        .filter(UserChatList.pin_priority > 0)
-        .with_entities(UserChatList.other_user_id, UserChatList.pin_priority)
-        .order_by(UserChatList.pin_priority.asc())
-        .all())
-
-    payload = {
-        "pins": [{"other_user_id": uid, "pin_priority": pri} for (uid, pri) in new_pins]
-    }
+    payload = {"pins": pins}
 
     # notify this user’s personal room in realtime
-    socketio.emit("chat_pins_updated", payload, room=f"user_{my_id}")
+    emit_replayable("chat_pins_updated", payload, [my_id])
 
     return jsonify({"ok": True, **payload})
 
@@ -785,52 +739,45 @@ def pin_chat(other_user_id):
 # GET MESSAGES
 @user_bp.route('/messages/<int:other_user_id>', methods=['GET'])
 @jwt_required()
+@read_replica
+@compressed
 def get_messages(other_user_id):
     """Fetch paginated chat messages between two users."""
     current_user_id = get_jwt_identity()
     
     offset = int(request.args.get('offset', 0))  # how many to skip
     limit = int(request.args.get('limit', 15))   # how many to fetch
-    
-    # --- Check blocking status ---
-    block_by_me = UserChatList.query.filter_by(
-        user_id=current_user_id, other_user_id=other_user_id, is_blocked=True
-    ).first() is not None
-
-    block_by_them = UserChatList.query.filter_by(
-        user_id=other_user_id, other_user_id=current_user_id, is_blocked=True
-    ).first() is not None
-
-    # --- Fetch all relevant messages ---
-    messages_query = Message.query.filter(
-        or_(
-            and_(
-                Message.sender_id == current_user_id,
-                Message.receiver_id == other_user_id,
-                Message.is_deleted_for_sender == False
-            ),
-            and_(
-                Message.sender_id == other_user_id,
-                Message.receiver_id == current_user_id,
-                Message.is_deleted_for_recipient == False
-            )
-        )
-    ).order_by(Message.timestamp.desc())  # latest first
-
-    total_count = messages_query.count()
-    messages = messages_query.offset(offset).limit(limit).all()
-    output = []
-    for msg in messages:
-        if msg.is_deleted_for_everyone:
-            output.append({
-                'id': msg.id,
-                'sender_id': msg.sender_id,
-                'is_deleted_for_everyone': True,
-                'content': 'This message was deleted.',
-                'timestamp': msg.timestamp.isoformat(),
-            })
-        else:
-            output.append(msg.to_dict())
+
+    # --- The newest page of an active chat is usually in the hot-conversation cache ---
+    loading = nullcontext()
+    if offset == 0:
+        cached = message_cache.page(current_user_id, other_user_id, limit)
+        if cached is not None:
+            output, total_count, block_by_me, block_by_them = cached
+            return jsonify({
+                'messages': output[::-1],
+                'total_count': total_count,
+                'is_blocked_by_me': block_by_me,
+                'is_blocked_by_them': block_by_them
+            }), 200
+        loading = message_cache.loading(current_user_id, other_user_id)
+
+    with loading as load_token:
+        # --- Check blocking status ---
+        block_by_me = UserChatList.query.filter_by(
+            user_id=current_user_id, other_user_id=other_user_id, is_blocked=True
+        ).first() is not None
+
+        block_by_them = UserChatList.query.filter_by(
+            user_id=other_user_id, other_user_id=current_user_id, is_blocked=True
+        ).first() is not None
+
+        # --- Fetch the page, continuing into the archive past the hot boundary ---
+        messages, total_count = conversation_page(current_user_id, other_user_id, offset, limit)
+        contents = decrypt_many(msg.ciphertext for msg in messages)
+        output = [message_payload(msg, content) for msg, content in zip(messages, contents)]
+        if load_token is not None:
+            message_cache.load(load_token, current_user_id, other_user_id, total_count, block_by_me, block_by_them)
 
     # Return newest first, but UI expects oldest-first order
     output.reverse()
@@ -841,47 +788,39 @@ def get_messages(other_user_id):
         'is_blocked_by_me': block_by_me,
         'is_blocked_by_them': block_by_them
     }), 200
-    
-    
+
+
 @user_bp.route('/messages/search/<int:other_user_id>', methods=['GET'])
 @jwt_required()
+@read_replica
 def search_messages(other_user_id):
     """Search messages between current user and another user by keyword."""
     current_user_id = int(get_jwt_identity())
     query = request.args.get('q', '').strip().lower()
 
-    print("CURRENT USER IN SEARCH MESSAGE", current_user_id)
-    print("QUERYY", query)
 
     if not query:
         return jsonify({"results": []})
 
-    # Step 1️⃣: Get all messages between A and B
-    messages = Message.query.filter(
-        (
-            ((Message.sender_id == current_user_id) & (Message.receiver_id == other_user_id))
-            | ((Message.sender_id == other_user_id) & (Message.receiver_id == current_user_id))
-        )
-        & (Message.is_deleted_for_everyone == False)
-    ).order_by(Message.timestamp.asc()).all()
+    # Step 1️⃣: Get all messages between A and B (archived history first, it is older)
+    messages = []
+    for model in (ArchivedMessage, Message):
+        messages += model.query.filter(
+            (
+                ((model.sender_id == current_user_id) & (model.receiver_id == other_user_id))
+                | ((model.sender_id == other_user_id) & (model.receiver_id == current_user_id))
+            )
+            & (model.is_deleted_for_everyone == False)
+        ).order_by(model.timestamp.asc()).all()
 
-    print(f"Fetched {len(messages)} messages to search")
 
-    # Step 2️⃣: Decrypt + search in memory
+    # Step 2️⃣: Decrypt (one batch, off the eventlet hub) + search in memory
     matched_messages = []
-    for msg in messages:
-        try:
-            decrypted_text = decrypt_message(msg.content)
-        except Exception as e:
-            print("Decryption failed for message:", e)
-            continue
-
+    for msg, decrypted_text in zip(messages, decrypt_many(msg.ciphertext for msg in messages)):
         if query in decrypted_text.lower():
-            msg_dict = msg.to_dict()
-            msg_dict["content"] = decrypted_text  # Replace encrypted with plain text
-            matched_messages.append(msg_dict)
+            matched_messages.append(msg.to_dict(decrypted_text))
 
-    print(f"Matched {len(matched_messages)} messages for query '{query}'")
+    logger.debug("message search", extra={"user_id": current_user_id, "scanned": len(messages), "matched": len(matched_messages)})
 
     return jsonify({"results": matched_messages})
 
@@ -932,13 +871,15 @@ def upload_media():
         }), 200
 
     except Exception as e:
-        print(f"Cloudinary Upload Error: {e}")
+        logger.exception("cloudinary upload failed")
         return jsonify({"msg": f"Media upload failed: {str(e)}"}), 500
 
 
 # New route to get initial notifications (friend requests)
 @user_bp.route('/notifications', methods=['GET'])
 @jwt_required()
+@read_replica
+@compressed
 def get_notifications():
     """Retrieves all pending friend requests AND historical notifications for the current user."""
     my_id = int(get_jwt_identity())
@@ -947,16 +888,7 @@ def get_notifications():
     pending_requests = FriendRequest.query.filter_by(receiver_id=my_id).all()
 
     # Format the pending requests as notifications
-    request_notifications = []
-    for req in pending_requests:
-        request_notifications.append({
-            'id': req.id,
-            'type': 'friend_request',
-            'sender_id': req.sender_id,
-            'sender_name': req.sender.name,
-            'timestamp': req.timestamp.isoformat(),
-            'content': f"{req.sender.name} sent you a friend request."
-        })
+    request_notifications = [friend_request_payload(req) for req in pending_requests]
 
     # 2. Fetch all persistent Notifications (These are the response and info notifications)
     # Order by timestamp descending (newest first)
@@ -965,31 +897,7 @@ def get_notifications():
     # Format historical notifications
     # The frontend logic for rendering is complex, so let's simplify the payload by mapping:
 
-    history_out = []
-    for n in historical_notifications:
-        payload = {
-            'id': n.id,
-            'type': n.type, 
-            'timestamp': n.timestamp.isoformat(),
-            'request_id': n.request_id,
-        }
-        # Add actor information, which is used by the frontend as the "sender"
-        if n.actor:
-            payload['sender_id'] = n.actor_id
-            payload['sender_name'] = n.actor.name
-            
-       # Determine specific fields based on notification type
-        if n.type == 'request_response' or n.type == 'request_resolved':
-            # Extract action (accept/reject) for the frontend to render the response status
-            action_word = n.content.split(' ')[1].replace('ed', '').replace('.', '') # Extracts 'accept' or 'reject'
-            payload['action'] = action_word
-            
-        elif n.type == 'new_user_verified':
-                # Use 'name' for new user notifications as expected by your frontend
-                if n.actor:
-                    payload['name'] = n.actor.name
-                    
-        history_out.append(payload)
+    history_out = [notification_payload(n) for n in historical_notifications]
 
 
     # 3. Combine both lists
@@ -1002,6 +910,45 @@ def get_notifications():
     return jsonify(all_notifications)
 
 
+def friend_request_payload(req):
+    """A pending request, shaped like a notification for the frontend."""
+    return {
+        'id': req.id,
+        'type': 'friend_request',
+        'sender_id': req.sender_id,
+        'sender_name': req.sender.name,
+        'timestamp': req.timestamp.isoformat(),
+        'content': f"{req.sender.name} sent you a friend request."
+    }
+
+
+def notification_payload(n):
+    """A persistent Notification in the shape the frontend renders."""
+    payload = {
+        'id': n.id,
+        'type': n.type, 
+        'timestamp': n.timestamp.isoformat(),
+        'request_id': n.request_id,
+    }
+    # Add actor information, which is used by the frontend as the "sender"
+    if n.actor:
+        payload['sender_id'] = n.actor_id
+        payload['sender_name'] = n.actor.name
+        
+   # Determine specific fields based on notification type
+    if n.type == 'request_response' or n.type == 'request_resolved':
+        # Extract action (accept/reject) for the frontend to render the response status
+        action_word = n.content.split(' ')[1].replace('ed', '').replace('.', '') # Extracts 'accept' or 'reject'
+        payload['action'] = action_word
+        
+    elif n.type == 'new_user_verified':
+            # Use 'name' for new user notifications as expected by your frontend
+            if n.actor:
+                payload['name'] = n.actor.name
+
+    return payload
+
+
 @user_bp.route('/block/<int:other_user_id>', methods=['POST'])
 @jwt_required()
 def toggle_block_user(other_user_id):
@@ -1017,7 +964,8 @@ def toggle_block_user(other_user_id):
     ).first()
 
     # If the entry doesn't exist, create it (it must exist for a chat to be open, but safer to check)
-    if not chat_list_entry:
+    created = chat_list_entry is None
+    if created:
         chat_list_entry = UserChatList(
             user_id=current_user_id,
             other_user_id=other_user_id,
@@ -1026,13 +974,18 @@ def toggle_block_user(other_user_id):
 
     # 2. Update the block status
     chat_list_entry.is_blocked = should_block
+    record_change(int(current_user_id), 'chat', other_user_id)
+    record_change(other_user_id, 'block', int(current_user_id))
     
     try:
         db.session.commit()
+        if created:
+            invalidate_friend_graph(current_user_id)
+        bump_version('chatlist', current_user_id)
+        message_cache.set_blocked(current_user_id, other_user_id, should_block)
 
         # 3. Notify the *other user* in real-time about the change
         # This will trigger the disabled chat input on their side.
-        from apps.routes.socket import socketio # Import socketio
         
         # Room is the other user's personal room for notifications
         room = f"user_{other_user_id}" 
@@ -1042,12 +995,103 @@ def toggle_block_user(other_user_id):
             'blocker_id': current_user_id,
             'is_blocked': should_block,
         }
-        socketio.emit('block_status_update', payload, room=room)
+        emit_event('block_status_update', payload, room=room)
         
         action = "blocked" if should_block else "unblocked"
         return jsonify({'message': f"User {other_user_id} successfully {action}."}), 200
 
     except Exception as e:
         db.session.rollback()
-        print(f"Error during block/unblock: {e}")
-        return jsonify({'message': 'Failed to update block status.'}), 500
\ No newline at end of file
+        logger.exception("block/unblock failed")
+        return jsonify({'message': 'Failed to update block status.'}), 500
+
+# ===== Delta Sync =====
+@user_bp.route('/sync', methods=['GET'])
+@jwt_required()
+def sync_changes():
+    """
+    Everything that changed for the current user since `since` (the token from the previous sync).
+    Without a token, or with one older than the retained change log, returns {"reset": true}
+    and the client should do a full refetch, then continue from the returned token.
+    """
+    my_id = int(get_jwt_identity())
+    since = request.args.get('since')
+    try:
+        since = int(since) if since not in (None, '') else None
+    except ValueError:
+        return jsonify({"msg": "Invalid sync token"}), 400
+
+    limit = current_app.config.get('SYNC_PAGE_SIZE', 500)
+    entries, token, has_more, reset = changes_since(my_id, since, limit)
+    if reset:
+        return jsonify({"reset": True, "token": str(token)}), 200
+
+    ids = {}
+    for entry in entries:
+        ids.setdefault(entry.kind, set()).add(entry.entity_id)
+
+    # Messages (new, edited, deleted for everyone) in their current state, hot or archived
+    messages, deleted_message_ids = [], set(ids.get('message_deleted', ()))
+    if ids.get('message'):
+        visible = []
+        for model in (Message, ArchivedMessage):
+            for msg in model.query.filter(model.id.in_(ids['message'])):
+                hidden_for_me = (msg.is_deleted_for_sender if msg.sender_id == my_id else msg.is_deleted_for_recipient)
+                if hidden_for_me:
+                    deleted_message_ids.add(msg.id)
+                else:
+                    visible.append(msg)
+        contents = decrypt_many(msg.ciphertext for msg in visible)
+        messages = [message_payload(msg, content) for msg, content in zip(visible, contents)]
+
+    # Chat list entries that changed (added, profile edits, favorites); missing ones were removed
+    chats, removed_chat_ids = [], set(ids.get('chat', ()))
+    if removed_chat_ids:
+        rows = (db.session.query(UserChatList, User)
+                .join(User, User.id == UserChatList.other_user_id)
+                .filter(UserChatList.user_id == my_id, UserChatList.other_user_id.in_(removed_chat_ids)))
+        for item, user in rows:
+            chats.append(chat_list_payload(item, user))
+            removed_chat_ids.discard(user.id)
+
+    blocks = []
+    if ids.get('block'):
+        blocks = [{"blocker_id": blocker_id, "is_blocked": bool(is_blocked)} for blocker_id, is_blocked in
+                  db.session.query(UserChatList.user_id, UserChatList.is_blocked)
+                  .filter(UserChatList.user_id.in_(ids['block']), UserChatList.other_user_id == my_id)]
+
+    pins = None
+    if ids.get('pins'):
+        pins = [{"other_user_id": uid, "pin_priority": pri} for uid, pri in
+                db.session.query(UserChatList.other_user_id, UserChatList.pin_priority)
+                .filter(UserChatList.user_id == my_id, UserChatList.pin_priority > 0)
+                .order_by(UserChatList.pin_priority.asc())]
+
+    notifications = []
+    if ids.get('notification'):
+        notifications = [notification_payload(n) for n in
+                         Notification.query.filter(Notification.id.in_(ids['notification']),
+                                                   Notification.user_id == my_id)]
+
+    # Pending requests to me; resolved or withdrawn ones are reported as removed
+    friend_requests, removed_request_ids = [], set(ids.get('friend_request', ()))
+    if removed_request_ids:
+        for req in FriendRequest.query.filter(FriendRequest.id.in_(removed_request_ids),
+                                              FriendRequest.receiver_id == my_id):
+            friend_requests.append(friend_request_payload(req))
+            removed_request_ids.discard(req.id)
+
+    return jsonify({
+        "reset": False,
+        "token": str(token),
+        "has_more": has_more,
+        "messages": messages,
+        "deleted_message_ids": sorted(deleted_message_ids),
+        "chats": chats,
+        "removed_chat_ids": sorted(removed_chat_ids),
+        "blocks": blocks,
+        "pins": pins,
+        "notifications": notifications,
+        "friend_requests": friend_requests,
+        "removed_friend_request_ids": sorted(removed_request_ids),
+    }), 200
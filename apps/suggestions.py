@@ -0,0 +1,134 @@
+"""
+Ranked, cursor-paginated "people you may know".
+
+Candidates are ranked by the number of mutual connections (friends in common, from
+UserChatList), then by id. Mutual counts are computed with one grouped self-join and
+cached per user; invalidate_friend_graph() drops the affected entries whenever chat
+list membership changes. Exclusions (self, already added, requests received) are
+anti-joins in SQL, never Python id lists.
+
+Cursor format: "<mutual_count>.<user_id>" of the last returned item. Users with mutual
+connections come first; a cursor with mutual_count 0 is in the id-ordered tail.
+"""
+from collections import OrderedDict
+
+from sqlalchemy import and_, exists, func
+from sqlalchemy.orm import aliased
+
+from apps.models import db, User, UserChatList, FriendRequest
+
+MAX_CACHED_USERS = 10000
+
+# user_id -> {candidate_id: mutual_count}, least recently used first
+_mutual_cache = OrderedDict()
+
+
+def mutual_counts(user_id):
+    """Friends-of-friends of `user_id` with the number of friends in common."""
+    counts = _mutual_cache.get(user_id)
+    if counts is not None:
+        _mutual_cache.move_to_end(user_id)
+        return counts
+
+    mine = aliased(UserChatList)
+    theirs = aliased(UserChatList)
+    rows = (db.session.query(theirs.other_user_id, func.count(theirs.user_id.distinct()))
+            .join(mine, theirs.user_id == mine.other_user_id)
+            .filter(mine.user_id == user_id, theirs.other_user_id != user_id)
+            .group_by(theirs.other_user_id)
+            .all())
+    counts = dict(rows)
+
+    _mutual_cache[user_id] = counts
+    while len(_mutual_cache) > MAX_CACHED_USERS:
+        _mutual_cache.popitem(last=False)
+    return counts
+
+
+def invalidate_friend_graph(*user_ids):
+    """
+    Call after chat list entries of these users were added or removed.
+    Their own rankings change, and so do those of everyone connected to them.
+    """
+    user_ids = [int(u) for u in user_ids if u is not None]
+    if not user_ids or not _mutual_cache:
+        return
+    affected = set(user_ids)
+    affected.update(other_id for (other_id,) in db.session.query(UserChatList.user_id)
+                    .filter(UserChatList.other_user_id.in_(user_ids)))
+    for user_id in affected:
+        _mutual_cache.pop(user_id, None)
+
+
+def parse_cursor(cursor):
+    """Returns (mutual_count, user_id) or None for the first page. Raises ValueError when malformed."""
+    if not cursor:
+        return None
+    mutual, user_id = cursor.split('.', 1)
+    return int(mutual), int(user_id)
+
+
+def _candidates_query(user_id):
+    """Verified users that may be suggested to `user_id`, with the id of my pending request to them (if any)."""
+    received = aliased(FriendRequest)
+    return (db.session.query(User, FriendRequest.id)
+            .outerjoin(FriendRequest, and_(FriendRequest.sender_id == user_id,
+                                           FriendRequest.receiver_id == User.id))
+            .filter(
+                User.verified == True,
+                User.id != user_id,
+                ~exists().where(UserChatList.user_id == user_id, UserChatList.other_user_id == User.id),
+                # Users who sent ME a request are handled through notifications instead
+                ~exists().where(received.receiver_id == user_id, received.sender_id == User.id),
+            ))
+
+
+def _to_item(user, sent_request_id, mutual):
+    return {
+        "id": user.id,
+        "name": user.name,
+        "email": user.email,
+        "status": "Pending" if sent_request_id else "Request",
+        "mutual_count": mutual,
+    }
+
+
+def suggestion_page(user_id, cursor=None, limit=20):
+    """Returns (items, next_cursor). next_cursor is None when there is nothing after this page."""
+    counts = mutual_counts(user_id)
+    items = []
+
+    # 1. Users with mutual connections, best ranked first
+    if cursor is None or cursor[0] > 0:
+        ranked = sorted(((-mutual, candidate) for candidate, mutual in counts.items()))
+        if cursor is not None:
+            ranked = [key for key in ranked if key > (-cursor[0], cursor[1])]
+        for start in range(0, len(ranked), limit * 2):
+            chunk = ranked[start:start + limit * 2]
+            rows = dict((user.id, (user, request_id)) for user, request_id in
+                        _candidates_query(user_id).filter(User.id.in_([c for _, c in chunk])))
+            for neg_mutual, candidate in chunk:
+                if candidate in rows:
+                    items.append(_to_item(*rows[candidate], -neg_mutual))
+                    if len(items) == limit:
+                        return items, f"{-neg_mutual}.{candidate}"
+        cursor = None
+
+    # 2. Everybody else, by id
+    after_id = cursor[1] if cursor else 0
+    while len(items) < limit:
+        rows = (_candidates_query(user_id)
+                .filter(User.id > after_id)
+                .order_by(User.id.asc())
+                .limit(limit)
+                .all())
+        if not rows:
+            return items, None
+        for user, request_id in rows:
+            after_id = user.id
+            if user.id in counts:
+                continue  # already listed in the ranked part
+            items.append(_to_item(user, request_id, 0))
+            if len(items) == limit:
+                break
+    return items, f"0.{after_id}"
@@ -1,12 +1,20 @@
 import os
-import random
+import secrets
 import string
 import smtplib
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes, hmac, padding
 import base64
+import binascii
+import struct
+import zlib
 import requests
+import logging
+
+from apps.metrics import timed_crypto
+
+logger = logging.getLogger(__name__)
 
 
 def send_email(to_email, subject, body):
@@ -28,10 +36,10 @@ def send_email(to_email, subject, body):
 
     try:
         r = requests.post(url, json=data, headers=headers)
-        print("EMAIL SENT RESPONSE:", r.text)
+        logger.info("email sent", extra={"status": r.status_code})
         return True
     except Exception as e:
-        print("Email send error:", e)
+        logger.warning("email send error: %s", e)
         return False
 
 # def send_email(to_email, subject, body):
@@ -59,8 +67,8 @@ def send_email(to_email, subject, body):
 #         return False
 
 def gen_otp(length=4):
-    """Generates a random N-digit OTP."""
-    return ''.join(random.choices(string.digits, k=length))
+    """Generates a random N-digit OTP from the OS CSPRNG (`random` is predictable from its output)."""
+    return ''.join(secrets.choice(string.digits) for _ in range(length))
 
 
 def get_chat_room_name(user_a_id, user_b_id):
@@ -80,84 +88,241 @@ try:
         # Pad or use a default secure key if the secret is too short
         ENCRYPTION_KEY = (ENCRYPTION_KEY + b'A' * 32)[:32]
 except Exception as e:
-    print(f"Error initializing encryption key: {e}")
+    logger.error("error initializing encryption key: %s", e)
     ENCRYPTION_KEY = b'B' * 32 # Fallback to a default secure key
     
 
-def encrypt_message(plaintext):
+# Stored message content (Message.content_bin):
+#   version (1 byte) | flags (1 byte) | key id (1 byte) | IV (12) | ciphertext | GCM tag (16)
+# Rows written before the binary column hold base64(IV + ciphertext + tag) text in
+# Message.content instead; decrypt_message reads both until apps.content_conversion
+# has converted them. The header isn't covered by the GCM tag (converted legacy rows were
+# encrypted without it), but a wrong key id still fails authentication and a flipped
+# compression flag fails to inflate or decode.
+CONTENT_FORMAT_VERSION = 1
+CONTENT_HEADER = struct.Struct('>BBB')
+LEGACY_KEY_ID = 0  # the key derived from SECRET_KEY above; legacy base64 rows all use it
+
+
+def load_keyring(spec=None, current=None):
     """
-    Encrypts plaintext using AES-256-GCM.
-    Returns a base64 encoded string containing the IV, ciphertext, and tag.
+    Key id -> AES-256 key. Id 0 is always ENCRYPTION_KEY; further keys come from
+    ENCRYPTION_KEYS ("1:<base64 key>,2:<base64 key>") and new content is written with
+    ENCRYPTION_KEY_ID (default: the highest id). Returns (keyring, current key id).
+
+    To rotate, add a key under a new id and restart: new messages use it at once and
+    apps.key_rotation re-encrypts the stored ones in the background. Keep retired keys
+    in the keyring until that job has finished.
     """
-    if not plaintext:
-        return ""
-    
-    plaintext_bytes = plaintext.encode('utf-8')
+    spec = os.getenv("ENCRYPTION_KEYS", "") if spec is None else spec
+    keyring = {LEGACY_KEY_ID: ENCRYPTION_KEY}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        try:
+            key_id, _, encoded = entry.partition(':')
+            key_id, key = int(key_id), base64.b64decode(encoded, validate=True)
+        except (ValueError, binascii.Error):
+            logger.error("ignoring malformed ENCRYPTION_KEYS entry")
+            continue
+        if not 0 < key_id < 256 or len(key) != 32:
+            logger.error("ignoring ENCRYPTION_KEYS entry %s: needs an id from 1 to 255 and a 32-byte key", key_id)
+            continue
+        keyring[key_id] = key
+
+    current = os.getenv("ENCRYPTION_KEY_ID") if current is None else current
+    current = max(keyring) if current in (None, '') else int(current)
+    if current not in keyring:
+        # Writing with a key nobody can load later would lose those messages
+        logger.critical("ENCRYPTION_KEY_ID %s is not in the keyring; encrypting with key %s", current, max(keyring))
+        current = max(keyring)
+    return keyring, current
 
+
+KEYRING, CURRENT_KEY_ID = load_keyring()
+
+# Header flags
+FLAG_DEFLATE = 0x01  # the plaintext was raw-deflated before encryption
+KNOWN_FLAGS = FLAG_DEFLATE
+
+# Long messages (pasted logs, code, documents) are deflated before encryption when that
+# makes them smaller; short chat lines don't compress and are stored as is. Compression
+# lets the ciphertext length depend on how repetitive the text is, which only matters
+# where an attacker can mix their own text into a message and watch its size; a message
+# here has a single author. See benchmarks/bench_content_compression.py for the numbers.
+_compression = {'min_bytes': 512, 'level': 1}
+
+
+def configure_compression(min_bytes=None, level=None):
+    """Plaintext size from which messages are compressed (0 turns it off) and the zlib level."""
+    if min_bytes is not None:
+        _compression['min_bytes'] = min_bytes
+    if level is not None:
+        _compression['level'] = level
+
+
+def _compress(plaintext_bytes):
+    """(payload, flags): the deflated text if compression applies and saves space, else the text."""
+    min_bytes = _compression['min_bytes']
+    if not min_bytes or len(plaintext_bytes) < min_bytes:
+        return plaintext_bytes, 0
+    # Raw deflate: no zlib header or checksum, the GCM tag already authenticates the payload
+    compressor = zlib.compressobj(_compression['level'], zlib.DEFLATED, -15)
+    packed = compressor.compress(plaintext_bytes) + compressor.flush()
+    if len(packed) >= len(plaintext_bytes):
+        return plaintext_bytes, 0
+    return packed, FLAG_DEFLATE
+
+
+def _encrypt_raw(plaintext_bytes, key):
+    """IV + ciphertext + tag."""
     # Generate a random 12-byte Initialization Vector (IV/Nonce) for GCM
-    iv = os.urandom(12) 
-    
+    iv = os.urandom(12)
+
     # Create the cipher object
     cipher = Cipher(
-        algorithms.AES(ENCRYPTION_KEY),
+        algorithms.AES(key),
         modes.GCM(iv),
         backend=default_backend()
     )
-    
+
     encryptor = cipher.encryptor()
-    
+
     # Encrypt the data
     ciphertext = encryptor.update(plaintext_bytes) + encryptor.finalize()
-    
+
     # The Authentication Tag (auth_tag) is produced by GCM mode
-    tag = encryptor.tag
-    
-    # Package the IV, ciphertext, and tag for storage/transmission (Base64 for safety)
-    # Format: IV (12 bytes) + Ciphertext + Tag (16 bytes)
-    encrypted_data = base64.b64encode(iv + ciphertext + tag)
-    
-    return encrypted_data.decode('utf-8')
+    return iv + ciphertext + encryptor.tag
 
 
-def decrypt_message(encrypted_data_b64):
-    """
-    Decrypts base64 encoded data (IV + Ciphertext + Tag) using AES-256-GCM.
-    """
-    if not encrypted_data_b64:
-        return ""
+def _open_raw(encrypted_data, key):
+    """Authenticated payload bytes of IV + ciphertext + tag; raises if the tag doesn't verify."""
+    # Separate the parts: IV (12 bytes), Ciphertext, Tag (16 bytes)
+    iv = encrypted_data[:12]
+    tag = encrypted_data[-16:]
+    ciphertext = encrypted_data[12:-16]
+
+    # Create the cipher object with the IV and Tag
+    cipher = Cipher(
+        algorithms.AES(key),
+        modes.GCM(iv, tag),
+        backend=default_backend()
+    )
+
+    decryptor = cipher.decryptor()
+
+    # Decrypt the data and authenticate the tag
+    return decryptor.update(ciphertext) + decryptor.finalize()
 
-    try:
-        # Decode the base64 string back to bytes
-        encrypted_data = base64.b64decode(encrypted_data_b64)
-    except:
-        return "[Decryption Failed: Invalid Data Format]"
 
+def _decrypt_raw(encrypted_data, flags=0, key_id=LEGACY_KEY_ID):
+    """Plaintext of IV + ciphertext + tag, or a "[Decryption Failed ...]" marker."""
     # Check minimum length (IV: 12 bytes, Tag: 16 bytes = 28 bytes)
     if len(encrypted_data) < 28:
         return "[Decryption Failed: Data Too Short]"
 
-    # Separate the parts: IV (12 bytes), Ciphertext, Tag (16 bytes)
-    iv = encrypted_data[:12]
-    tag = encrypted_data[-16:]
-    ciphertext = encrypted_data[12:-16]
+    try:
+        decrypted_bytes = _open_raw(encrypted_data, KEYRING[key_id])
+    except Exception as e:
+        # Authentication failure means the message was tampered with or the key is wrong
+        logger.warning("decryption failed (authentication failure): %r", e)
+        return "[Decryption Failed: Authentication Error]"
 
     try:
-        # Create the cipher object with the IV and Tag
-        cipher = Cipher(
-            algorithms.AES(ENCRYPTION_KEY),
-            modes.GCM(iv, tag),
-            backend=default_backend()
-        )
-        
-        decryptor = cipher.decryptor()
-        
-        # Decrypt the data and authenticate the tag
-        decrypted_bytes = decryptor.update(ciphertext) + decryptor.finalize()
-        
+        if flags & FLAG_DEFLATE:
+            decrypted_bytes = zlib.decompress(decrypted_bytes, -15)
         # Decode the bytes back to a UTF-8 string
         return decrypted_bytes.decode('utf-8')
+    except (zlib.error, UnicodeDecodeError) as e:
+        logger.warning("decrypted message content is unreadable: %r", e)
+        return "[Decryption Failed: Invalid Data Format]"
+
+
+def _parse_header(encrypted_data):
+    """(flags, key id, IV + ciphertext + tag) of binary content, or None if this build can't read it."""
+    if len(encrypted_data) < CONTENT_HEADER.size:
+        return None
+    version, flags, key_id = CONTENT_HEADER.unpack_from(encrypted_data)
+    if version != CONTENT_FORMAT_VERSION or flags & ~KNOWN_FLAGS or key_id not in KEYRING:
+        logger.warning("unsupported content header", extra={"version": version, "flags": flags, "key_id": key_id})
+        return None
+    return flags, key_id, encrypted_data[CONTENT_HEADER.size:]
 
+
+@timed_crypto('encrypt')
+def encrypt_message(plaintext):
+    """
+    Encrypts plaintext using AES-256-GCM with the current key, deflating it first if it is long.
+    Returns the binary stored format (header + IV + ciphertext + tag) for Message.content_bin.
+    """
+    if not plaintext:
+        return b""
+    payload, flags = _compress(plaintext.encode('utf-8'))
+    header = CONTENT_HEADER.pack(CONTENT_FORMAT_VERSION, flags, CURRENT_KEY_ID)
+    return header + _encrypt_raw(payload, KEYRING[CURRENT_KEY_ID])
+
+
+@timed_crypto('decrypt')
+def decrypt_message(encrypted_data):
+    """
+    Decrypts stored message content: the binary format (bytes) or legacy base64 text.
+    """
+    if not encrypted_data:
+        return ""
+
+    if isinstance(encrypted_data, str):
+        try:
+            # Decode the base64 string back to bytes
+            return _decrypt_raw(base64.b64decode(encrypted_data))
+        except binascii.Error:
+            return "[Decryption Failed: Invalid Data Format]"
+
+    encrypted_data = bytes(encrypted_data)
+    if len(encrypted_data) < CONTENT_HEADER.size:
+        return "[Decryption Failed: Data Too Short]"
+    parsed = _parse_header(encrypted_data)
+    if parsed is None:
+        return "[Decryption Failed: Unsupported Format]"
+    flags, key_id, sealed = parsed
+    return _decrypt_raw(sealed, flags, key_id)
+
+
+def legacy_to_binary(text):
+    """
+    The binary stored format of legacy base64 content, without re-encrypting
+    (same key, same IV/ciphertext/tag). None if the text isn't valid legacy content.
+    """
+    if not text:
+        return b""
+    try:
+        raw = base64.b64decode(text, validate=True)
+    except binascii.Error:
+        return None
+    if len(raw) < 28:
+        return None
+    return CONTENT_HEADER.pack(CONTENT_FORMAT_VERSION, 0, LEGACY_KEY_ID) + raw
+
+
+def reencrypt_message(stored):
+    """
+    Stored content (binary or legacy text) re-encrypted under the current key, keeping its
+    flags and payload as they are. None if it already uses the current key or can't be
+    authenticated with the key it names.
+    """
+    if not stored:
+        return None
+    if isinstance(stored, str):
+        stored = legacy_to_binary(stored)
+        if stored is None:
+            return None
+    parsed = _parse_header(bytes(stored))
+    if parsed is None:
+        return None
+    flags, key_id, sealed = parsed
+    if key_id == CURRENT_KEY_ID or len(sealed) < 28:
+        return None
+    try:
+        payload = _open_raw(sealed, KEYRING[key_id])
     except Exception as e:
-        # Authentication failure means the message was tampered with or the key is wrong
-        print(f"Decryption Error (Authentication failure): {e}")
-        return "[Decryption Failed: Authentication Error]"
\ No newline at end of file
+        logger.warning("re-encryption skipped (authentication failure): %r", e)
+        return None
+    header = CONTENT_HEADER.pack(CONTENT_FORMAT_VERSION, flags, CURRENT_KEY_ID)
+    return header + _encrypt_raw(payload, KEYRING[CURRENT_KEY_ID])
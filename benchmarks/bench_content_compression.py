@@ -0,0 +1,204 @@
+"""
+Stored size and CPU cost of compressing message text before encryption.
+
+    python -m benchmarks.bench_content_compression [--messages 400] [--min-bytes 512]
+
+The corpus mixes what people actually send: short chat lines, paragraph-length
+messages, and long pastes (slices of this repository's source, stack traces, log
+excerpts and JSON documents). Each bucket is stored with compression off and then
+with raw deflate at each --levels setting, through the real encrypt_message /
+decrypt_message, and the report shows the stored bytes against the UTF-8 text and the
+time per encrypt and decrypt. Messages shorter than --min-bytes are never compressed,
+so the chat bucket mostly shows that the threshold keeps them at zero cost.
+
+zstandard and lz4, if installed, are measured on the raw pastes for comparison only;
+the stored format uses zlib's deflate.
+"""
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+
+from benchmarks.common import write_results
+from benchmarks.seed import _WORDS
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover - optional dependency
+    lz4_frame = None
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+_SENTENCES = (
+    "I went through the draft last night and most of it reads well.",
+    "The second section still feels long, maybe we can cut the background part?",
+    "Can you send me the final numbers before the call on Thursday?",
+    "We landed late, the train was cancelled so we took a cab from the airport.",
+    "Honestly I think the old layout was easier to use, the new menu hides everything.",
+    "Let me know if the invoice needs another signature, I'm in the office until six.",
+    "My sister is visiting this weekend so I might be slow to reply.",
+    "The photos from the trip are in the shared folder, the good ones are near the end.",
+)
+
+
+def chat_lines(rng, count):
+    return [' '.join(rng.choices(_WORDS, k=rng.randint(2, 18))) for _ in range(count)]
+
+
+def paragraphs(rng, count):
+    return [' '.join(rng.choices(_SENTENCES, k=rng.randint(3, 9))) for _ in range(count)]
+
+
+def _stack_trace(rng):
+    frames = []
+    for _ in range(rng.randint(6, 20)):
+        module = rng.choice(('apps/routes/user.py', 'apps/routes/socket.py', 'apps/models.py',
+                             'site-packages/sqlalchemy/engine/base.py', 'site-packages/flask/app.py'))
+        frames.append(f'  File "/srv/chat/{module}", line {rng.randint(10, 2000)}, in handler_{rng.randint(1, 99)}\n'
+                      f'    result = session.execute(statement, params)')
+    return 'Traceback (most recent call last):\n' + '\n'.join(frames) + \
+        '\nsqlalchemy.exc.OperationalError: (pymysql.err.OperationalError) (2013, \'Lost connection\')'
+
+
+def _log_excerpt(rng):
+    lines = []
+    for n in range(rng.randint(15, 60)):
+        lines.append(f'2026-10-{rng.randint(1, 28):02d} 14:{n % 60:02d}:{rng.randint(0, 59):02d},{rng.randint(0, 999):03d} '
+                     f'{rng.choice(("INFO", "INFO", "WARNING", "ERROR"))} apps.routes.socket '
+                     f'message delivered sender={rng.randint(1, 9999)} receiver={rng.randint(1, 9999)} '
+                     f'latency_ms={rng.uniform(1, 80):.1f}')
+    return '\n'.join(lines)
+
+
+def _json_document(rng):
+    items = [{'id': rng.randint(1, 10**6), 'name': rng.choice(_WORDS), 'quantity': rng.randint(1, 20),
+              'price': round(rng.uniform(1, 500), 2), 'tags': rng.sample(_WORDS, 3)}
+             for _ in range(rng.randint(5, 40))]
+    return json.dumps({'order': rng.randint(1, 10**6), 'items': items, 'status': 'pending'}, indent=2)
+
+
+def _source_slice(rng, sources):
+    text = rng.choice(sources)
+    length = rng.randint(1024, 8192)
+    start = rng.randrange(max(1, len(text) - length))
+    return text[start:start + length]
+
+
+def pastes(rng, count):
+    sources = [path.read_text() for path in sorted((REPO_ROOT / 'apps').rglob('*.py'))
+               if path.stat().st_size > 2048]
+    makers = (_stack_trace, _log_excerpt, _json_document, lambda r: _source_slice(r, sources))
+    return [makers[n % len(makers)](rng) for n in range(count)]
+
+
+def corpus(messages, seed):
+    rng = random.Random(seed)
+    return {
+        'chat': chat_lines(rng, messages),
+        'paragraph': paragraphs(rng, messages),
+        'paste': pastes(rng, max(8, messages // 4)),
+    }
+
+
+def measure(texts, repeat):
+    """Stored bytes and mean encrypt/decrypt microseconds with the current compression settings."""
+    from apps.utils import decrypt_message, encrypt_message
+
+    encrypt = getattr(encrypt_message, '__wrapped__', encrypt_message)
+    decrypt = getattr(decrypt_message, '__wrapped__', decrypt_message)
+    stored = [encrypt(text) for text in texts]
+    assert [decrypt(blob) for blob in stored] == texts
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            encrypt(text)
+    encrypt_us = (time.perf_counter() - start) / (repeat * len(texts)) * 1e6
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for blob in stored:
+            decrypt(blob)
+    decrypt_us = (time.perf_counter() - start) / (repeat * len(texts)) * 1e6
+
+    raw = sum(len(text.encode('utf-8')) for text in texts)
+    size = sum(len(blob) for blob in stored)
+    return {
+        'raw_bytes': raw,
+        'stored_bytes': size,
+        'ratio': round(size / raw, 3),
+        'compressed_share': round(sum(1 for blob in stored if blob[1]) / len(stored), 3),
+        'encrypt_us': round(encrypt_us, 2),
+        'decrypt_us': round(decrypt_us, 2),
+    }
+
+
+def other_codecs(texts, repeat):
+    """Compressed/raw ratio and compress+decompress microseconds of optional codecs, without encryption."""
+    codecs = {}
+    if zstandard is not None:
+        compressor, decompressor = zstandard.ZstdCompressor(level=3), zstandard.ZstdDecompressor()
+        codecs['zstd-3'] = (compressor.compress, decompressor.decompress)
+    if lz4_frame is not None:
+        codecs['lz4'] = (lz4_frame.compress, lz4_frame.decompress)
+    results = {}
+    data = [text.encode('utf-8') for text in texts]
+    for name, (compress, decompress) in codecs.items():
+        packed = [compress(item) for item in data]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for item in data:
+                decompress(compress(item))
+        micros = (time.perf_counter() - start) / (repeat * len(data)) * 1e6
+        results[name] = {'ratio': round(sum(map(len, packed)) / sum(map(len, data)), 3),
+                         'roundtrip_us': round(micros, 2)}
+    return results
+
+
+def main():
+    from apps.utils import configure_compression
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=400, help="chat lines and paragraphs (pastes: a quarter)")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-bytes', type=int, default=512, help="MESSAGE_COMPRESS_MIN_BYTES")
+    parser.add_argument('--levels', default='1,6', help="zlib levels to compare")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--out', help="result file (default: benchmarks/results/...)")
+    args = parser.parse_args()
+
+    buckets = corpus(args.messages, args.seed)
+    settings = {'off': (0, None)}
+    settings.update({f'deflate-{level}': (args.min_bytes, int(level)) for level in args.levels.split(',')})
+
+    results = {}
+    for bucket, texts in buckets.items():
+        mean = sum(len(text.encode('utf-8')) for text in texts) // len(texts)
+        print(f"\n{bucket}: {len(texts)} messages, {mean} bytes on average")
+        print(f"  {'setting':<12}{'stored':>10}{'ratio':>8}{'compressed':>12}{'encrypt us':>12}{'decrypt us':>12}")
+        results[bucket] = {}
+        for name, (min_bytes, level) in settings.items():
+            configure_compression(min_bytes, level)
+            row = results[bucket][name] = measure(texts, args.repeat)
+            print(f"  {name:<12}{row['stored_bytes']:>10}{row['ratio']:>8.2f}{row['compressed_share']:>12.0%}"
+                  f"{row['encrypt_us']:>12.1f}{row['decrypt_us']:>12.1f}")
+
+    results['other_codecs'] = other_codecs(buckets['paste'], args.repeat)
+    for name, row in results['other_codecs'].items():
+        print(f"\npaste, {name} (no encryption): ratio {row['ratio']:.2f}, {row['roundtrip_us']:.1f} us round trip")
+    missing = [pkg for pkg, mod in (('zstandard', zstandard), ('lz4', lz4_frame)) if mod is None]
+    if missing:
+        print(f"\nskipped (not installed): {', '.join(missing)}")
+
+    params = dict(messages=args.messages, repeat=args.repeat, min_bytes=args.min_bytes, levels=args.levels,
+                  seed=args.seed)
+    out = write_results('content-compression', params, results, args.out)
+    print(f"\nresults written to {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Bytes on the wire and encode time per payload encoding.
+
+    python -m benchmarks.bench_serialization [--iterations 2000]
+
+Payloads are shaped like the real ones: a new_message event, a presence_update and a
+50-message /api/messages page. Encodings that need an optional package (brotli,
+msgpack) are skipped when it isn't installed.
+"""
+import argparse
+import gzip
+import json
+import time
+from datetime import datetime, timedelta
+
+from apps import compact
+from apps.compression import brotli
+
+
+def sample_payloads():
+    now = datetime(2025, 11, 3, 14, 30, 12, 123456)
+    message = {
+        "id": 184467,
+        "sender_id": 1042,
+        "receiver_id": 877,
+        "content": "Are we still on for tomorrow? I can bring the slides.",
+        "timestamp": now.isoformat(),
+        "media_url": None,
+        "media_type": None,
+        "seq": 90211,
+    }
+    presence = {"user_id": 1042, "online": False, "last_seen": "2025-11-03T20:00:12.123456+05:30"}
+    history = {
+        "messages": [
+            dict(message, id=184467 - i, timestamp=(now - timedelta(minutes=3 * i)).isoformat(),
+                 is_edited=False, is_deleted_for_everyone=False)
+            for i in range(50)
+        ],
+        "total_messages": 1260,
+        "current_page": 1,
+        "has_more": True,
+    }
+    return {"new_message": message, "presence_update": presence, "history_page": history}
+
+
+def encoders():
+    def as_json(payload):
+        return json.dumps(payload, separators=(",", ":")).encode()
+
+    encs = {
+        "json": as_json,
+        "json+gzip": lambda p: gzip.compress(as_json(p), compresslevel=6, mtime=0),
+        "short-keys json": lambda p: as_json(compact.shorten(p)),
+    }
+    if brotli is not None:
+        encs["json+br"] = lambda p: brotli.compress(as_json(p), quality=5)
+    if compact.available():
+        encs["msgpack compact"] = compact.pack
+    return encs
+
+
+def measure(encode, payload, iterations):
+    size = len(encode(payload))
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encode(payload)
+    elapsed = time.perf_counter() - start
+    return size, elapsed / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    encs = encoders()
+    for name, payload in sample_payloads().items():
+        print(f"\n{name}")
+        print(f"  {'encoding':<18}{'bytes':>8}{'vs json':>9}{'encode us':>11}")
+        baseline = None
+        for enc_name, encode in encs.items():
+            size, micros = measure(encode, payload, args.iterations)
+            baseline = baseline or size
+            print(f"  {enc_name:<18}{size:>8}{size / baseline:>8.0%}{micros:>11.1f}")
+    missing = [pkg for pkg, mod in (("brotli", brotli), ("msgpack", compact.msgpack)) if mod is None]
+    if missing:
+        print(f"\nskipped (not installed): {', '.join(missing)}")
+
+
+if __name__ == "__main__":
+    main()
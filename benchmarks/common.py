@@ -0,0 +1,153 @@
+"""
+Shared setup for the benchmark scripts: app/database bootstrap, bulk seeding,
+percentiles and the JSON result files that benchmarks/compare.py diffs.
+
+Every script takes --db (any SQLAlchemy URI; defaults to a throwaway SQLite file) so the
+same scenario can run against SQLite or a local MySQL.
+"""
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+RESULTS_DIR = Path(__file__).with_name('results')
+
+# Shared by the seeding process and any server process started for a run
+BENCH_SECRET = 'benchmark-secret-key-0123456789abcdef'
+
+
+def default_db_uri():
+    return f"sqlite:///{tempfile.mkdtemp(prefix='chat-bench-')}/bench.db"
+
+
+def bench_config(db_uri, **overrides):
+    config = {
+        'SQLALCHEMY_DATABASE_URI': db_uri,
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SECRET_KEY': BENCH_SECRET,
+        'JWT_SECRET_KEY': BENCH_SECRET,
+        'JWT_ACCESS_TOKEN_EXPIRES': timedelta(hours=6),
+        'JWT_TOKEN_LOCATION': ['headers'],
+        # Simulated clients send far faster than the per-user limits allow
+        'RATE_LIMIT_ENABLED': False,
+    }
+    config.update(overrides)
+    return config
+
+
+def create_bench_app(db_uri, **overrides):
+    """App configured for benchmarking, with its tables created."""
+    from apps.routes import create_app
+    from apps.models import db
+
+    app = create_app(bench_config(db_uri, **overrides))
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def insert_rows(table, rows, batch_size=5000):
+    """Executemany insert in batches; `rows` may be any iterable of dicts."""
+    from apps.models import db
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            db.session.execute(table.insert(), batch)
+            db.session.commit()
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+
+
+def seed_users(count, start=1):
+    """Inserts `count` verified users (password "benchpass") and returns their ids."""
+    from werkzeug.security import generate_password_hash
+    from apps.models import User
+
+    password_hash = generate_password_hash('benchpass')  # hashed once, shared by every row
+    created = datetime.utcnow() - timedelta(days=365)
+    ids = list(range(start, start + count))
+    insert_rows(User.__table__, ({
+        'id': user_id,
+        'email': f'bench{user_id}@example.com',
+        'name': f'bench{user_id}',
+        'name_normalized': f'bench{user_id}',
+        'password_hash': password_hash,
+        'verified': True,
+        'created_at': created,
+    } for user_id in ids))
+    return ids
+
+
+def connect_pairs(pairs):
+    """Adds both chat list entries for each (a, b)."""
+    from apps.models import UserChatList
+
+    insert_rows(UserChatList.__table__, (
+        {'user_id': x, 'other_user_id': y, 'is_blocked': False, 'pin_priority': 0, 'is_favorite': False}
+        for a, b in pairs for x, y in ((a, b), (b, a))
+    ))
+
+
+def tokens_for(app, user_ids):
+    from flask_jwt_extended import create_access_token
+
+    with app.app_context():
+        return {user_id: create_access_token(identity=str(user_id)) for user_id in user_ids}
+
+
+def percentiles(samples, points=(50, 90, 95, 99)):
+    """Summary in milliseconds of a list of durations in seconds."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    summary = {'count': len(ordered), 'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3)}
+    for p in points:
+        index = min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))
+        summary[f'p{p}_ms'] = round(ordered[index] * 1000, 3)
+    summary['max_ms'] = round(ordered[-1] * 1000, 3)
+    return summary
+
+
+def rss_mb(pid=None):
+    """Resident memory of a process in MB (Linux /proc), or None where unavailable."""
+    try:
+        with open(f"/proc/{pid or os.getpid()}/status") as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=Path(__file__).parent, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(suite, params, results, out=None):
+    """Writes a result file (default benchmarks/results/<suite>-<timestamp>.json) and returns its path."""
+    payload = {
+        'suite': suite,
+        'created_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'params': params,
+        'results': results,
+    }
+    if out is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        out = RESULTS_DIR / f"{suite}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    Path(out).write_text(json.dumps(payload, indent=2, sort_keys=True))
+    return out
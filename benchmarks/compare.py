@@ -0,0 +1,86 @@
+"""
+Compares two benchmark result files and flags regressions.
+
+    python -m benchmarks.compare before.json after.json [--threshold 10]
+
+Every numeric result is matched by its path. Latencies, durations, memory, lost
+messages and failures are lower-is-better; rates (*_per_sec) are higher-is-better; other
+numbers (counts) are shown but never flagged. Exits 1 if any metric got worse by more
+than --threshold percent. A zero baseline has no percentage: a lower-is-better metric
+rising from 0, or a higher-is-better one falling to 0, is always a regression.
+"""
+import argparse
+import json
+import math
+import sys
+
+LOWER_IS_BETTER = ('_ms', 'seconds', 'rss', 'lost', 'failed')
+HIGHER_IS_BETTER = ('per_sec',)
+
+
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f"{prefix}.{key}" if prefix else str(key))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def direction(path):
+    if any(marker in path for marker in HIGHER_IS_BETTER):
+        return 1
+    if any(marker in path for marker in LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(before, after, threshold):
+    """Returns [(path, before, after, change %, regressed)] for metrics present in both."""
+    old = dict(flatten(before['results']))
+    rows = []
+    for path, new_value in flatten(after['results']):
+        if path not in old:
+            continue
+        old_value = old[path]
+        sign = direction(path)
+        if old_value:
+            change = (new_value - old_value) / old_value * 100
+        else:
+            # From 0 any increase is unbounded: +inf%, shown as such and always over the threshold
+            change = math.copysign(math.inf, new_value) if new_value else 0.0
+        regressed = sign != 0 and (-sign * change > threshold or (sign > 0 and old_value > 0 and new_value <= 0))
+        rows.append((path, old_value, new_value, change, regressed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before.get('suite') != after.get('suite'):
+        print(f"warning: comparing different suites ({before.get('suite')} vs {after.get('suite')})")
+    if before.get('params') != after.get('params'):
+        print("warning: parameters differ between the runs")
+
+    rows = compare(before, after, args.threshold)
+    width = max((len(path) for path, *_ in rows), default=10)
+    print(f"{'metric':<{width}}  {'before':>12}  {'after':>12}  {'change':>8}")
+    for path, old_value, new_value, change, regressed in rows:
+        mark = '  REGRESSION' if regressed else ''
+        print(f"{path:<{width}}  {old_value:>12g}  {new_value:>12g}  {change:>+7.1f}%{mark}")
+
+    regressions = [row for row in rows if row[4]]
+    if regressions:
+        print(f"\n{len(regressions)} metric(s) regressed by more than {args.threshold:g}%")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+Socket latency during a login storm.
+
+    python -m benchmarks.login_storm [--logins 200] [--concurrency 16] [--inline]
+
+Starts the app under eventlet (see socket_load.serve), keeps one pair of users chatting
+at a steady rate and measures send -> new_message latency, first with nothing else
+going on and then while --concurrency clients hammer POST /api/login. Every login
+verifies a password hash. With the hash on the native thread pool (the default) the
+storm-phase latency should stay close to the baseline. --inline sets
+CPU_OFFLOAD_ENABLED=False so the same run shows the hub stalling instead.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.common import (
+    connect_pairs, create_bench_app, default_db_uri, percentiles, seed_users, tokens_for, write_results,
+)
+from benchmarks.socket_load import Harness, SimulatedUser, free_port, wait_for_port
+
+
+def probe(user, harness, interval, stop):
+    """Sends a message every `interval` seconds until `stop` is set."""
+    n = 0
+    while not stop.is_set():
+        content = f"probe {n} {time.perf_counter():.6f}"
+        harness.message_sent(content)
+        user.client.emit('send_message', {'token': user.token, 'to': user.partner_id, 'content': content})
+        n += 1
+        stop.wait(interval)
+
+
+def storm(url, emails, results, lock):
+    import requests
+
+    with requests.Session() as session:
+        for email in emails:
+            started = time.perf_counter()
+            response = session.post(f"{url}/api/login", json={'email': email, 'password': 'benchpass'}, timeout=60)
+            elapsed = time.perf_counter() - started
+            with lock:
+                results.append((elapsed, response.status_code == 200))
+
+
+def run(db_uri, logins, concurrency, phase_seconds, interval, inline, pool_size=None):
+    app = create_bench_app(db_uri)
+    with app.app_context():
+        ids = seed_users(2 + concurrency)
+        connect_pairs([(ids[0], ids[1])])
+    tokens = tokens_for(app, ids[:2])
+
+    port = free_port()
+    config = {'CPU_OFFLOAD_ENABLED': not inline}
+    if pool_size:
+        config['CPU_POOL_SIZE'] = pool_size
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.socket_load', 'serve', '--db', db_uri,
+                               '--port', str(port), '--config', json.dumps(config)])
+    url = f"http://127.0.0.1:{port}"
+    harness = Harness(['polling'])
+    users = []
+    login_results, lock = [], threading.Lock()
+    try:
+        wait_for_port(port)
+        users = [SimulatedUser(harness, ids[0], tokens[ids[0]], ids[1]),
+                 SimulatedUser(harness, ids[1], tokens[ids[1]], ids[0])]
+        for user in users:
+            user.connect(url)
+
+        stop = threading.Event()
+        prober = threading.Thread(target=probe, args=(users[0], harness, interval, stop))
+        prober.start()
+        time.sleep(phase_seconds)
+        baseline = list(harness.latencies)
+
+        # Each storm client logs in as its own user, logins / concurrency times
+        per_client = max(1, logins // concurrency)
+        clients = [threading.Thread(target=storm, args=(url, [f'bench{user_id}@example.com'] * per_client,
+                                                         login_results, lock))
+                   for user_id in ids[2:]]
+        storm_start = time.perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        storm_seconds = time.perf_counter() - storm_start
+        during = harness.latencies[len(baseline):]
+
+        stop.set()
+        prober.join()
+        deadline = time.monotonic() + 10
+        while harness.sent_at and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        for user in users:
+            user.close()
+        server.terminate()
+        server.wait(timeout=10)
+
+    return {
+        'probe_latency_baseline': percentiles(baseline),
+        'probe_latency_storm': percentiles(during),
+        'messages_lost': len(harness.sent_at),
+        'login_latency': percentiles([elapsed for elapsed, _ in login_results]),
+        'logins_failed': sum(1 for _, ok in login_results if not ok),
+        'logins_per_sec': round(len(login_results) / storm_seconds, 1) if storm_seconds else None,
+        'storm_seconds': round(storm_seconds, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket latency during a login storm")
+    parser.add_argument('--logins', type=int, default=200, help="total logins in the storm")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--baseline-seconds', type=float, default=3.0)
+    parser.add_argument('--interval', type=float, default=0.02, help="seconds between probe messages")
+    parser.add_argument('--pool-size', type=int, help="CPU_POOL_SIZE for the server")
+    parser.add_argument('--inline', action='store_true', help="hash on the hub (CPU_OFFLOAD_ENABLED=False)")
+    parser.add_argument('--db', help="SQLAlchemy URI (default: a fresh SQLite file)")
+    parser.add_argument('--out', help="result file (default: benchmarks/results/...)")
+    args = parser.parse_args()
+
+    db_uri = args.db or default_db_uri()
+    results = run(db_uri, args.logins, args.concurrency, args.baseline_seconds, args.interval, args.inline,
+                  args.pool_size)
+    params = dict(logins=args.logins, concurrency=args.concurrency, interval=args.interval,
+                  offload=not args.inline, pool_size=args.pool_size, db=db_uri.split('://')[0])
+    out = write_results('login-storm', params, results, args.out)
+    for key, value in results.items():
+        print(f"{key:>24}: {value}")
+    print(f"\nresults written to {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+REST endpoint micro-benchmarks over a seeded dataset.
+
+    python -m benchmarks.rest_bench --preset small                 # seed a fresh SQLite file, then run
+    python -m benchmarks.seed --preset large --db mysql+pymysql://...
+    python -m benchmarks.rest_bench --db mysql+pymysql://... --preset large --no-seed
+    python -m benchmarks.compare before.json after.json
+
+Every case is a request through the Flask test client as the seeded subject user (user 1),
+so routing, JWT, serialization, decryption and compression are all inside the timing.
+get_messages is measured from the newest page down to the deepest offset of the big
+conversation. The chat list is measured both uncached (its version is bumped before each
+call) and as a cached repeat. Each case reports latency percentiles, the number of SQL
+statements and the response size.
+"""
+import argparse
+import time
+
+from benchmarks.common import create_bench_app, default_db_uri, percentiles, tokens_for, write_results
+from benchmarks.seed import PARTNER_ID, PRESETS, SEARCH_TERM, SUBJECT_ID, seed
+
+# Fractions of the big conversation's length used as get_messages offsets
+MESSAGE_DEPTHS = (0, 0.01, 0.1, 0.5, 0.99)
+
+
+def cases(client, headers):
+    """(name, path, before_each) for every benchmarked request."""
+    from apps.http_cache import bump_version
+
+    headers = {'Authorization': headers['Authorization']}  # uncompressed, these are parsed here
+    total = client.get(f'/api/messages/{PARTNER_ID}?limit=1', headers=headers).get_json()['total_count']
+    offsets = sorted({int(total * depth) for depth in MESSAGE_DEPTHS})
+    first_page = client.get('/api/users/suggestions?limit=20', headers=headers).get_json()
+
+    yield from ((f'messages_offset_{offset}', f'/api/messages/{PARTNER_ID}?offset={offset}&limit=15', None)
+                for offset in offsets)
+    yield 'search_messages', f'/api/messages/search/{PARTNER_ID}?q={SEARCH_TERM}', None
+    yield 'chatlist', '/api/users/chatlist', lambda: bump_version('chatlist', SUBJECT_ID)
+    yield 'chatlist_cached', '/api/users/chatlist', None
+    yield 'notifications', '/api/notifications', None
+    yield 'suggestions_first_page', '/api/users/suggestions?limit=20', None
+    if first_page.get('next_cursor'):
+        yield 'suggestions_next_page', f"/api/users/suggestions?limit=20&cursor={first_page['next_cursor']}", None
+
+
+def measure(client, headers, path, before_each, repeat, warmup):
+    from apps.profiler import assert_max_queries
+
+    samples, queries, size = [], 0, 0
+    for n in range(warmup + repeat):
+        if before_each:
+            before_each()
+        with assert_max_queries(float('inf'), path) as scope:
+            started = time.perf_counter()
+            response = client.get(path, headers=headers)
+            elapsed = time.perf_counter() - started
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {path} -> {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        if n >= warmup:
+            samples.append(elapsed)
+            queries, size = scope.queries, len(response.get_data())
+    return dict(percentiles(samples), queries=queries, response_bytes=size)
+
+
+def run(app, repeat, warmup, only=None, log=print):
+    headers = {'Authorization': f"Bearer {tokens_for(app, [SUBJECT_ID])[SUBJECT_ID]}",
+               'Accept-Encoding': 'gzip'}
+    results = {}
+    with app.test_client() as client:
+        for name, path, before_each in list(cases(client, headers)):
+            if only and name not in only:
+                continue
+            results[name] = measure(client, headers, path, before_each, repeat, warmup)
+            log(f"{name:>26}: p50 {results[name]['p50_ms']:>9.2f} ms  p95 {results[name]['p95_ms']:>9.2f} ms"
+                f"  {results[name]['queries']:>4} queries  {results[name]['response_bytes']:>8} bytes")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="REST endpoint micro-benchmarks")
+    parser.add_argument('--preset', default='small', choices=sorted(PRESETS))
+    parser.add_argument('--db', help="SQLAlchemy URI (default: a fresh SQLite file)")
+    parser.add_argument('--no-seed', action='store_true', help="--db already holds the preset (benchmarks.seed)")
+    parser.add_argument('--archive', action='store_true', help="archive cold months while seeding")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--case', action='append', help="run only this case (repeatable)")
+    parser.add_argument('--out', help="result file (default: benchmarks/results/...)")
+    args = parser.parse_args()
+
+    db_uri = args.db or default_db_uri()
+    app = create_bench_app(db_uri)
+    dataset = None
+    if not args.no_seed:
+        dataset = seed(app, PRESETS[args.preset], archive=args.archive)
+
+    results = run(app, args.repeat, args.warmup, args.case)
+    params = dict(PRESETS[args.preset], preset=args.preset, db=db_uri.split('://')[0], archive=args.archive,
+                  repeat=args.repeat, warmup=args.warmup, dataset=dataset)
+    out = write_results(f'rest-{args.preset}', params, results, args.out)
+    print(f"\nresults written to {out}")
+
+
+if __name__ == '__main__':
+    main()
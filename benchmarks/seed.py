@@ -0,0 +1,165 @@
+"""
+Seeds a realistic dataset for the REST benchmarks.
+
+    python -m benchmarks.seed --preset large --db mysql+pymysql://user:pw@localhost/chat_bench
+    python -m benchmarks.seed --preset small            # fresh SQLite file, path printed
+
+Shape:
+- Friend counts and conversation sizes are long-tailed (Pareto): most chats are short,
+  a few are very long.
+- User 1 is the benchmark subject. It has a large chat list, one huge conversation with
+  user 2 (for deep offsets), pending friend requests and a backlog of notifications.
+- Message contents are real AES-GCM ciphertexts from a pool of pre-encrypted sentences,
+  so reads pay the real decrypt cost. SEARCH_TERM appears in about 2% of them.
+- --archive moves messages older than MESSAGE_HOT_MONTHS into message_archive, as the
+  nightly job would.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import connect_pairs, create_bench_app, default_db_uri, insert_rows, seed_users
+
+SUBJECT_ID = 1
+PARTNER_ID = 2
+SEARCH_TERM = 'invoice'
+
+PRESETS = {
+    'tiny': dict(users=300, messages=20_000, subject_friends=50, subject_conversation=5_000,
+                 notifications=100, friend_requests=20),
+    'small': dict(users=2_000, messages=200_000, subject_friends=200, subject_conversation=20_000,
+                  notifications=300, friend_requests=50),
+    'medium': dict(users=20_000, messages=1_000_000, subject_friends=1_000, subject_conversation=100_000,
+                   notifications=1_000, friend_requests=200),
+    'large': dict(users=100_000, messages=10_000_000, subject_friends=2_000, subject_conversation=500_000,
+                  notifications=2_000, friend_requests=500),
+}
+
+_WORDS = ('hey', 'are', 'we', 'still', 'on', 'for', 'tomorrow', 'lunch', 'meeting', 'call', 'later',
+          'sounds', 'good', 'thanks', 'see', 'you', 'the', 'slides', 'photos', 'weekend', 'train',
+          'running', 'late', 'ok', 'sure', 'maybe', 'next', 'week', 'coffee', 'project', 'deadline')
+
+
+def content_pool(rng, size=512):
+    """Pre-encrypted message bodies; encrypting millions of rows one by one would dominate seeding."""
+    from apps.utils import encrypt_message
+
+    pool = []
+    for n in range(size):
+        words = rng.choices(_WORDS, k=rng.randint(2, 18))
+        if n % 50 == 0:
+            words.insert(rng.randrange(len(words)), SEARCH_TERM)
+        pool.append(encrypt_message(' '.join(words)))
+    return pool
+
+
+def long_tail(rng, alpha, low, high):
+    return int(min(high, max(low, low * rng.paretovariate(alpha))))
+
+
+def friend_pairs(rng, users, subject_friends):
+    pairs = set()
+    for other in range(2, min(users, subject_friends + 1) + 1):
+        pairs.add((SUBJECT_ID, other))
+    for user_id in range(2, users + 1):
+        for _ in range(long_tail(rng, 1.6, 2, 300) // 2):
+            other = rng.randint(2, users)
+            if other != user_id:
+                pairs.add((min(user_id, other), max(user_id, other)))
+    return sorted(pairs)
+
+
+def conversation_sizes(rng, pairs, total, subject_conversation):
+    """Messages per pair: the subject's main conversation first, the rest long-tailed."""
+    sizes = {(SUBJECT_ID, PARTNER_ID): subject_conversation}
+    weights = [rng.paretovariate(1.2) for _ in pairs]
+    scale = max(0, total - subject_conversation) / sum(weights)
+    for pair, weight in zip(pairs, weights):
+        if pair != (SUBJECT_ID, PARTNER_ID):
+            sizes[pair] = int(weight * scale)
+    return sizes
+
+
+def message_rows(rng, sizes, pool, now, span_days=730):
+    for (a, b), count in sizes.items():
+        if not count:
+            continue
+        start = now - timedelta(days=rng.uniform(30, span_days))
+        step = (now - start) / count
+        for n in range(count):
+            sender, receiver = (a, b) if rng.random() < 0.5 else (b, a)
+            yield {
+                'sender_id': sender,
+                'receiver_id': receiver,
+                'content': '',
+                'content_bin': pool[rng.randrange(len(pool))],
+                'timestamp': start + step * n,
+                'is_edited': False,
+                'is_deleted_for_everyone': n % 200 == 0,
+                'is_deleted_for_sender': False,
+                'is_deleted_for_recipient': False,
+            }
+
+
+def seed(app, preset, rng_seed=7, archive=False, log=print):
+    """Seeds `preset` into the app's database and returns dataset stats."""
+    from apps.models import FriendRequest, Message, Notification
+    from apps.archive import archive_old_messages
+
+    rng = random.Random(rng_seed)
+    now = datetime.utcnow()
+    with app.app_context():
+        started = time.perf_counter()
+        seed_users(preset['users'])
+        pairs = friend_pairs(rng, preset['users'], preset['subject_friends'])
+        connect_pairs(pairs)
+        log(f"users={preset['users']} chat pairs={len(pairs)} ({time.perf_counter() - started:.0f}s)")
+
+        sizes = conversation_sizes(rng, pairs, preset['messages'], preset['subject_conversation'])
+        insert_rows(Message.__table__, message_rows(rng, sizes, content_pool(rng), now), batch_size=10_000)
+        log(f"messages={sum(sizes.values())} ({time.perf_counter() - started:.0f}s)")
+
+        friends = [b for a, b in pairs if a == SUBJECT_ID]
+        strangers = range(preset['subject_friends'] + 2, preset['users'] + 1)
+        insert_rows(FriendRequest.__table__, (
+            {'sender_id': sender, 'receiver_id': SUBJECT_ID, 'timestamp': now - timedelta(hours=n)}
+            for n, sender in enumerate(rng.sample(strangers, min(len(strangers), preset['friend_requests'])))
+        ))
+        insert_rows(Notification.__table__, (
+            {'user_id': SUBJECT_ID, 'actor_id': actor,
+             'type': 'request_response' if n % 3 else 'new_user_verified',
+             'content': f"bench{actor} accepted your friend request." if n % 3 else f"bench{actor} just joined.",
+             'timestamp': now - timedelta(minutes=n)}
+            for n, actor in enumerate(rng.choices(friends, k=preset['notifications']))
+        ))
+
+        if archive:
+            moved = archive_old_messages(batch_size=10_000)
+            log(f"archived={moved} ({time.perf_counter() - started:.0f}s)")
+
+    return {
+        'users': preset['users'],
+        'chat_pairs': len(pairs),
+        'messages': sum(sizes.values()),
+        'subject_conversation': sizes[(SUBJECT_ID, PARTNER_ID)],
+        'largest_other_conversation': max(size for pair, size in sizes.items() if pair != (SUBJECT_ID, PARTNER_ID)),
+        'archived': archive,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a benchmark dataset")
+    parser.add_argument('--preset', default='small', choices=sorted(PRESETS))
+    parser.add_argument('--db', help="SQLAlchemy URI of an EMPTY database (default: a fresh SQLite file)")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--archive', action='store_true', help="move cold months to message_archive")
+    args = parser.parse_args()
+
+    db_uri = args.db or default_db_uri()
+    stats = seed(create_bench_app(db_uri), PRESETS[args.preset], args.seed, args.archive)
+    print(f"seeded {db_uri}: {stats}")
+
+
+if __name__ == '__main__':
+    main()
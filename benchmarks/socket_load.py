@@ -0,0 +1,331 @@
+"""
+Socket.IO load harness.
+
+    python -m benchmarks.socket_load --scenario chat [--users 100] [--db mysql+pymysql://...]
+    python -m benchmarks.socket_load --list
+
+Seeds a database, starts the real app (eventlet, like production) in a subprocess and
+drives it with python-socketio clients, one per simulated user: connect, join_chat,
+typing, send_message, pin_chat. Reports send -> new_message latency percentiles at the
+receiver, events per second, and the server's resident memory, then writes a result
+file for benchmarks/compare.py.
+
+The fanout_new_user scenario verifies fresh accounts through POST /api/verify-otp while
+every user is connected, which exercises notify_new_user's broadcast to all of them.
+"""
+import argparse
+import json
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import (
+    bench_config, connect_pairs, create_bench_app, default_db_uri, insert_rows, percentiles,
+    rss_mb, seed_users, tokens_for, write_results,
+)
+
+SCENARIOS = {
+    # Steady one-to-one chatting with typing indicators and the odd pin
+    'chat': dict(users=50, messages_per_user=20, typing_per_message=3, pin_every=10,
+                 send_interval=0.05, new_users=0),
+    # Keystroke-heavy: many typing events per message
+    'typing_storm': dict(users=50, messages_per_user=5, typing_per_message=40, pin_every=0,
+                         send_interval=0.01, new_users=0),
+    # Everyone online while new accounts get verified (notify_new_user fans out to all)
+    'fanout_new_user': dict(users=200, messages_per_user=0, typing_per_message=0, pin_every=0,
+                            send_interval=0.0, new_users=10),
+    # A few users sending as fast as they can
+    'hot_pairs': dict(users=10, messages_per_user=200, typing_per_message=0, pin_every=0,
+                      send_interval=0.0, new_users=0),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not start listening on {port} within {timeout}s")
+
+
+def serve(db_uri, port, overrides=None):
+    """Server process entry point: the app under eventlet, as gunicorn -k eventlet would run it."""
+    import eventlet
+    eventlet.monkey_patch()
+
+    from engineio.payload import Payload
+    from apps.routes import create_app
+    from apps.routes.socket import socketio
+
+    # Simulated clients emit far faster than a person types, so one polling POST carries
+    # more packets than the default cap of 16
+    Payload.max_decode_packets = 10000
+
+    app = create_app(bench_config(db_uri, **(overrides or {})))
+    socketio.run(app, host='127.0.0.1', port=port, log_output=False)
+
+
+class SimulatedUser:
+    def __init__(self, harness, user_id, token, partner_id):
+        import socketio as sio
+        from engineio.payload import Payload
+
+        # A busy polling client gets many packets per poll response; the client's default
+        # cap (16) would abort the connection with "Unexpected packet from server"
+        Payload.max_decode_packets = 10000
+
+        self.harness = harness
+        self.user_id = user_id
+        self.token = token
+        self.partner_id = partner_id
+        self.client = sio.Client(reconnection=False)
+        self.client.on('*', self._on_any)
+        self.client.on('new_message', self._on_new_message)
+        self.client.on('notification', self._on_notification)
+
+    def _on_any(self, event, *args):
+        self.harness.count_event()
+
+    def _on_new_message(self, payload):
+        self.harness.count_event()
+        if payload.get('receiver_id') == self.user_id:
+            self.harness.message_received(payload.get('content'))
+
+    def _on_notification(self, payload):
+        self.harness.count_event()
+        if payload.get('type') == 'new_user_verified':
+            self.harness.fanout_received()
+
+    def connect(self, url):
+        # The token also goes in the query string: the disconnect handler reads it from there
+        self.client.connect(f"{url}?token={self.token}", auth={'token': self.token},
+                            transports=self.harness.transports, wait_timeout=30)
+        if self.partner_id:
+            # call() waits for the ack, so the room is joined before anyone sends into it
+            self.client.call('join_chat', {'token': self.token, 'other_id': self.partner_id}, timeout=30)
+
+    def run(self, scenario):
+        rng = random.Random(self.user_id)
+        for n in range(scenario['messages_per_user']):
+            for _ in range(scenario['typing_per_message']):
+                self.client.emit('typing', {'token': self.token, 'to_id': self.partner_id, 'is_typing': True})
+                self.harness.count_sent()
+            content = f"bench {self.user_id} {n} {rng.random():.6f}"
+            self.harness.message_sent(content)
+            self.client.emit('send_message', {'token': self.token, 'to': self.partner_id, 'content': content})
+            self.harness.count_sent()
+            if scenario['pin_every'] and n % scenario['pin_every'] == 0:
+                self.client.emit('pin_chat', {'token': self.token, 'other_user_id': self.partner_id, 'pin': True})
+                self.harness.count_sent()
+            if scenario['send_interval']:
+                time.sleep(scenario['send_interval'])
+
+    def close(self):
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+
+class Harness:
+    def __init__(self, transports):
+        self.transports = transports
+        self.lock = threading.Lock()
+        self.sent_at = {}
+        self.latencies = []
+        self.events_received = 0
+        self.events_sent = 0
+        self.fanout_started = None
+        self.fanout_latencies = []
+
+    def count_event(self):
+        with self.lock:
+            self.events_received += 1
+
+    def count_sent(self):
+        with self.lock:
+            self.events_sent += 1
+
+    def message_sent(self, content):
+        with self.lock:
+            self.sent_at[content] = time.perf_counter()
+
+    def message_received(self, content):
+        now = time.perf_counter()
+        with self.lock:
+            sent = self.sent_at.pop(content, None)
+            if sent is not None:
+                self.latencies.append(now - sent)
+
+    def fanout_received(self):
+        now = time.perf_counter()
+        with self.lock:
+            if self.fanout_started is not None:
+                self.fanout_latencies.append(now - self.fanout_started)
+
+
+def seed(app, scenario):
+    """
+    Users paired up (1-2, 3-4, ...) plus unverified accounts with known OTPs for the fanout
+    scenario. The codes are `otp` rows, which the server reads with OTP_STORAGE_URL=database.
+    """
+    from apps.models import OTP, User
+
+    with app.app_context():
+        ids = seed_users(scenario['users'])
+        connect_pairs(zip(ids[0::2], ids[1::2]))
+        pending = []
+        for n in range(scenario['new_users']):
+            user_id = ids[-1] + 1 + n
+            email = f'newbench{user_id}@example.com'
+            insert_rows(User.__table__, [{'id': user_id, 'email': email, 'name': f'newbench{user_id}',
+                                          'name_normalized': f'newbench{user_id}', 'password_hash': '!',
+                                          'verified': False, 'created_at': datetime.utcnow()}])
+            insert_rows(OTP.__table__, [{'user_id': user_id, 'code': '0000', 'purpose': 'verify_email',
+                                         'attempts': 0, 'expires_at': datetime.utcnow() + timedelta(hours=1)}])
+            pending.append(email)
+    partners = {}
+    for a, b in zip(ids[0::2], ids[1::2]):
+        partners[a], partners[b] = b, a
+    return ids, partners, pending
+
+
+def sample_memory(pid, samples, stop):
+    while not stop.is_set():
+        value = rss_mb(pid)
+        if value is not None:
+            samples.append(value)
+        stop.wait(0.5)
+
+
+def run(scenario_name, scenario, db_uri, transports, drain_timeout=30, config=None):
+    import requests
+
+    app = create_bench_app(db_uri)
+    ids, partners, pending = seed(app, scenario)
+    tokens = tokens_for(app, ids)
+
+    port = free_port()
+    command = [sys.executable, '-m', 'benchmarks.socket_load', 'serve', '--db', db_uri, '--port', str(port),
+               # The seeded codes live in the database, not in the server process's own store
+               '--config', json.dumps({'OTP_STORAGE_URL': 'database', **(config or {})})]
+    server = subprocess.Popen(command)
+    url = f"http://127.0.0.1:{port}"
+    harness = Harness(transports)
+    users = []
+    memory, stop_sampling = [], threading.Event()
+    try:
+        wait_for_port(port)
+        sampler = threading.Thread(target=sample_memory, args=(server.pid, memory, stop_sampling), daemon=True)
+        sampler.start()
+        rss_idle = rss_mb(server.pid)
+
+        connect_start = time.perf_counter()
+        users = [SimulatedUser(harness, user_id, tokens[user_id], partners.get(user_id)) for user_id in ids]
+        for user in users:
+            user.connect(url)
+        connect_seconds = time.perf_counter() - connect_start
+        rss_connected = rss_mb(server.pid)
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=user.run, args=(scenario,)) for user in users if user.partner_id]
+        for thread in threads:
+            thread.start()
+
+        for email in pending:
+            # Counted before the POST: receipts can arrive while it is still in flight
+            expected = len(harness.fanout_latencies) + len(users)
+            harness.fanout_started = time.perf_counter()
+            requests.post(f"{url}/api/verify-otp", json={'email': email, 'pin': '0000'}, timeout=30)
+            deadline = time.monotonic() + drain_timeout
+            while len(harness.fanout_latencies) < expected and time.monotonic() < deadline:
+                time.sleep(0.01)
+
+        for thread in threads:
+            thread.join()
+        sent_seconds = time.perf_counter() - start
+
+        # Wait for in-flight messages to arrive
+        deadline = time.monotonic() + drain_timeout
+        while harness.sent_at and time.monotonic() < deadline:
+            time.sleep(0.05)
+        duration = time.perf_counter() - start
+    finally:
+        for user in users:
+            user.close()
+        stop_sampling.set()
+        server.terminate()
+        server.wait(timeout=10)
+
+    expected_messages = sum(scenario['messages_per_user'] for user in users if user.partner_id)
+    return {
+        'scenario': scenario_name,
+        'users': len(users),
+        'connect_seconds': round(connect_seconds, 3),
+        'duration_seconds': round(duration, 3),
+        'message_latency': percentiles(harness.latencies),
+        'messages_lost': expected_messages - len(harness.latencies),
+        'fanout_latency': percentiles(harness.fanout_latencies),
+        'events_sent_per_sec': round(harness.events_sent / sent_seconds, 1) if sent_seconds else None,
+        'events_received_per_sec': round(harness.events_received / duration, 1) if duration else None,
+        'server_rss_mb': {'idle': rss_idle, 'connected': rss_connected, 'peak': max(memory, default=None)},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Socket.IO load harness")
+    parser.add_argument('mode', nargs='?', default='run', choices=['run', 'serve'])
+    parser.add_argument('--scenario', default='chat', choices=sorted(SCENARIOS))
+    parser.add_argument('--list', action='store_true', help="print the scenarios and exit")
+    parser.add_argument('--users', type=int, help="override the scenario's user count")
+    parser.add_argument('--messages', type=int, help="override messages per user")
+    parser.add_argument('--db', help="SQLAlchemy URI (default: a fresh SQLite file)")
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--config', type=json.loads, help="serve: JSON object of app config overrides")
+    parser.add_argument('--routing', choices=['chat_room', 'user_rooms'],
+                        help="MESSAGE_ROUTING for the server (default: the app's)")
+    parser.add_argument('--transport', default='polling', choices=['polling', 'websocket'],
+                        help="websocket needs the websocket-client package")
+    parser.add_argument('--out', help="result file (default: benchmarks/results/...)")
+    args = parser.parse_args()
+
+    if args.mode == 'serve':
+        serve(args.db, args.port, args.config)
+        return
+    if args.list:
+        for name, scenario in SCENARIOS.items():
+            print(f"{name}: {scenario}")
+        return
+
+    scenario = dict(SCENARIOS[args.scenario])
+    if args.users:
+        scenario['users'] = args.users
+    if args.messages is not None:
+        scenario['messages_per_user'] = args.messages
+    db_uri = args.db or default_db_uri()
+
+    config = {'MESSAGE_ROUTING': args.routing} if args.routing else None
+    results = run(args.scenario, scenario, db_uri, [args.transport], config=config)
+    out = write_results(f'socket-{args.scenario}', dict(scenario, db=db_uri.split('://')[0],
+                                                        transport=args.transport, routing=args.routing),
+                        results, args.out)
+    for key, value in results.items():
+        print(f"{key:>24}: {value}")
+    print(f"\nresults written to {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""message archive table for cold history
+
+Revision ID: 5c1e7a2f9b40
+Revises: 939b595d6ab0
+Create Date: 2026-10-19 10:05:12.418204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c1e7a2f9b40'
+down_revision = '939b595d6ab0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('message_archive',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.Column('sender_id', sa.Integer(), nullable=False),
+    sa.Column('receiver_id', sa.Integer(), nullable=False),
+    sa.Column('content', sa.String(length=512), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('is_edited', sa.Boolean(), nullable=True),
+    sa.Column('is_deleted_for_everyone', sa.Boolean(), nullable=True),
+    sa.Column('is_deleted_for_sender', sa.Boolean(), nullable=True),
+    sa.Column('is_deleted_for_recipient', sa.Boolean(), nullable=True),
+    sa.Column('media_url', sa.String(length=512), nullable=True),
+    sa.Column('media_type', sa.String(length=50), nullable=True),
+    sa.ForeignKeyConstraint(['receiver_id'], ['user.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['sender_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('message_archive', schema=None) as batch_op:
+        batch_op.create_index('ix_message_archive_pair_ts', ['sender_id', 'receiver_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('message_archive', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_archive_pair_ts')
+
+    op.drop_table('message_archive')
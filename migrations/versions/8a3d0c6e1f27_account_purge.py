@@ -0,0 +1,44 @@
+"""account tombstones and background purge progress
+
+Revision ID: 8a3d0c6e1f27
+Revises: 5c1e7a2f9b40
+Create Date: 2026-10-19 10:48:37.902115
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8a3d0c6e1f27'
+down_revision = '5c1e7a2f9b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('account_purge',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('stage', sa.String(length=50), nullable=False),
+    sa.Column('rows_deleted', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('account_purge', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_account_purge_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('deleted_at')
+
+    with op.batch_alter_table('account_purge', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_account_purge_user_id'))
+
+    op.drop_table('account_purge')
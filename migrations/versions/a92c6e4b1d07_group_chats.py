@@ -0,0 +1,71 @@
+"""group chats
+
+Revision ID: a92c6e4b1d07
+Revises: 3f8b2d7c4a61
+Create Date: 2026-10-19 17:41:09.362514
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a92c6e4b1d07'
+down_revision = '3f8b2d7c4a61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('chat_group',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('description', sa.String(length=500), nullable=True),
+    sa.Column('image_url', sa.String(length=512), nullable=True),
+    sa.Column('created_by', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('last_message_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['created_by'], ['user.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('group_member',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('role', sa.String(length=20), nullable=False),
+    sa.Column('joined_at', sa.DateTime(), nullable=True),
+    sa.Column('last_read_message_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['group_id'], ['chat_group.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('group_id', 'user_id', name='_group_member_uc')
+    )
+    with op.batch_alter_table('group_member', schema=None) as batch_op:
+        batch_op.create_index('ix_group_member_user_id', ['user_id'], unique=False)
+
+    op.create_table('group_message',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('group_id', sa.Integer(), nullable=False),
+    sa.Column('sender_id', sa.Integer(), nullable=False),
+    sa.Column('content_bin', sa.LargeBinary(), nullable=True),
+    sa.Column('timestamp', sa.DateTime(), nullable=True),
+    sa.Column('media_url', sa.String(length=512), nullable=True),
+    sa.Column('media_type', sa.String(length=50), nullable=True),
+    sa.ForeignKeyConstraint(['group_id'], ['chat_group.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['sender_id'], ['user.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('group_message', schema=None) as batch_op:
+        batch_op.create_index('ix_group_message_group_id_id', ['group_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('group_message', schema=None) as batch_op:
+        batch_op.drop_index('ix_group_message_group_id_id')
+
+    op.drop_table('group_message')
+    with op.batch_alter_table('group_member', schema=None) as batch_op:
+        batch_op.drop_index('ix_group_member_user_id')
+
+    op.drop_table('group_member')
+    op.drop_table('chat_group')
@@ -0,0 +1,26 @@
+"""index friend requests by receiver for suggestion anti-joins
+
+Revision ID: b7e24f1a93c5
+Revises: 8a3d0c6e1f27
+Create Date: 2026-10-19 11:32:05.117630
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e24f1a93c5'
+down_revision = '8a3d0c6e1f27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('friend_request', schema=None) as batch_op:
+        batch_op.create_index('ix_friend_request_receiver_sender', ['receiver_id', 'sender_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('friend_request', schema=None) as batch_op:
+        batch_op.drop_index('ix_friend_request_receiver_sender')
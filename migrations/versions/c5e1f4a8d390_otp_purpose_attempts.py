@@ -0,0 +1,30 @@
+"""otp purpose, attempts and user_id index
+
+Revision ID: c5e1f4a8d390
+Revises: a92c6e4b1d07
+Create Date: 2026-10-19 19:12:44.108235
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e1f4a8d390'
+down_revision = 'a92c6e4b1d07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('otp', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('purpose', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('attempts', sa.Integer(), server_default='0', nullable=False))
+        batch_op.create_index('ix_otp_user_id', ['user_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('otp', schema=None) as batch_op:
+        batch_op.drop_index('ix_otp_user_id')
+        batch_op.drop_column('attempts')
+        batch_op.drop_column('purpose')
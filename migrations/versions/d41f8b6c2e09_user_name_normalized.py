@@ -0,0 +1,34 @@
+"""normalized username column for prefix search
+
+Revision ID: d41f8b6c2e09
+Revises: b7e24f1a93c5
+Create Date: 2026-10-19 12:04:51.730488
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41f8b6c2e09'
+down_revision = 'b7e24f1a93c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('name_normalized', sa.String(length=120), nullable=True))
+
+    # Backfill with the same normalization as apps.models.normalize_name
+    user = sa.table('user', sa.column('name', sa.String), sa.column('name_normalized', sa.String))
+    op.execute(user.update().values(name_normalized=sa.func.lower(user.c.name)))
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_name_normalized'), ['name_normalized'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_name_normalized'))
+        batch_op.drop_column('name_normalized')
@@ -0,0 +1,38 @@
+"""change log for delta sync
+
+Revision ID: e6a9c3d5b812
+Revises: d41f8b6c2e09
+Create Date: 2026-10-19 13:17:42.554901
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a9c3d5b812'
+down_revision = 'd41f8b6c2e09'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_log',
+    sa.Column('id', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=30), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_change_log_created_at'), ['created_at'], unique=False)
+        batch_op.create_index('ix_change_log_user_id_id', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_change_log_user_id_id')
+        batch_op.drop_index(batch_op.f('ix_change_log_created_at'))
+
+    op.drop_table('change_log')
@@ -0,0 +1,89 @@
+"""
+Replica routing (apps/db_routing.py) with two SQLite files standing in for the primary
+and a replica. Both hold the same schema but different rows, so a search result shows
+which database served it.
+"""
+import time
+from datetime import timedelta
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from apps import db_routing
+from apps.models import db, User
+from apps.routes import create_app
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'primary.db'}",
+        'SQLALCHEMY_BINDS': db_routing.replica_binds_from_env(f"sqlite:///{tmp_path / 'replica.db'}"),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        'SQLALCHEMY_REPLICA_STICKY_SECONDS': 0.2,
+        'SECRET_KEY': 'test', 'JWT_SECRET_KEY': 'test-jwt', 'TESTING': True,
+        'JWT_ACCESS_TOKEN_EXPIRES': timedelta(hours=1),
+    })
+    with app.app_context():
+        db.create_all()
+        db.metadata.create_all(db.engines['replica_0'])
+        for engine, other in ((db.engine, 'bob_primary'), (db.engines['replica_0'], 'bob_replica')):
+            with engine.begin() as conn:
+                conn.execute(User.__table__.insert(), [
+                    {'id': 1, 'name': 'alice', 'name_normalized': 'alice', 'email': 'alice@example.com',
+                     'password_hash': 'x', 'verified': True},
+                    {'id': 2, 'name': other, 'name_normalized': other, 'email': f'{other}@example.com',
+                     'password_hash': 'x', 'verified': True},
+                ])
+    db_routing._recent_writers.clear()
+    yield app
+    db_routing._recent_writers.clear()
+
+
+@pytest.fixture
+def search(app):
+    with app.app_context():
+        token = create_access_token(identity='1')
+    client = app.test_client()
+
+    def search(params=None, headers=None):
+        response = client.get('/api/users/search', query_string={'q': 'bob', **(params or {})},
+                              headers={'Authorization': f'Bearer {token}', **(headers or {})})
+        assert response.status_code == 200
+        return [user['name'] for user in response.json['users']]
+    return search
+
+
+def test_read_replica_view_reads_the_replica(search):
+    assert search() == ['bob_replica']
+
+
+def test_strong_consistency_reads_the_primary(search):
+    assert search(params={'consistency': 'strong'}) == ['bob_primary']
+    assert search(headers={'X-Read-Consistency': 'strong'}) == ['bob_primary']
+    assert search() == ['bob_replica']
+
+
+def test_recent_writer_reads_the_primary_until_the_window_passes(search):
+    db_routing.note_write(1)
+    assert search() == ['bob_primary']
+    time.sleep(0.25)
+    assert search() == ['bob_replica']
+
+
+def test_other_users_writes_do_not_pin_the_reader(search):
+    db_routing.note_write(2)
+    assert search() == ['bob_replica']
+
+
+def test_views_without_the_decorator_use_the_primary(app):
+    with app.test_request_context():
+        assert db.session.get(User, 2).name == 'bob_primary'
+
+
+def test_writers_past_the_window_are_forgotten(app):
+    with app.app_context():
+        db_routing.note_write(1, 2)
+        time.sleep(0.25)
+        db_routing.note_write(3)
+    assert list(db_routing._recent_writers) == [3]